@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import gzip
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import requests
+from contextlib import contextmanager
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CONFIG_PATH = os.path.join(REPO_DIR, "configurations", "config.json")
+DEFAULT_STORE_PATH = "./cache/artifacts"
+DEFAULT_MAX_BYTES = 200 * 1024 ** 3
+# Entries used within this many seconds are never evicted, another process may be reading them
+DEFAULT_MIN_AGE = 600
+MANIFEST_FILE = "manifest.sqlite"
+# Overrides the configured store path, e.g. for ChimeraX instances started by segment_driver.py
+STORE_ENV = "ARTIFACT_STORE_PATH"
+DEFAULT_RCSB_FILES_URL = "https://files.rcsb.org/download"
+DEFAULT_EMDB_FILES_URL = "https://ftp.ebi.ac.uk/pub/databases/emdb/structures"
+REQUEST_TIMEOUT = 60
+
+
+def load_config():
+    try:
+        with open(CONFIG_PATH, "r") as config_file:
+            return json.load(config_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def emdb_number(emdb_id):
+    return emdb_id.upper().replace("EMD-", "")
+
+
+class ArtifactStore:
+    """
+    Local store of downloaded structures (PDB/<id>.cif) and maps (EMDB/emd_<n>.map.gz).
+
+    A manifest (SQLite, safe to share between processes) records the size, sha256, source
+    URL and last access time of every file. Files are checksummed when they are stored and
+    verified again on their first reuse by this instance (later hits only compare size and
+    mtime), and a mismatching file is downloaded again. Instead of deleting
+    files after use, the least recently used entries are evicted once the store grows beyond
+    max_bytes.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, verify=True, min_age=DEFAULT_MIN_AGE,
+                 rcsb_files_url=DEFAULT_RCSB_FILES_URL, emdb_files_url=DEFAULT_EMDB_FILES_URL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.min_age = min_age
+        self.rcsb_files_url = rcsb_files_url.rstrip("/")
+        self.emdb_files_url = emdb_files_url.rstrip("/")
+        self._session = None
+        # key -> (size, mtime_ns) of the files whose checksum matched, so each is hashed once per run
+        self._verified = {}
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts (key TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "sha256 TEXT NOT NULL, url TEXT, stored_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+
+    @classmethod
+    def from_config(cls, root=None):
+        config = load_config()
+        store = config.get("artifact_store", {})
+        root = root or os.environ.get(STORE_ENV) or store.get("path", DEFAULT_STORE_PATH)
+        if not os.path.isabs(root):
+            root = os.path.normpath(os.path.join(REPO_DIR, root))
+        return cls(
+            root,
+            max_bytes=int(store.get("max_gb", DEFAULT_MAX_BYTES / 1024 ** 3) * 1024 ** 3),
+            verify=store.get("verify_checksums", True),
+            rcsb_files_url=config.get("rcsb_files_base_url", DEFAULT_RCSB_FILES_URL),
+            emdb_files_url=config.get("emdb_files_base_url", DEFAULT_EMDB_FILES_URL),
+        )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(os.path.join(self.root, MANIFEST_FILE), timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def record(self, key):
+        with self._connect() as db:
+            row = db.execute("SELECT size, sha256, url, last_access FROM artifacts WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("size", "sha256", "url", "last_access"), row))
+
+    def lookup(self, key):
+        """Return the path of a stored, intact entry and mark it as used, otherwise None."""
+        record = self.record(key)
+        path = self.path(key)
+        if record is None or not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if stat.st_size != record["size"] or (self.verify and self._verified.get(key) != signature
+                                              and sha256_file(path) != record["sha256"]):
+            print(f"Checksum mismatch for {key}, fetching it again")
+            self.remove(key)
+            return None
+        self._verified[key] = signature
+        with self._connect() as db:
+            db.execute("UPDATE artifacts SET last_access = ? WHERE key = ?", (time.time(), key))
+        return path
+
+    def add(self, key, source_path, url=None):
+        """Move source_path into the store as key and record it in the manifest."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = sha256_file(source_path)
+        size = os.path.getsize(source_path)
+        os.replace(source_path, path)
+        stat = os.stat(path)
+        self._verified[key] = (stat.st_size, stat.st_mtime_ns)
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO artifacts (key, size, sha256, url, stored_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, size, digest, url, now, now),
+            )
+        self.evict()
+        return path
+
+    def download(self, key, url):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f, self.session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                response.raise_for_status()
+                for block in response.iter_content(1 << 20):
+                    f.write(block)
+            return self.add(key, tmp, url)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def fetch(self, key, url):
+        return self.lookup(key) or self.download(key, url)
+
+    def fetch_structure(self, pdb_id):
+        pdb_id = pdb_id.lower()
+        return self.fetch(f"PDB/{pdb_id}.cif", f"{self.rcsb_files_url}/{pdb_id}.cif")
+
+    def fetch_map(self, emdb_id, decompress=False):
+        """
+        Path of the gzipped map of emdb_id, downloaded on a miss. With decompress, the path of a
+        decompressed .map for readers that can not open or memory-map .map.gz. It is stored as its
+        own entry in place of the .map.gz, which is only fetched when the .map is not stored.
+        """
+        number = emdb_number(emdb_id)
+        gz_key = f"EMDB/emd_{number}.map.gz"
+        url = f"{self.emdb_files_url}/EMD-{number}/map/emd_{number}.map.gz"
+        if not decompress:
+            return self.fetch(gz_key, url)
+
+        key = f"EMDB/emd_{number}.map"
+        path = self.lookup(key)
+        if path:
+            return path
+        gz_path = self.fetch(gz_key, url)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(gz_path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f, gzip.open(gz_path, "rb") as gz:
+                shutil.copyfileobj(gz, f, 1 << 20)
+            path = self.add(key, tmp, url)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.remove(gz_key)
+        return path
+
+    def remove(self, key):
+        self._verified.pop(key, None)
+        with self._connect() as db:
+            db.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        with self._connect() as db:
+            return db.execute("SELECT key, size, last_access FROM artifacts ORDER BY last_access").fetchall()
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes=None):
+        """Delete least recently used entries until the store fits in max_bytes."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.min_age
+        for key, size, last_access in entries:
+            if total <= max_bytes:
+                break
+            if last_access > cutoff:
+                continue
+            self.remove(key)
+            total -= size
+            print(f"Evicted {key} from the artifact store")
+        return total
+
+    def verify_all(self):
+        """Check every entry against the manifest, removing missing or corrupt files."""
+        bad = []
+        for key, size, _ in self.entries():
+            path = self.path(key)
+            record = self.record(key)
+            if not os.path.isfile(path) or os.path.getsize(path) != size or sha256_file(path) != record["sha256"]:
+                bad.append(key)
+                self.remove(key)
+        return bad
+
+
+_default_store = None
+
+
+def default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = ArtifactStore.from_config()
+    return _default_store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and maintain the local structure/map store")
+    parser.add_argument("command", choices=["list", "verify", "evict"], help="Action to run on the store")
+    parser.add_argument("--store", default=None, help="Store directory (default from config.json)")
+    parser.add_argument("--max-gb", type=float, default=None, help="Size bound of evict (default from config.json)")
+    args = parser.parse_args()
+
+    store = ArtifactStore.from_config(args.store)
+    if args.command == "list":
+        for key, size, last_access in store.entries():
+            print(f"{key}\t{size / 1024 ** 2:.1f} MB\t{time.strftime('%Y-%m-%d %H:%M', time.localtime(last_access))}")
+        print(f"{store.total_bytes() / 1024 ** 3:.2f} GB in {store.root}")
+    elif args.command == "verify":
+        bad = store.verify_all()
+        print(f"Removed {len(bad)} corrupt or missing entries")
+        if bad:
+            sys.exit(1)
+    else:
+        store.min_age = 0
+        max_bytes = None if args.max_gb is None else int(args.max_gb * 1024 ** 3)
+        print(f"{store.evict(max_bytes) / 1024 ** 3:.2f} GB left in {store.root}")
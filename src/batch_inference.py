@@ -0,0 +1,187 @@
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import inference_single
+import volume_cache
+
+DEFAULT_BATCH_SIZE = 32
+PROB_COLUMNS = [f"prob_{label}" for label in inference_single.COARSE_LABELS]
+CSV_COLUMNS = ["path", "label"] + PROB_COLUMNS + ["error"]
+
+
+def list_inputs(source):
+    """
+    Maps to classify from a folder (searched recursively for .mrc), a glob pattern, a CSV
+    with a filepath (training CSVs) or map_path (segment_driver manifest) column, or a
+    text file with one path per line.
+    """
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "**", "*.mrc"), recursive=True))
+    if os.path.isfile(source) and source.lower().endswith(".csv"):
+        with open(source, newline="") as f:
+            rows = list(csv.DictReader(f))
+        column = "filepath" if rows and "filepath" in rows[0] else "map_path"
+        return [row[column] for row in rows if row.get(column) and row.get("status", "ok") == "ok"]
+    if os.path.isfile(source):
+        with open(source) as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return sorted(glob.glob(source, recursive=True))
+
+
+def default_threads(workers):
+    # Leave a core to every preprocessing worker
+    return max(1, (os.cpu_count() or 1) - workers)
+
+
+def preprocess(path, cache=None):
+    if cache is not None:
+        return np.array(cache.get(path))
+    return volume_cache.preprocess_volume(path)
+
+
+def _preprocess_in_worker(path):
+    return preprocess(path, volume_cache.worker_cache())
+
+
+def preprocessed(paths, workers=os.cpu_count(), cache_dir=None, window=None):
+    """
+    Preprocess paths in a pool of worker processes, at most `window` maps ahead of the
+    consumer, and yield (path, patch, error) in input order. workers=0 runs in process.
+    With a cache_dir every worker keeps one VolumeCache for all its maps.
+    """
+    cache = volume_cache.VolumeCache.from_config(cache_dir) if cache_dir else None
+    if workers == 0:
+        for path in paths:
+            try:
+                yield path, preprocess(path, cache), None
+            except Exception as e:
+                yield path, None, str(e)
+        return
+
+    window = window or 4 * workers
+    remaining = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers, initializer=volume_cache.init_worker, initargs=(cache,)) as pool:
+        pending = deque((path, pool.submit(_preprocess_in_worker, path)) for path in islice(remaining, window))
+        while pending:
+            path, future = pending.popleft()
+            for next_path in islice(remaining, 1):
+                pending.append((next_path, pool.submit(_preprocess_in_worker, next_path)))
+            try:
+                yield path, future.result(), None
+            except Exception as e:
+                yield path, None, str(e)
+
+
+class PredictionWriter:
+    """Streams predictions to a CSV, or to JSON lines if the output ends with .jsonl."""
+
+    def __init__(self, output_path):
+        self.jsonl = output_path.lower().endswith(".jsonl")
+        self.file = open(output_path, "w", newline="")
+        if not self.jsonl:
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_COLUMNS)
+            self.writer.writeheader()
+
+    def write(self, path, label=None, probs=None, error=None):
+        if self.jsonl:
+            record = {"path": path, "label": label, "error": error}
+            if probs is not None:
+                record["probabilities"] = dict(zip(inference_single.COARSE_LABELS, map(float, probs)))
+            self.file.write(json.dumps(record) + "\n")
+        else:
+            row = {"path": path, "label": label or "", "error": error or ""}
+            if probs is not None:
+                row.update({column: f"{p:.6f}" for column, p in zip(PROB_COLUMNS, probs)})
+            self.writer.writerow(row)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def classify_paths(paths, model, output_path, batch_size=DEFAULT_BATCH_SIZE, workers=os.cpu_count(),
+                   cache_dir=None, report_every=10):
+    """
+    Classify every map with an already loaded model. Patches are stacked into batches of
+    batch_size for one forward pass each, and every batch is written before the next one.
+    :return Number of classified maps and number of failures
+    """
+    done = failed = batches = 0
+    start = time.time()
+    with PredictionWriter(output_path) as writer:
+        batch_paths, batch = [], []
+
+        def flush_batch():
+            nonlocal done, batches
+            labels, probs = inference_single.classify_batch(np.stack(batch), model)
+            for path, label, p in zip(batch_paths, labels, probs):
+                writer.write(path, label, p)
+            writer.flush()
+            done += len(batch)
+            batches += 1
+            batch_paths.clear()
+            batch.clear()
+            if batches % report_every == 0:
+                print(f"[{done + failed}/{len(paths)}] {done / (time.time() - start):.1f} maps/sec")
+
+        for path, patch, error in preprocessed(paths, workers, cache_dir, window=2 * batch_size):
+            if error is not None:
+                print(f"Error processing {path}: {error}")
+                writer.write(path, error=error)
+                failed += 1
+                continue
+            batch_paths.append(path)
+            batch.append(patch)
+            if len(batch) == batch_size:
+                flush_batch()
+        if batch:
+            flush_batch()
+    return done, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify many motif maps with one model load")
+    parser.add_argument("checkpoint", help="Model weights (.pth)")
+    parser.add_argument("output", help="Predictions, .csv or .jsonl")
+    parser.add_argument("sources", nargs="+", help="Folders, glob patterns, CSV manifests or path lists")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Maps per forward pass")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Preprocessing worker processes")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads (default: cores left by workers)")
+    parser.add_argument("--cache-dir", default=None, help="Preprocessed volume cache (see volume_cache.py)")
+    args = parser.parse_args()
+
+    paths = []
+    for source in args.sources:
+        paths.extend(list_inputs(source))
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        print("No input maps found.")
+        sys.exit(1)
+
+    torch.set_num_threads(args.threads or default_threads(args.workers))
+    model = inference_single.load_model(args.checkpoint)
+    print(f"Classifying {len(paths)} maps, batch size {args.batch_size}, {args.workers} workers, "
+          f"{torch.get_num_threads()} torch threads")
+    start = time.time()
+    done, failed = classify_paths(paths, model, args.output, args.batch_size, args.workers, args.cache_dir)
+    print(f"Classified {done} maps ({failed} failed) in {time.time() - start:.0f}s -> {args.output}")
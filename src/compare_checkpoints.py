@@ -0,0 +1,123 @@
+import os
+import re
+import sys
+import csv
+import glob
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import inference_single
+from batch_inference import preprocessed
+from validate_folder import COARSE_LABELS, LABEL_TO_IDX, RunningMetrics, list_class_files
+
+TABLE_COLUMNS = (["checkpoint", "accuracy", "macro_sensitivity", "macro_specificity"]
+                 + [f"{label}_{metric}" for label in COARSE_LABELS for metric in ("sensitivity", "specificity")])
+
+
+def natural_key(path):
+    # label_less_classifier_epoch10.pth sorts after label_less_classifier_epoch9.pth
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+def expand_checkpoints(patterns):
+    checkpoints = []
+    for pattern in patterns:
+        checkpoints.extend(sorted(glob.glob(pattern), key=natural_key) if glob.has_magic(pattern) else [pattern])
+    return list(dict.fromkeys(checkpoints))
+
+
+def load_patches(files, workers=os.cpu_count(), cache_dir=None):
+    """
+    Preprocess (path, label) files once into one (n, 64, 64, 64) array.
+    :return patches, true class indexes and the paths that could be preprocessed
+    """
+    truths = dict(files)
+    paths, labels, patches = [], [], []
+    for path, patch, error in preprocessed([path for path, _ in files], workers, cache_dir):
+        if error is not None:
+            print(f"Error processing {path}: {error}")
+            continue
+        paths.append(path)
+        labels.append(LABEL_TO_IDX[truths[path]])
+        patches.append(patch)
+    if not patches:
+        return np.empty((0, 64, 64, 64), dtype=np.float32), np.empty(0, dtype=int), []
+    return np.stack(patches), np.array(labels), paths
+
+
+def evaluate_checkpoint(model, patches, y_true, batch_size=32):
+    metrics = RunningMetrics()
+    for start in range(0, len(patches), batch_size):
+        labels, _ = inference_single.classify_batch(patches[start:start + batch_size], model)
+        metrics.update(y_true[start:start + batch_size], [LABEL_TO_IDX[label] for label in labels])
+    return metrics
+
+
+def metrics_row(checkpoint, metrics):
+    macro_sens, macro_spec = metrics.macro()
+    row = {"checkpoint": checkpoint, "accuracy": metrics.accuracy(), "macro_sensitivity": macro_sens,
+           "macro_specificity": macro_spec}
+    for label, m in metrics.per_class().items():
+        row[f"{label}_sensitivity"] = m["sensitivity"]
+        row[f"{label}_specificity"] = m["specificity"]
+    return row
+
+
+def compare_checkpoints(checkpoints, patches, y_true, batch_size=32, output_csv=None):
+    """
+    Evaluate every checkpoint on the same preprocessed patches.
+    :return One TABLE_COLUMNS row per checkpoint, also written to output_csv if given
+    """
+    rows = []
+    for checkpoint in checkpoints:
+        start = time.time()
+        try:
+            model = inference_single.load_model(checkpoint)
+        except Exception as e:
+            print(f"Could not load {checkpoint}: {e}")
+            continue
+        row = metrics_row(checkpoint, evaluate_checkpoint(model, patches, y_true, batch_size))
+        rows.append(row)
+        print(f"{os.path.basename(checkpoint):40s} accuracy {row['accuracy']:.3f} "
+              f"macro sensitivity {row['macro_sensitivity']:.3f} macro specificity {row['macro_specificity']:.3f} "
+              f"({time.time() - start:.1f}s)")
+
+    if output_csv:
+        with open(output_csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+            writer.writeheader()
+            writer.writerows({key: f"{value:.4f}" if isinstance(value, float) else value
+                              for key, value in row.items()} for row in rows)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate many checkpoints on one preprocessed test folder")
+    parser.add_argument("folder_path", help="Folder with one sub-folder of .mrc files per class")
+    parser.add_argument("checkpoints", nargs="+", help="Checkpoints or glob patterns, e.g. 'SET1/*.pth'")
+    parser.add_argument("--output", default="checkpoint_comparison.csv", help="Comparison table (CSV)")
+    parser.add_argument("--cache-dir", default=None, help="Preprocessed volume cache (see volume_cache.py)")
+    parser.add_argument("--max-per-class", type=int, default=90, help="Files sampled from every class")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the per-class sampling")
+    parser.add_argument("--batch-size", type=int, default=32, help="Files per forward pass")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Preprocessing worker processes")
+    args = parser.parse_args()
+
+    checkpoints = expand_checkpoints(args.checkpoints)
+    files = list_class_files(args.folder_path, args.max_per_class, args.seed)
+    if not checkpoints or not files:
+        print("No checkpoints or no .mrc files found.")
+        sys.exit(1)
+
+    start = time.time()
+    patches, y_true, _ = load_patches(files, args.workers, args.cache_dir)
+    print(f"Preprocessed {len(patches)} of {len(files)} files once in {time.time() - start:.0f}s "
+          f"({patches.nbytes / 1024 ** 2:.0f} MB), evaluating {len(checkpoints)} checkpoints\n")
+
+    rows = compare_checkpoints(checkpoints, patches, y_true, args.batch_size, args.output)
+    if rows:
+        best = max(rows, key=lambda row: (row["accuracy"], row["macro_sensitivity"]))
+        print(f"\nBest: {best['checkpoint']} (accuracy {best['accuracy']:.3f}), table written to {args.output}")
@@ -0,0 +1,71 @@
+import os
+import socket
+from collections import namedtuple
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+# Rank of this process, number of processes and their number on this node, as set by torchrun
+DistributedContext = namedtuple("DistributedContext", ["rank", "world_size", "local_rank", "local_world_size"])
+SINGLE_PROCESS = DistributedContext(0, 1, 0, 1)
+
+
+def env_context():
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size == 1:
+        return SINGLE_PROCESS
+    return DistributedContext(int(os.environ["RANK"]), world_size, int(os.environ.get("LOCAL_RANK", 0)),
+                              int(os.environ.get("LOCAL_WORLD_SIZE", world_size)))
+
+
+def init_distributed(backend="gloo", threads=None):
+    """
+    Join the process group described by the torchrun environment (RANK, WORLD_SIZE,
+    MASTER_ADDR, MASTER_PORT). A plain `python train.py` run stays single-process.
+    torchrun limits every process to one OpenMP thread, so the intra-op threads are
+    set to the cores of the node shared by its processes unless threads is given.
+    """
+    context = env_context()
+    if context.world_size == 1:
+        return context
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend, rank=context.rank, world_size=context.world_size)
+    torch.set_num_threads(threads or max(1, (os.cpu_count() or 1) // context.local_world_size))
+    return context
+
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def all_reduce_sum(values):
+    # Sum a list of numbers over all processes, returned unchanged when not distributed
+    if not dist.is_initialized():
+        return list(values)
+    t = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t.tolist()
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _local_worker(local_rank, nproc, port, fn, args, kwargs):
+    os.environ.update({
+        "RANK": str(local_rank), "LOCAL_RANK": str(local_rank), "WORLD_SIZE": str(nproc),
+        "LOCAL_WORLD_SIZE": str(nproc), "MASTER_ADDR": "127.0.0.1", "MASTER_PORT": str(port),
+    })
+    fn(*args, **kwargs)
+
+
+def launch_local(fn, nproc, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) in nproc processes on this machine with the environment torchrun would
+    set up, e.g. to try the DDP mode of train.py without torchrun. fn must be importable by the
+    spawned processes.
+    """
+    mp.spawn(_local_worker, args=(nproc, find_free_port(), fn, args, kwargs), nprocs=nproc, join=True)
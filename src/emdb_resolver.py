@@ -0,0 +1,227 @@
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import argparse
+import requests
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CONFIG_PATH = os.path.join(REPO_DIR, "configurations", "config.json")
+DEFAULT_BASE_URL = "https://data.rcsb.org/rest/v1/core/entry"
+DEFAULT_CACHE_PATH = "./cache/emdb_ids.sqlite"
+DEFAULT_TTL_DAYS = 30
+DEFAULT_WORKERS = 8
+REQUEST_TIMEOUT = 30
+# Any non-empty value other than 0/false serves lookups from the cache only
+OFFLINE_ENV = "EMDB_RESOLVER_OFFLINE"
+
+
+def load_config():
+    try:
+        with open(CONFIG_PATH, "r") as config_file:
+            return json.load(config_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def env_offline():
+    return os.environ.get(OFFLINE_ENV, "").lower() not in ("", "0", "false", "no")
+
+
+class ResolverError(Exception):
+    # Network or API failure, the result must not be cached
+    pass
+
+
+class EMDBResolver:
+    """
+    Resolves PDB ids to EMDB ids with the RCSB entry API.
+
+    Results, including entries without an EMDB reference, are cached in an SQLite
+    file shared by all processes and expire after ttl seconds. Requests go through one
+    pooled keep-alive session, and prefetch() resolves many ids with at most `workers`
+    concurrent requests. In offline mode lookups are served from the cache only, even
+    if the cached result has expired.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL_DAYS * 86400, base_url=DEFAULT_BASE_URL,
+                 offline=False, workers=DEFAULT_WORKERS, timeout=REQUEST_TIMEOUT):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.base_url = base_url.rstrip("/")
+        self.offline = offline
+        self.workers = workers
+        self.timeout = timeout
+        self._session = None
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS emdb_ids "
+                "(pdb_id TEXT PRIMARY KEY, emdb_id TEXT, fetched_at REAL NOT NULL)"
+            )
+
+    @classmethod
+    def from_config(cls, cache_path=None, offline=None):
+        config = load_config()
+        resolver = config.get("emdb_resolver", {})
+        cache_path = cache_path or resolver.get("cache_path", DEFAULT_CACHE_PATH)
+        if not os.path.isabs(cache_path):
+            # Relative to the repository, so every script and working directory shares one cache
+            cache_path = os.path.normpath(os.path.join(REPO_DIR, cache_path))
+        if offline is None:
+            offline = resolver.get("offline", False) or env_offline()
+        return cls(
+            cache_path,
+            ttl=resolver.get("ttl_days", DEFAULT_TTL_DAYS) * 86400,
+            base_url=config.get("rcsb_api_base_url", DEFAULT_BASE_URL),
+            offline=offline,
+            workers=resolver.get("workers", DEFAULT_WORKERS),
+        )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.cache_path, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers, max_retries=2)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        return self._session
+
+    def cached(self, pdb_ids):
+        """Return {pdb_id: (emdb_id, fetched_at)} of the cached ids."""
+        keys = [pdb_id.upper() for pdb_id in pdb_ids]
+        found = {}
+        with self._connect() as db:
+            # Stay below SQLite's bound parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = db.execute(
+                    f"SELECT pdb_id, emdb_id, fetched_at FROM emdb_ids WHERE pdb_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                found.update((pdb_id, (emdb_id, fetched_at)) for pdb_id, emdb_id, fetched_at in rows)
+        return found
+
+    def store(self, results):
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO emdb_ids (pdb_id, emdb_id, fetched_at) VALUES (?, ?, ?)",
+                [(pdb_id.upper(), emdb_id, now) for pdb_id, emdb_id in results.items()],
+            )
+
+    def fresh(self, fetched_at):
+        return self.offline or time.time() - fetched_at < self.ttl
+
+    def fetch(self, pdb_id):
+        url = f"{self.base_url}/{pdb_id.lower()}"
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ResolverError(f"Error retrieving EMDB ID for {pdb_id}: {e}")
+        if response.status_code == 404:
+            print(f"RCSB API error for PDB {pdb_id}: {response.status_code}")
+            return None
+        if response.status_code != 200:
+            raise ResolverError(f"RCSB API error for PDB {pdb_id}: {response.status_code}")
+
+        try:
+            entry = response.json()
+        except ValueError as e:
+            # e.g. an HTML error page from a proxy, transient like a network error
+            raise ResolverError(f"Invalid RCSB API response for PDB {pdb_id}: {e}")
+        references = entry.get("rcsb_external_references", []) if isinstance(entry, dict) else []
+        for ref in references:
+            if ref.get("id", "").startswith("EMD"):
+                return ref["id"]
+        print(f"No EMDB reference found for {pdb_id}")
+        return None
+
+    def prefetch(self, pdb_ids):
+        """
+        Resolve all pdb_ids, fetching the missing or expired ones concurrently.
+        :return {PDB_ID: emdb_id or None}, ids that could not be resolved map to None
+        """
+        keys = list(dict.fromkeys(pdb_id.upper() for pdb_id in pdb_ids))
+        cached = self.cached(keys)
+        results = {key: cached[key][0] for key in keys if key in cached and self.fresh(cached[key][1])}
+        missing = [key for key in keys if key not in results]
+
+        if missing and self.offline:
+            print(f"Offline: {len(missing)} PDB ids are not in the EMDB id cache")
+        elif missing:
+            fetched = {}
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for key, future in [(key, pool.submit(self.fetch, key)) for key in missing]:
+                    try:
+                        fetched[key] = future.result()
+                    except ResolverError as e:
+                        print(e)
+                        if key in cached:
+                            # Fall back to the expired entry rather than failing the lookup
+                            results[key] = cached[key][0]
+            self.store(fetched)
+            results.update(fetched)
+
+        return {key: results.get(key) for key in keys}
+
+    def resolve(self, pdb_id):
+        return self.prefetch([pdb_id])[pdb_id.upper()]
+
+
+_default_resolver = None
+
+
+def default_resolver():
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = EMDBResolver.from_config()
+    return _default_resolver
+
+
+#Return EMDB ID for a given PDB ID using RCSB API.
+def get_emdb_id_from_pdb(pdb_id):
+    return default_resolver().resolve(pdb_id)
+
+
+def prefetch_emdb_ids(pdb_ids):
+    return default_resolver().prefetch(pdb_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolve PDB ids to EMDB ids and fill the resolver cache")
+    parser.add_argument("inputs", nargs="+", help="PDB ids or CSV files with a pdb column")
+    parser.add_argument("--cache", default=None, help="SQLite cache file (default from config.json)")
+    parser.add_argument("--offline", action="store_true", help="Only read from the cache")
+    args = parser.parse_args()
+
+    pdb_ids = []
+    for item in args.inputs:
+        if os.path.isfile(item):
+            with open(item, newline="") as csvfile:
+                pdb_ids.extend(row["pdb"].strip() for row in csv.DictReader(csvfile))
+        else:
+            pdb_ids.append(item)
+
+    resolver = EMDBResolver.from_config(args.cache, offline=args.offline or None)
+    start = time.time()
+    results = resolver.prefetch(pdb_ids)
+    for pdb_id, emdb_id in results.items():
+        print(f"{pdb_id},{emdb_id or ''}")
+    resolved = sum(emdb_id is not None for emdb_id in results.values())
+    print(f"Resolved {resolved}/{len(results)} PDB ids in {time.time() - start:.1f}s", file=sys.stderr)
@@ -0,0 +1,263 @@
+import io
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import inference_single
+import volume_cache
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "configurations", "config.json")
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 16
+DEFAULT_MAX_WAIT_MS = 10
+LATENCY_WINDOW = 10000
+
+
+def load_config():
+    try:
+        with open(CONFIG_PATH, "r") as config_file:
+            return json.load(config_file)
+    except (OSError, ValueError):
+        return {}
+
+
+class Metrics:
+    """Request latencies (last LATENCY_WINDOW requests), batch sizes and throughput since start."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = self.errors = self.samples = self.batches = self.batched = 0
+        self.batch_seconds = 0.0
+
+    def record_request(self, seconds, samples, ok=True):
+        with self.lock:
+            self.requests += 1
+            self.errors += not ok
+            self.samples += samples
+            self.latencies.append(seconds)
+
+    def record_batch(self, size, seconds):
+        with self.lock:
+            self.batches += 1
+            self.batch_seconds += seconds
+            self.batched += size
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.time() - self.start
+            latencies = np.array(self.latencies) * 1000
+            snapshot = {
+                "uptime_s": round(uptime, 3),
+                "requests": self.requests,
+                "errors": self.errors,
+                "samples": self.samples,
+                "batches": self.batches,
+                "mean_batch_size": round(self.batched / self.batches, 3) if self.batches else 0,
+                "mean_batch_ms": round(1000 * self.batch_seconds / self.batches, 3) if self.batches else 0,
+                "samples_per_s": round(self.samples / uptime, 3) if uptime > 0 else 0,
+            }
+        for name, q in (("p50", 50), ("p95", 95), ("p99", 99)):
+            snapshot[f"latency_{name}_ms"] = round(float(np.percentile(latencies, q)), 3) if latencies.size else 0
+        return snapshot
+
+
+class MicroBatcher:
+    """
+    Collects submitted patches for up to max_wait seconds or max_batch patches, whichever
+    comes first, and classifies them in one forward pass on a single model thread.
+    """
+
+    def __init__(self, model, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT_MS / 1000, metrics=None):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.metrics = metrics or Metrics()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, patch):
+        """:return Future of (label, probabilities)"""
+        future = Future()
+        self.queue.put((patch, future))
+        return future
+
+    def _collect(self):
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, stop on the next call
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            patches, futures = zip(*batch)
+            start = time.perf_counter()
+            try:
+                labels, probs = inference_single.classify_batch(np.stack(patches), self.model)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.metrics.record_batch(len(batch), time.perf_counter() - start)
+            for future, label, p in zip(futures, labels, probs):
+                future.set_result((label, p))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def result_record(label, probs):
+    return {"label": label, "probabilities": dict(zip(inference_single.COARSE_LABELS, map(float, probs)))}
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """
+    POST /classify with a JSON body {"path": ...} or {"paths": [...]} of MRC files readable by
+    the server, with the bytes of an MRC file (application/octet-stream), or with a
+    preprocessed 64^3 float32 patch saved by numpy.save (application/x-npy).
+    GET /metrics and GET /health.
+    """
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.send_json(200, self.server.metrics.snapshot())
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/classify":
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "application/json").split(";")[0].strip()
+        try:
+            if content_type == "application/json":
+                request = json.loads(body or b"{}")
+                single = "paths" not in request
+                patches = [self.server.preprocess_path(path) for path in
+                           ([request["path"]] if single else request["paths"])]
+            elif content_type == "application/octet-stream":
+                single, patches = True, [volume_cache.preprocess_mrc_bytes(body)]
+            elif content_type == "application/x-npy":
+                single, patches = True, [self.server.check_patch(np.load(io.BytesIO(body), allow_pickle=False))]
+            else:
+                raise ValueError(f"Unsupported content type {content_type}")
+        except Exception as e:
+            self.server.metrics.record_request(time.perf_counter() - start, 0, ok=False)
+            self.send_json(400, {"error": str(e)})
+            return
+
+        results = [self.server.batcher.submit(patch) for patch in patches]
+        try:
+            results = [result_record(*future.result()) for future in results]
+        except Exception as e:
+            self.server.metrics.record_request(time.perf_counter() - start, 0, ok=False)
+            self.send_json(500, {"error": str(e)})
+            return
+        self.server.metrics.record_request(time.perf_counter() - start, len(results))
+        self.send_json(200, results[0] if single else {"results": results})
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class InferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, model, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS, cache=None,
+                 verbose=False):
+        super().__init__(address, InferenceHandler)
+        self.metrics = Metrics()
+        self.batcher = MicroBatcher(model, max_batch, max_wait_ms / 1000, self.metrics)
+        self.cache = cache
+        self.verbose = verbose
+
+    def preprocess_path(self, path):
+        if self.cache is not None:
+            return np.array(self.cache.get(path))
+        return volume_cache.preprocess_volume(path)
+
+    @staticmethod
+    def check_patch(patch):
+        size = volume_cache.PATCH_SIZE
+        if patch.shape != (size, size, size):
+            raise ValueError(f"Expected a {size}^3 patch, got shape {patch.shape}")
+        return patch.astype(np.float32, copy=False)
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+
+
+if __name__ == "__main__":
+    config = load_config().get("inference_server", {})
+    parser = argparse.ArgumentParser(description="Serve Motif3DCNN predictions over local HTTP")
+    parser.add_argument("checkpoint", help="Model weights (.pth)")
+    parser.add_argument("--host", default=config.get("host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=config.get("port", DEFAULT_PORT))
+    parser.add_argument("--max-batch", type=int, default=config.get("max_batch", DEFAULT_MAX_BATCH),
+                        help="Largest micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=config.get("max_wait_ms", DEFAULT_MAX_WAIT_MS),
+                        help="Longest wait for a micro-batch to fill")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads")
+    parser.add_argument("--cache-dir", default=None, help="Preprocessed volume cache for path requests")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = inference_single.load_model(args.checkpoint)
+    cache = volume_cache.VolumeCache.from_config(args.cache_dir) if args.cache_dir else None
+    server = InferenceServer((args.host, args.port), model, args.max_batch, args.max_wait_ms, cache, args.verbose)
+    print(f"Serving {args.checkpoint} on http://{args.host}:{server.server_port} "
+          f"(batches of up to {args.max_batch}, {args.max_wait_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
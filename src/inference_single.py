@@ -3,8 +3,9 @@ import numpy as np
 import mrcfile
 import sys
 import os
-import train
 import resample_mrc
+import model_runtime
+import volume_cache
 
 COARSE_LABELS = [
     "symmetricloop",
@@ -35,17 +36,15 @@ def safe_load_mrc(path):
     
 
 def center_crop_64(vol):
-    c = np.array(vol.shape) // 2
-    size = 64
-    half = size // 2
-    vol = np.pad(vol, size, mode="constant")
-    c += size
-    return vol[c[0]-half:c[0]+half,
-               c[1]-half:c[1]+half,
-               c[2]-half:c[2]+half]
+    return volume_cache.center_crop(vol, 64)
 
 
 def load_model(checkpoint_path):
+    # A TorchScript export of model_export.py is loaded without importing train
+    if model_runtime.is_torchscript(checkpoint_path):
+        return model_runtime.load_scripted(checkpoint_path)
+
+    import train
     model = train.Motif3DCNN(num_classes=NUM_CLASSES)
 
     # build model weights
@@ -57,18 +56,15 @@ def load_model(checkpoint_path):
     model.eval()
     return model
 
-def load_mrc_as_numpy(path):
-    tmp_out = "/tmp/infer_tmp.mrc"
+def load_mrc_as_numpy(path, cache=None):
+    if cache is not None:
+        return np.array(cache.get(path))
+
     vol = resample_mrc.resample_mrc(
-        0, path, tmp_out, resample_mrc.TARGET_VOXEL
+        0, path, None, resample_mrc.TARGET_VOXEL
     )
 
-    mean = vol.mean()
-    std = vol.std()
-    vol = (vol - mean) / (std + 1e-6)
-
-    vol = center_crop_64(vol)
-    return vol
+    return volume_cache.normalize_patch(vol)
 
 
 
@@ -83,6 +79,15 @@ def classify_vol(vol_np, model):
     return COARSE_LABELS[idx], probs
 
 
+def classify_batch(vols_np, model):
+    # vols_np: (n, 64, 64, 64) patches, one forward pass for all of them
+    t = torch.from_numpy(np.ascontiguousarray(vols_np, dtype=np.float32)).unsqueeze(1)  # n×1×64×64×64
+    with torch.no_grad():
+        probs = torch.softmax(model(t), dim=1).cpu().numpy()
+
+    return [COARSE_LABELS[int(i)] for i in probs.argmax(axis=1)], probs
+
+
 if __name__ == "__main__":
     if len(sys.argv) != 3:
         print("Usage: python inference.py <patch.mrc> <checkpoint.pth>")
@@ -1,9 +1,17 @@
 import os
-import sys
+import math
+import argparse
 import numpy as np
 import mrcfile
 from Bio import PDB
 from copy import deepcopy
+from label_io import LABEL_PREFIXES, LABEL_BITS, LABEL_FORMATS, write_label_maps, write_separate_label_maps
+
+# hard: only the nearest voxel of each atom is set to 1.0
+# sphere: every voxel within radius of the atom is set to 1.0
+# gaussian: voxels within radius get exp(-d^2 / (2 sigma^2)), overlapping atoms keep the maximum
+LABEL_MODES = ("hard", "sphere", "gaussian")
+STAMP_BATCH = 1 << 22
 
 # Normalize an MRC map by its 95th percentile and clips values to [0,1].
 def normalize_map(input_mrc_path, output_mrc_path):
@@ -34,92 +42,175 @@ def get_index(coord, origin, voxel_size):
     return round((coord - origin) / voxel_size)
 
 
-def generate_label_maps(experimental_map, pdb_structure, input_mrc_path):
-    error_list = set()
+BACKBONE_ATOMS = ["P", "O5'", "O3'", "O1P", "O2P"]
+RIBOSE_ATOMS = ["C1'", "C2'", "C3'", "C4'", "C5'", "O2'", "O4'"]
+BASE_ATOMS = [
+    "N1", "N3", "N9", "N2", "N6", "N7",
+    "C2", "C4", "C5", "C6", "C8",
+    "O2", "O4", "O6"
+]
 
-    org_map = mrcfile.open(experimental_map, mode='r')
-    shape = org_map.data.shape
+# Label class of each atom name, 0 is unlabeled. The classes follow the order of LABEL_PREFIXES.
+ATOM_CLASS = {}
+for class_id, atom_names in enumerate([BACKBONE_ATOMS, RIBOSE_ATOMS, BASE_ATOMS], start=1):
+    ATOM_CLASS.update({name: class_id for name in atom_names})
 
-    backbone_map = np.zeros(shape, dtype=np.float32)
-    ribose_map  = np.zeros(shape, dtype=np.float32)
-    base_map    = np.zeros(shape, dtype=np.float32)
-
-    x_origin = org_map.header.origin['x']
-    y_origin = org_map.header.origin['y']
-    z_origin = org_map.header.origin['z']
-    x_voxel = org_map.voxel_size['x']
-    y_voxel = org_map.voxel_size['y']
-    z_voxel = org_map.voxel_size['z']
 
+#Read all atom coordinates (x, y, z) and atom names of a structure into arrays.
+def read_atoms(pdb_structure):
     parser = PDB.PDBParser(QUIET=True)
     structure = parser.get_structure("model", pdb_structure)
+    atoms = list(structure.get_atoms())
+    coords = np.array([atom.get_coord() for atom in atoms], dtype=np.float32).reshape(-1, 3)
+    names = np.array([atom.get_name() for atom in atoms], dtype=str)
+    return coords, names
+
+
+#Look up the label class of every atom name, each distinct name is looked up once.
+def classify_atoms(names):
+    unique_names, inverse = np.unique(names, return_inverse=True)
+    lookup = np.array([ATOM_CLASS.get(name, 0) for name in unique_names], dtype=np.uint8)
+    return lookup[inverse.reshape(-1)]
+
+
+#Vectorized get_index of (x, y, z) coordinates, returns (N, 3) voxel indexes in (z, y, x) order.
+def get_indexes(coords, origin, voxel_size):
+    origin = np.array([origin['x'], origin['y'], origin['z']], dtype=np.float32)
+    voxel_size = np.array([voxel_size['x'], voxel_size['y'], voxel_size['z']], dtype=np.float32)
+    return np.rint((coords - origin) / voxel_size).astype(np.int64)[:, ::-1]
+
+
+#Unrounded voxel positions of (x, y, z) coordinates, returns (N, 3) float64 positions in (z, y, x) order.
+def get_positions(coords, origin, voxel_size):
+    origin = np.array([origin['x'], origin['y'], origin['z']], dtype=np.float64)
+    voxel_size = np.array([voxel_size['x'], voxel_size['y'], voxel_size['z']], dtype=np.float64)
+    return ((coords - origin) / voxel_size)[:, ::-1]
+
+
+#(K, 3) voxel offsets in (z, y, x) order around the nearest voxel of an atom that can lie within radius of it,
+#the atom may sit anywhere inside that voxel so the box reaches half a voxel further than the radius.
+def kernel_offsets(voxel_size, radius):
+    voxel = np.array([voxel_size['z'], voxel_size['y'], voxel_size['x']], dtype=np.float64)
+    half = [math.ceil(radius / v + 0.5) for v in voxel]
+    grid = np.mgrid[-half[0]:half[0] + 1, -half[1]:half[1] + 1, -half[2]:half[2] + 1].reshape(3, -1).T
+    dist2 = ((np.maximum(np.abs(grid) - 0.5, 0) * voxel) ** 2).sum(axis=1)
+    return grid[dist2 <= radius ** 2]
+
+
+#Label weight at squared distance dist2 (Angstrom^2) from an atom, 0 outside radius.
+def stamp_weights(dist2, radius, mode="sphere", sigma=None):
+    inside = dist2 <= radius ** 2
+    if mode == "sphere":
+        return inside.astype(np.float32)
+    sigma = sigma or radius / 2
+    return np.where(inside, np.exp(-dist2 / (2 * sigma ** 2)), 0).astype(np.float32)
+
+
+#Accumulate one stamp per atom into a volume, overlapping stamps keep the maximum weight. The weights use the
+#distance of every voxel to the exact (fractional) atom position, not to the voxel nearest to the atom.
+def render_stamps(positions, voxel_size, radius, shape, mode="sphere", sigma=None, batch=STAMP_BATCH):
+    volume = np.zeros(int(np.prod(shape)), dtype=np.float32)
+    if len(positions) == 0:
+        return volume.reshape(shape)
+    voxel = np.array([voxel_size['z'], voxel_size['y'], voxel_size['x']], dtype=np.float64)
+    offsets = kernel_offsets(voxel_size, radius)
+    shape_arr = np.array(shape)
+    atoms_per_batch = max(1, batch // len(offsets))
+
+    for start in range(0, len(positions), atoms_per_batch):
+        chunk = positions[start:start + atoms_per_batch]
+        centers = np.rint(chunk).astype(np.int64)
+        voxels = (centers[:, None, :] + offsets[None, :, :]).reshape(-1, 3)
+        delta = (offsets[None, :, :] - (chunk - centers)[:, None, :]) * voxel
+        values = stamp_weights((delta ** 2).sum(axis=2).reshape(-1), radius, mode, sigma)
+        keep = np.all((voxels >= 0) & (voxels < shape_arr), axis=1) & (values > 0)
+        flat = np.ravel_multi_index(tuple(voxels[keep].T), shape)
+        values = values[keep]
+
+        # Sort by voxel and max-reduce each run of equal voxels
+        order = np.argsort(flat, kind="stable")
+        flat, values = flat[order], values[order]
+        if len(flat) == 0:
+            continue
+        starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+        voxel_ids = flat[starts]
+        volume[voxel_ids] = np.maximum(volume[voxel_ids], np.maximum.reduceat(values, starts))
+    return volume.reshape(shape)
+
+
+def generate_label_maps(experimental_map, pdb_structure, input_mrc_path, output_format="separate",
+                        label_mode="hard", radius=None, sigma=None):
+    if output_format not in LABEL_FORMATS:
+        raise ValueError(f"Unknown label format {output_format!r}, expected one of {LABEL_FORMATS}")
+    if label_mode not in LABEL_MODES:
+        raise ValueError(f"Unknown label mode {label_mode!r}, expected one of {LABEL_MODES}")
+    if label_mode != "hard" and not radius:
+        raise ValueError(f"Label mode {label_mode!r} requires a radius in Angstrom")
+    if label_mode == "gaussian" and output_format != "separate":
+        raise ValueError("Gaussian labels are only written in the separate format")
 
-    print(f"Labeling map using {pdb_structure}")
-
-    for model in structure:
-        for chain in model:
-            for residue in chain:
-                for atom in residue:
-                    x, y, z = atom.get_coord()
-
-                    iz = int(get_index(z, z_origin, z_voxel))
-                    jy = int(get_index(y, y_origin, y_voxel))
-                    kx = int(get_index(x, x_origin, x_voxel))
-
-                    try:
-                        atom_name = atom.get_name()
-
-                        if atom_name == "P" or atom_name in ["O5'", "O3'", "O1P", "O2P"]:
-                            backbone_map[iz, jy, kx] = 1.0
-
-                        elif atom_name in ["C1'", "C2'", "C3'", "C4'", "C5'", "O2'", "O4'"]:
-                            ribose_map[iz, jy, kx] = 1.0
+    org_map = mrcfile.open(experimental_map, mode='r')
+    shape = org_map.data.shape
 
-                        elif atom_name in [
-                            "N1", "N3", "N9", "N2", "N6", "N7",
-                            "C2", "C4", "C5", "C6", "C8",
-                            "O2", "O4", "O6"
-                        ]:
-                            base_map[iz, jy, kx] = 1.0
+    print(f"Labeling map using {pdb_structure}")
 
-                    except IndexError:
-                        error_list.add((iz, jy, kx))
+    coords, names = read_atoms(pdb_structure)
+    classes = classify_atoms(names)
+    labeled = classes > 0
+    indexes = get_indexes(coords[labeled], org_map.header.origin, org_map.voxel_size)
+    classes = classes[labeled]
 
+    inside = np.all((indexes >= 0) & (indexes < np.array(shape)), axis=1)
+    error_list = np.unique(indexes[~inside], axis=0)
     base_name = os.path.splitext(os.path.basename(input_mrc_path))[0]
 
-    outputs = {
-        f"backbone_label_{base_name}.mrc": backbone_map,
-        f"ribose_label_{base_name}.mrc": ribose_map,
-        f"sugar_label_{base_name}.mrc": base_map
-    }
-
-    for fname, vol in outputs.items():
-        with mrcfile.new(fname, overwrite=True) as mrc:
-            mrc.set_data(vol)
-            mrc.voxel_size = org_map.voxel_size
-            mrc.header.origin = org_map.header.origin
-            mrc.nstart = org_map.nstart
-            mrc.update_header_stats()
-        print(f"Wrote: {fname}")
+    if label_mode == "hard":
+        indexes, classes = indexes[inside], classes[inside]
+
+        # One bit per class so that voxels shared by several classes keep all of them
+        label_bits = np.zeros(shape, dtype=np.uint8)
+        for class_id, prefix in enumerate(LABEL_PREFIXES, start=1):
+            iz, jy, kx = indexes[classes == class_id].T
+            label_bits[iz, jy, kx] |= LABEL_BITS[prefix]
+        write_label_maps(label_bits, org_map, base_name, output_format)
+    else:
+        # Atoms just outside the map still contribute the part of their stamp that is inside
+        positions = get_positions(coords[labeled], org_map.header.origin, org_map.voxel_size)
+        label_maps = [
+            render_stamps(positions[classes == class_id], org_map.voxel_size, radius, shape, label_mode, sigma)
+            for class_id in range(1, len(LABEL_PREFIXES) + 1)
+        ]
+        if output_format == "separate":
+            write_separate_label_maps(label_maps, org_map, base_name)
+        else:
+            label_bits = np.zeros(shape, dtype=np.uint8)
+            for prefix, label_map in zip(LABEL_PREFIXES, label_maps):
+                label_bits[label_map > 0] |= LABEL_BITS[prefix]
+            write_label_maps(label_bits, org_map, base_name, output_format)
 
     org_map.close()
 
-    if error_list:
+    if len(error_list):
         print(f"{len(error_list)} atoms were outside map bounds.")
 
 
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python label.py input.mrc input.pdb")
-        sys.exit(1)
-
-    input_mrc, input_pdb = sys.argv[1:3]
-
-    normalized_mrc = os.path.splitext(input_mrc)[0] + "_normalized.mrc"
-    normalize_map(input_mrc, normalized_mrc)
-
-    generate_label_maps(normalized_mrc, input_pdb,input_mrc)
+    parser = argparse.ArgumentParser(description="Label a density map with backbone, ribose and sugar atoms")
+    parser.add_argument("input_mrc", help="Input map")
+    parser.add_argument("input_pdb", help="Atomic model fitted to the map")
+    parser.add_argument("output_format", nargs="?", default="separate", choices=LABEL_FORMATS,
+                        help="Label output format")
+    parser.add_argument("--mode", default="hard", choices=LABEL_MODES, help="Label rendering of each atom")
+    parser.add_argument("--radius", type=float, default=None, help="Atom radius in Angstrom for sphere/gaussian")
+    parser.add_argument("--sigma", type=float, default=None, help="Gaussian sigma in Angstrom (default radius/2)")
+    args = parser.parse_args()
+
+    normalized_mrc = os.path.splitext(args.input_mrc)[0] + "_normalized.mrc"
+    normalize_map(args.input_mrc, normalized_mrc)
+
+    generate_label_maps(normalized_mrc, args.input_pdb, args.input_mrc, args.output_format,
+                        args.mode, args.radius, args.sigma)
 
 
 if __name__ == "__main__":
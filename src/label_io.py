@@ -0,0 +1,153 @@
+import os
+import numpy as np
+import mrcfile
+
+# Label classes in bit order, the file prefixes are the ones written by label.py
+LABEL_PREFIXES = ["backbone", "ribose", "sugar"]
+LABEL_BITS = {prefix: 1 << i for i, prefix in enumerate(LABEL_PREFIXES)}
+
+# separate: one float32 MRC per class (backbone_label_*.mrc, ribose_label_*.mrc, sugar_label_*.mrc)
+# packed:   one int8 MRC of class bits (labels_*.mrc), overlapping classes are kept as separate bits
+# sparse:   voxel indexes and class bits of the labeled voxels only (labels_*.npz)
+LABEL_FORMATS = ("separate", "packed", "sparse")
+
+
+def xyz_record(values):
+    return np.rec.array(tuple(float(value) for value in values), dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4')])
+
+
+def label_filenames(base_name, output_format):
+    if output_format == "separate":
+        return [f"{prefix}_label_{base_name}.mrc" for prefix in LABEL_PREFIXES]
+    if output_format == "packed":
+        return [f"labels_{base_name}.mrc"]
+    if output_format == "sparse":
+        return [f"labels_{base_name}.npz"]
+    raise ValueError(f"Unknown label format {output_format!r}, expected one of {LABEL_FORMATS}")
+
+
+def write_label_maps(bits, org_map, base_name, output_format="separate"):
+    """
+    Write a volume of class bits (see LABEL_BITS) in one of LABEL_FORMATS with the header of org_map.
+    :param bits: uint8 volume, bit i is set where class LABEL_PREFIXES[i] is labeled
+    :param org_map: Open MrcFile the labels were generated for
+    :param base_name: Name appended to the output files
+    :param output_format: One of LABEL_FORMATS
+    :return List of written files
+    """
+    fnames = label_filenames(base_name, output_format)
+
+    if output_format == "sparse":
+        indexes = np.argwhere(bits)
+        np.savez_compressed(
+            fnames[0],
+            indexes=indexes.astype(np.int32),
+            bits=bits[tuple(indexes.T)],
+            shape=np.array(bits.shape),
+            origin=np.array(org_map.header.origin.tolist(), dtype=np.float32),
+            voxel_size=np.array(org_map.voxel_size.tolist(), dtype=np.float32),
+            nstart=np.array(org_map.nstart.tolist()),
+        )
+        print(f"Wrote: {fnames[0]}")
+        return fnames
+
+    if output_format == "separate":
+        volumes = [((bits & LABEL_BITS[prefix]) > 0).astype(np.float32) for prefix in LABEL_PREFIXES]
+        return write_separate_label_maps(volumes, org_map, base_name)
+
+    write_mrc(fnames[0], bits.astype(np.int8), org_map)
+    return fnames
+
+
+def write_separate_label_maps(volumes, org_map, base_name):
+    # One float32 MRC per class, the volumes may hold soft labels
+    fnames = label_filenames(base_name, "separate")
+    for fname, vol in zip(fnames, volumes):
+        write_mrc(fname, vol.astype(np.float32, copy=False), org_map)
+    return fnames
+
+
+def write_mrc(fname, vol, org_map):
+    with mrcfile.new(fname, overwrite=True) as mrc:
+        mrc.set_data(vol)
+        mrc.voxel_size = org_map.voxel_size
+        mrc.header.origin = org_map.header.origin
+        mrc.nstart = org_map.nstart
+        mrc.update_header_stats()
+    print(f"Wrote: {fname}")
+
+
+class LabelVolume:
+    """
+    Labels read from a packed (.mrc) or sparse (.npz) label file. Per-class masks are
+    only built when requested with mask(), and the packed volume stays memory-mapped.
+    """
+
+    def __init__(self, shape, origin, voxel_size, nstart, bits=None, indexes=None, values=None, mrc=None):
+        self.shape = tuple(int(n) for n in shape)
+        self.origin = origin
+        self.voxel_size = voxel_size
+        self.nstart = nstart
+        self._bits = bits
+        self._indexes = indexes
+        self._values = values
+        self._masks = {}
+        self._mrc = mrc
+
+    def close(self):
+        if self._mrc is not None:
+            self._mrc.close()
+            self._mrc = None
+        self._bits = None
+        self._masks = {}
+
+    @property
+    def bits(self):
+        if self._bits is None:
+            bits = np.zeros(self.shape, dtype=np.uint8)
+            bits[tuple(self._indexes.T)] = self._values
+            self._bits = bits
+        return self._bits
+
+    def mask(self, prefix):
+        if prefix not in self._masks:
+            flag = LABEL_BITS[prefix]
+            if self._bits is None:
+                mask = np.zeros(self.shape, dtype=bool)
+                selected = self._indexes[(self._values & flag) > 0]
+                mask[tuple(selected.T)] = True
+            else:
+                mask = (self._bits & flag) > 0
+            self._masks[prefix] = mask
+        return self._masks[prefix]
+
+    def coordinates(self, prefix):
+        # Voxel indexes of one class without building a dense mask for sparse labels
+        if self._bits is None:
+            return self._indexes[(self._values & LABEL_BITS[prefix]) > 0]
+        return np.argwhere(self.mask(prefix))
+
+
+def load_label_volume(path):
+    if path.lower().endswith(".npz"):
+        with np.load(path) as f:
+            return LabelVolume(
+                f["shape"], xyz_record(f["origin"]), xyz_record(f["voxel_size"]), tuple(f["nstart"]),
+                indexes=f["indexes"], values=f["bits"]
+            )
+
+    mrc = mrcfile.mmap(path, mode='r')
+    return LabelVolume(
+        mrc.data.shape, mrc.header.origin, mrc.voxel_size,
+        (int(mrc.header.nxstart), int(mrc.header.nystart), int(mrc.header.nzstart)),
+        bits=mrc.data.view(np.uint8), mrc=mrc
+    )
+
+
+def find_packed_labels(label_dir):
+    # Packed or sparse labels written next to the separate label maps, if any
+    for name in ("labels.mrc", "labels.npz"):
+        path = os.path.join(label_dir, name)
+        if os.path.isfile(path):
+            return path
+    return None
@@ -0,0 +1,154 @@
+import os
+import sys
+import csv
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from segment_engine import DensityMap, load_structure
+from phenix_batch import CC_COLUMNS, PhenixError
+
+# Gaussian width of the model map, sigma = resolution / (pi * sqrt(2)) as in ChimeraX molmap
+SIGMA_FACTOR = 1 / (np.pi * np.sqrt(2))
+# Atoms are splatted out to this many sigmas
+SPLAT_CUTOFF = 3.0
+# The molecular mask radius is the resolution clamped to these bounds, as in phenix.map_model_cc
+MIN_MASK_RADIUS = 3.0
+MAX_MASK_RADIUS = 10.0
+ATOM_BATCH = 4096
+ATOMIC_NUMBERS = {"H": 1, "C": 6, "N": 7, "O": 8, "F": 9, "NA": 11, "MG": 12, "P": 15, "S": 16, "CL": 17,
+                  "K": 19, "CA": 20, "MN": 25, "FE": 26, "CO": 27, "NI": 28, "CU": 29, "ZN": 30}
+
+
+def mask_radius(resolution):
+    return max(MIN_MASK_RADIUS, min(MAX_MASK_RADIUS, resolution))
+
+
+def voxel_neighbourhood(shape, origin, voxel_size, coords, radius):
+    """
+    Voxels of a (z, y, x) grid within radius of each atom, in batches of atoms.
+    :return Generator of (atom indexes, flat voxel indexes, squared distances) arrays
+    """
+    shape_xyz = np.array(shape[::-1])
+    half = np.ceil(radius / voxel_size).astype(int)
+    offsets = np.stack(np.meshgrid(*[np.arange(-h, h + 1) for h in half], indexing="ij"), axis=-1).reshape(-1, 3)
+
+    for start in range(0, len(coords), ATOM_BATCH):
+        batch = coords[start:start + ATOM_BATCH]
+        centre = np.rint((batch - origin) / voxel_size).astype(int)
+        ijk = centre[:, None, :] + offsets[None, :, :]  # (atoms, offsets, xyz)
+        d2 = (((origin + ijk * voxel_size) - batch[:, None, :]) ** 2).sum(axis=2)
+        inside = (d2 <= radius ** 2) & np.all((ijk >= 0) & (ijk < shape_xyz), axis=2)
+        atom, offset = np.nonzero(inside)
+        i, j, k = ijk[atom, offset].T
+        yield start + atom, (k * shape[1] + j) * shape[2] + i, d2[atom, offset]
+
+
+def model_map(shape, origin, voxel_size, coords, weights, resolution):
+    """
+    Map simulated from the atoms on the grid of the experimental map: a Gaussian of
+    sigma = SIGMA_FACTOR * resolution per atom, weighted by atomic number.
+    """
+    sigma = SIGMA_FACTOR * resolution
+    data = np.zeros(int(np.prod(shape)))
+    for atom, flat, d2 in voxel_neighbourhood(shape, origin, voxel_size, coords, SPLAT_CUTOFF * sigma):
+        data += np.bincount(flat, weights=weights[atom] * np.exp(-0.5 * d2 / sigma ** 2), minlength=data.size)
+    return data.reshape(shape)
+
+
+def molecular_mask(shape, origin, voxel_size, coords, radius):
+    mask = np.zeros(int(np.prod(shape)), dtype=bool)
+    for _, flat, _ in voxel_neighbourhood(shape, origin, voxel_size, coords, radius):
+        mask[flat] = True
+    return mask.reshape(shape)
+
+
+def correlation(a, b):
+    a = a - a.mean()
+    b = b - b.mean()
+    denominator = np.sqrt((a * a).sum() * (b * b).sum())
+    return float((a * b).sum() / denominator) if denominator > 0 else float("nan")
+
+
+def top_voxels(data, count):
+    selected = np.zeros(data.size, dtype=bool)
+    if count > 0:
+        selected[np.argpartition(data.ravel(), data.size - count)[data.size - count:]] = True
+    return selected.reshape(data.shape)
+
+
+def map_model_cc(density_map, coords, weights, resolution):
+    """
+    Map-model correlations of Afonine et al. 2018 (phenix.map_model_cc) between a density map
+    and a model map computed at the given resolution.
+    CC_mask: voxels within mask_radius(resolution) of the atoms.
+    CC_volume: the N highest voxels of the model map, N the number of voxels in the mask.
+    CC_peaks: the union of the N highest voxels of the model map and of the density map.
+    CC_box: every voxel of the map.
+    :return dict of CC_COLUMNS
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    weights = np.asarray(weights, dtype=np.float64)
+    data = np.asarray(density_map.data, dtype=np.float64)
+    args = (data.shape, density_map.origin, density_map.voxel_size, coords)
+    calc = model_map(*args, weights, resolution)
+    mask = molecular_mask(*args, mask_radius(resolution))
+
+    count = int(mask.sum())
+    volume = top_voxels(calc, count)
+    peaks = volume | top_voxels(data, count)
+    return {
+        "CC_mask": correlation(data[mask], calc[mask]),
+        "CC_volume": correlation(data[volume], calc[volume]),
+        "CC_peaks": correlation(data[peaks], calc[peaks]),
+        "CC_box": correlation(data.ravel(), calc.ravel()),
+    }
+
+
+def model_atoms(structure):
+    """Coordinates and atomic numbers of the atoms of the first model, hydrogens excluded."""
+    model = next(iter(structure))
+    atoms = [atom for atom in model.get_atoms() if atom.element not in ("H", "D")]
+    coords = np.array([atom.get_coord() for atom in atoms], dtype=np.float64).reshape(-1, 3)
+    weights = np.array([ATOMIC_NUMBERS.get(atom.element.upper(), 6) for atom in atoms], dtype=np.float64)
+    return coords, weights
+
+
+def compute_cc(structure_path, map_path, resolution):
+    """CC_mask, CC_volume, CC_peaks and CC_box of a model in a map, formatted like phenix.map_model_cc."""
+    coords, weights = model_atoms(load_structure(structure_path))
+    with DensityMap.open(map_path) as density_map:
+        cc = map_model_cc(density_map, coords, weights, resolution)
+    return {column: f"{value:.4f}" for column, value in cc.items()}
+
+
+class NativeRunner:
+    """Drop-in for phenix_batch.PhenixRunner that computes the correlations in process."""
+
+    def resolution(self, mrc_file, cwd=None):
+        raise PhenixError("resolutions are not estimated without phenix.mtriage, seed them from EMDB or a resolution CSV")
+
+    def map_model_cc(self, pdb_file, mrc_file, resolution, cwd=None):
+        try:
+            return compute_cc(pdb_file, mrc_file, resolution)
+        except Exception as e:
+            raise PhenixError(f"Could not compute the correlations of {mrc_file}: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute map-model correlations without Phenix")
+    parser.add_argument("structure", help="PDB or mmCIF file of the model")
+    parser.add_argument("map", help="Density map (.mrc/.map/.map.gz)")
+    parser.add_argument("resolution", type=float, help="Resolution of the map in Angstrom")
+    parser.add_argument("--output", default=None, help="CSV with the same columns as zscoreCompute.py")
+    args = parser.parse_args()
+
+    cc = compute_cc(args.structure, args.map, args.resolution)
+    for column in CC_COLUMNS:
+        print(f"{column:10}: {cc[column]}")
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["resolution"] + CC_COLUMNS)
+            writer.writerow([args.resolution] + [cc[column] for column in CC_COLUMNS])
@@ -0,0 +1,160 @@
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import inference_single
+import model_runtime
+from batch_inference import preprocessed
+
+PATCH_SHAPE = (1, 1, 64, 64, 64)
+
+
+def export_torchscript(model, output_path, quantize=False, channels_last=True):
+    """
+    Trace an eager Motif3DCNN, optionally with dynamic int8 quantization of the Linear layers
+    of its classifier, freeze it and save it with the metadata read by model_runtime.
+    :return model_runtime.ScriptedClassifier of the saved archive
+    """
+    model = copy.deepcopy(model).eval()
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    example = torch.zeros(PATCH_SHAPE)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last_3d)
+        example = example.contiguous(memory_format=torch.channels_last_3d)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.freeze(traced.eval())
+    metadata = {
+        "labels": inference_single.COARSE_LABELS,
+        "patch_size": PATCH_SHAPE[-1],
+        "quantized": quantize,
+        "channels_last": channels_last,
+        "torch_version": torch.__version__,
+    }
+    torch.jit.save(frozen, output_path, _extra_files={model_runtime.METADATA_FILE: json.dumps(metadata)})
+    return model_runtime.load_scripted(output_path)
+
+
+def export_onnx(model, output_path):
+    """ONNX export with a dynamic batch axis, needs the onnx package."""
+    try:
+        torch.onnx.export(copy.deepcopy(model).eval(), torch.zeros(PATCH_SHAPE), output_path,
+                          input_names=["volume"], output_names=["logits"],
+                          dynamic_axes={"volume": {0: "batch"}, "logits": {0: "batch"}}, dynamo=False)
+    except Exception as e:
+        print(f"ONNX export failed: {e}")
+        return False
+    return True
+
+
+def timed_batch(model, patches):
+    start = time.perf_counter()
+    labels, probs = inference_single.classify_batch(patches, model)
+    return labels, probs, time.perf_counter() - start
+
+
+def parity_check(eager, scripted, samples, batch_size=16):
+    """
+    Compare the predictions of the exported model with the eager model.
+    :param samples: Iterable of (patch, true label or None)
+    :return dict with the label agreement, the largest probability difference, the accuracy of
+            both models on labelled samples and their time per batch
+    """
+    report = {"samples": 0, "agreement": 0, "max_prob_diff": 0.0, "labelled": 0, "eager_correct": 0,
+              "exported_correct": 0, "eager_s": 0.0, "exported_s": 0.0, "batches": 0}
+
+    def run(patches, truths):
+        eager_labels, eager_probs, eager_s = timed_batch(eager, np.stack(patches))
+        labels, probs, exported_s = timed_batch(scripted, np.stack(patches))
+        report["samples"] += len(patches)
+        report["batches"] += 1
+        report["eager_s"] += eager_s
+        report["exported_s"] += exported_s
+        report["agreement"] += sum(a == b for a, b in zip(eager_labels, labels))
+        report["max_prob_diff"] = max(report["max_prob_diff"], float(np.abs(eager_probs - probs).max()))
+        for truth, eager_label, label in zip(truths, eager_labels, labels):
+            if truth is not None:
+                report["labelled"] += 1
+                report["eager_correct"] += truth == eager_label
+                report["exported_correct"] += truth == label
+
+    patches, truths = [], []
+    for patch, truth in samples:
+        patches.append(patch)
+        truths.append(truth)
+        if len(patches) == batch_size:
+            run(patches, truths)
+            patches, truths = [], []
+    if patches:
+        run(patches, truths)
+
+    n, batches, labelled = report["samples"], report["batches"], report["labelled"]
+    return {
+        "samples": n,
+        "agreement": report["agreement"] / n if n else 0.0,
+        "max_prob_diff": report["max_prob_diff"],
+        "eager_accuracy": report["eager_correct"] / labelled if labelled else None,
+        "exported_accuracy": report["exported_correct"] / labelled if labelled else None,
+        "eager_ms_per_batch": 1000 * report["eager_s"] / batches if batches else 0.0,
+        "exported_ms_per_batch": 1000 * report["exported_s"] / batches if batches else 0.0,
+    }
+
+
+def folder_samples(folder_path, max_per_class, workers):
+    # Preprocessed patches of the validate_folder layout (<folder>/<label>/*.mrc) with their labels
+    from validate_folder import list_class_files
+    files = list_class_files(folder_path, max_per_class, seed=0)
+    truths = dict(files)
+    for path, patch, error in preprocessed([path for path, _ in files], workers):
+        if error is not None:
+            print(f"Error processing {path}: {error}")
+            continue
+        yield patch, truths[path]
+
+
+def random_samples(count, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        yield rng.normal(size=PATCH_SHAPE[2:]).astype(np.float32), None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export Motif3DCNN to TorchScript (and ONNX) and check parity")
+    parser.add_argument("checkpoint", help="Model weights (.pth) saved by train.py")
+    parser.add_argument("output", help="TorchScript archive to write, loadable by inference_single.load_model")
+    parser.add_argument("--onnx", default=None, help="Also export an ONNX model to this path (needs onnx)")
+    parser.add_argument("--quantize", action="store_true", help="Dynamic int8 quantization of the Linear layers")
+    parser.add_argument("--no-channels-last", action="store_true", help="Keep the default memory format")
+    parser.add_argument("--parity-folder", default=None,
+                        help="validate_folder.py test folder for the parity check (random patches otherwise)")
+    parser.add_argument("--max-per-class", type=int, default=20, help="Files per class of the parity folder")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Preprocessing worker processes")
+    parser.add_argument("--min-agreement", type=float, default=0.99,
+                        help="Smallest label agreement with the eager model that passes the check")
+    args = parser.parse_args()
+
+    eager = inference_single.load_model(args.checkpoint)
+    scripted = export_torchscript(eager, args.output, args.quantize, not args.no_channels_last)
+    print(f"Wrote {args.output} ({os.path.getsize(args.output) / 1024 ** 2:.1f} MB, "
+          f"quantized={args.quantize}, channels_last={not args.no_channels_last})")
+    if args.onnx and export_onnx(eager, args.onnx):
+        print(f"Wrote {args.onnx}")
+
+    samples = (folder_samples(args.parity_folder, args.max_per_class, args.workers) if args.parity_folder
+               else random_samples(4 * args.batch_size))
+    report = parity_check(eager, scripted, samples, args.batch_size)
+    for key, value in report.items():
+        print(f"{key:22s}: {value:.4f}" if isinstance(value, float) else f"{key:22s}: {value}")
+    if report["agreement"] < args.min_agreement:
+        print(f"Parity check failed: agreement {report['agreement']:.4f} < {args.min_agreement}")
+        sys.exit(1)
@@ -0,0 +1,47 @@
+import json
+import zipfile
+import numpy as np
+import torch
+
+# Metadata stored inside the TorchScript archive by model_export.py
+METADATA_FILE = "motif_model.json"
+
+
+def is_torchscript(path):
+    # A TorchScript archive has code/ entries, a state dict saved by torch.save does not
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any("/code/" in name for name in archive.namelist())
+
+
+class ScriptedClassifier:
+    """
+    Frozen TorchScript Motif3DCNN exported by model_export.py. Only needs torch and numpy, so
+    loading it does not import train.py. Inputs are converted to channels-last-3d when the
+    model was exported in that memory format, and every call runs under torch.inference_mode.
+    """
+
+    def __init__(self, module, metadata):
+        self.module = module
+        self.metadata = metadata
+        self.labels = metadata["labels"]
+        self.memory_format = torch.channels_last_3d if metadata.get("channels_last") else torch.contiguous_format
+
+    def __call__(self, t):
+        with torch.inference_mode():
+            return self.module(t.contiguous(memory_format=self.memory_format))
+
+    def eval(self):
+        return self
+
+    def classify_batch(self, vols_np):
+        t = torch.from_numpy(np.ascontiguousarray(vols_np, dtype=np.float32)).unsqueeze(1)
+        probs = torch.softmax(self(t), dim=1).numpy()
+        return [self.labels[int(i)] for i in probs.argmax(axis=1)], probs
+
+
+def load_scripted(path):
+    extra_files = {METADATA_FILE: ""}
+    module = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+    return ScriptedClassifier(module.eval(), json.loads(extra_files[METADATA_FILE]))
@@ -0,0 +1,50 @@
+import os
+import csv
+
+
+def parse_key(map_path):
+    # <emdb_id>_<pdb_id>_<motif_type>_<internal_id>.mrc as written by the segmentation scripts
+    key = os.path.splitext(os.path.basename(map_path))[0]
+    parts = key.split("_")
+    if len(parts) < 4:
+        return key, "", "", "", ""
+    return key, parts[0], parts[1], "_".join(parts[2:-1]), parts[-1]
+
+
+def list_jobs(source, pdb_dir=None):
+    """
+    (map_path, pdb_path) pairs of the motifs to score, from a segment_driver manifest.csv or
+    from a folder of segmented maps whose models are <pdb_id>_<motif_type>_<internal_id>.pdb
+    in pdb_dir (the layout qscoreCompute.find_QScore reads).
+    """
+    if os.path.isfile(source):
+        with open(source, newline="") as f:
+            return [(row["map_path"], row["pdb_path"]) for row in csv.DictReader(f)
+                    if row.get("status", "ok") == "ok" and row["map_path"] and row["pdb_path"]]
+
+    jobs = []
+    pdb_dir = pdb_dir or source
+    for name in sorted(os.listdir(source)):
+        if not name.endswith(".mrc"):
+            continue
+        _, _, pdb_id, motif_type, internal_id = parse_key(name)
+        jobs.append((os.path.join(source, name), os.path.join(pdb_dir, f"{pdb_id}_{motif_type}_{internal_id}.pdb")))
+    return jobs
+
+
+def write_rows(path, columns, rows):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+def open_table(path, columns):
+    new = not os.path.isfile(path) or os.path.getsize(path) == 0
+    f = open(path, "a", newline="")
+    writer = csv.DictWriter(f, fieldnames=columns)
+    if new:
+        writer.writeheader()
+    return f, writer
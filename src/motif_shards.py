@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import Dataset
+from concurrent.futures import ProcessPoolExecutor
+
+import volume_cache
+
+SHARD_FORMAT_VERSION = 1
+INDEX_FILE = "index.csv"
+META_FILE = "meta.json"
+INDEX_COLUMNS = [
+    "shard", "offset", "class_id", "label", "motif", "emdb_id", "pdb_id", "internal_id", "resolution", "filepath"
+]
+
+
+def shard_name(shard):
+    return f"shard_{shard:05d}.npy"
+
+
+def parse_motif_filename(filepath):
+    # <emdb_id>_<pdb_id>_<motif_type>_<sequenceNumber>.mrc
+    parts = os.path.splitext(os.path.basename(filepath))[0].split("_")
+    if len(parts) < 4:
+        return "", "", "", ""
+    return parts[0], parts[1], parts[2], parts[3]
+
+
+def load_resolutions(resolution_csv):
+    if not resolution_csv:
+        return {}
+    df = pd.read_csv(resolution_csv)
+    return dict(zip(df["emdb_id"], df["resolution"].astype(float)))
+
+
+def _preprocess(path):
+    cache = volume_cache.worker_cache()
+    try:
+        if cache is not None:
+            return np.array(cache.get(path))
+        return volume_cache.preprocess_volume(path)
+    except Exception as e:
+        print(f"Failed to preprocess {path}: {e}")
+        return None
+
+
+def pack_shards(csv_file, output_dir, shard_size=512, dtype="float32", cache_dir=None, resolution_csv=None,
+                workers=os.cpu_count()):
+    """
+    Pack the samples of a training CSV (filepath,label) into contiguous .npy shards of preprocessed
+    patches with shape (n, 64, 64, 64), plus an index.csv holding shard/offset and sample metadata.
+    """
+    from train import CSV_LABEL_TO_CLASS
+
+    df = pd.read_csv(csv_file)
+    resolutions = load_resolutions(resolution_csv)
+    os.makedirs(output_dir, exist_ok=True)
+
+    size = volume_cache.PATCH_SIZE
+    buffer = np.empty((shard_size, size, size, size), dtype=dtype)
+    rows = []
+    shard = filled = 0
+
+    def flush():
+        nonlocal shard, filled
+        if filled:
+            np.save(os.path.join(output_dir, shard_name(shard)), buffer[:filled])
+            print(f"Wrote {shard_name(shard)} with {filled} samples")
+            shard += 1
+            filled = 0
+
+    # One VolumeCache per worker, so its size and digests carry over between maps
+    cache = volume_cache.VolumeCache.from_config(cache_dir) if cache_dir else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=volume_cache.init_worker, initargs=(cache,)) as pool:
+        for (_, row), patch in zip(df.iterrows(), pool.map(_preprocess, df["filepath"], chunksize=8)):
+            if patch is None:
+                continue
+            label = row["label"].lower()
+            emdb_id, pdb_id, motif, internal_id = parse_motif_filename(row["filepath"])
+            buffer[filled] = patch
+            rows.append([
+                shard, filled, CSV_LABEL_TO_CLASS[label], label, motif, emdb_id, pdb_id, internal_id,
+                resolutions.get(emdb_id, np.nan), row["filepath"]
+            ])
+            filled += 1
+            if filled == shard_size:
+                flush()
+    flush()
+
+    pd.DataFrame(rows, columns=INDEX_COLUMNS).to_csv(os.path.join(output_dir, INDEX_FILE), index=False)
+    with open(os.path.join(output_dir, META_FILE), "w") as f:
+        json.dump({
+            "version": SHARD_FORMAT_VERSION,
+            "cache_version": volume_cache.CACHE_VERSION,
+            "patch_size": size,
+            "dtype": np.dtype(dtype).name,
+            "num_shards": shard,
+            "num_samples": len(rows),
+            "source": os.path.abspath(csv_file),
+        }, f, indent=2)
+    return len(rows), shard
+
+
+def is_shard_dir(path):
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+class ShardedMotifDataset(Dataset):
+    """
+    Serves the samples packed by pack_shards as views into memory-mapped shards.
+
+    Shards are opened lazily in each DataLoader worker (copy-on-write mode, so the
+    views are writable for torch without copying), and the index is held as plain
+    arrays instead of a DataFrame to keep per-sample lookups cheap.
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        index = pd.read_csv(os.path.join(shard_dir, INDEX_FILE))
+        self.shard = index["shard"].to_numpy()
+        self.offset = index["offset"].to_numpy()
+        self.class_id = index["class_id"].to_numpy()
+        self.filepath = index["filepath"].to_numpy()
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.class_id)
+
+    def __getstate__(self):
+        # Memory maps are re-opened in each worker process instead of being pickled
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def get_shard(self, shard):
+        data = self._shards.get(shard)
+        if data is None:
+            data = np.load(os.path.join(self.shard_dir, shard_name(shard)), mmap_mode="c")
+            self._shards[shard] = data
+        return data
+
+    def __getitem__(self, idx):
+        patch = self.get_shard(self.shard[idx])[self.offset[idx]]
+        patch = torch.from_numpy(patch).float().unsqueeze(0)
+        return patch, torch.tensor(self.class_id[idx], dtype=torch.long)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack a training CSV into memory-mappable shards")
+    parser.add_argument("csv_file", help="CSV with filepath,label columns")
+    parser.add_argument("output_dir", help="Destination directory of the shards")
+    parser.add_argument("--shard-size", type=int, default=512, help="Samples per shard")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="Stored patch dtype")
+    parser.add_argument("--cache-dir", default=None, help="Reuse a preprocessed volume cache")
+    parser.add_argument("--resolutions", default=None, help="CSV with emdb_id,resolution columns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    args = parser.parse_args()
+
+    count, shards = pack_shards(args.csv_file, args.output_dir, args.shard_size, args.dtype,
+                                args.cache_dir, args.resolutions, args.workers)
+    if count == 0:
+        print("No samples were packed.")
+        sys.exit(1)
+    print(f"Packed {count} samples into {shards} shards in {args.output_dir}")
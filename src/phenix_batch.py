@@ -0,0 +1,294 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import re
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from motif_jobs import list_jobs, parse_key, open_table
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CONFIG_PATH = os.path.join(REPO_DIR, "configurations", "config.json")
+DEFAULT_RESOLUTIONS_PATH = "./cache/resolutions.csv"
+DEFAULT_EMDB_API_URL = "https://www.ebi.ac.uk/emdb/api/entry"
+DEFAULT_TIMEOUT = 600
+ENGINES = ("phenix", "native")
+CC_COLUMNS = ["CC_mask", "CC_volume", "CC_peaks", "CC_box"]
+RESULT_COLUMNS = ["key", "emdb_id", "pdb_id", "motif_type", "internal_id", "resolution"] + CC_COLUMNS + ["status"]
+RESOLUTION_COLUMNS = ["emdb_id", "resolution", "source"]
+
+
+def load_config():
+    try:
+        with open(CONFIG_PATH, "r") as config_file:
+            return json.load(config_file)
+    except (OSError, ValueError):
+        return {}
+
+
+class PhenixError(Exception):
+    pass
+
+
+def parse_resolution(stdout):
+    match = re.search(r"Resolution set to \s*([\d\.]+)", stdout)
+    return float(match.group(1)) if match else None
+
+
+def parse_cc(stdout):
+    values = {}
+    for column in CC_COLUMNS:
+        match = re.search(rf"{column}\s*:\s*([0-9.]+)", stdout)
+        values[column] = match.group(1) if match else ""
+    return values
+
+
+class PhenixRunner:
+    """
+    Runs the Phenix command line tools used for validation. The executables are
+    configurable, so tests (or other installations) can substitute them.
+    """
+
+    def __init__(self, mtriage="phenix.mtriage", map_model_cc="phenix.map_model_cc", timeout=DEFAULT_TIMEOUT):
+        self.mtriage_command = mtriage
+        self.map_model_cc_command = map_model_cc
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls):
+        config = load_config().get("phenix", {})
+        return cls(
+            mtriage=config.get("mtriage", "phenix.mtriage"),
+            map_model_cc=config.get("map_model_cc", "phenix.map_model_cc"),
+            timeout=config.get("timeout", DEFAULT_TIMEOUT),
+        )
+
+    def run(self, cmd, cwd=None):
+        print(f" Running: {' '.join(cmd)}")
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                    timeout=self.timeout, cwd=cwd)
+        except subprocess.TimeoutExpired:
+            raise PhenixError(f"{cmd[0]} timed out after {self.timeout}s")
+        except OSError as e:
+            raise PhenixError(f"Could not run {cmd[0]}: {e}")
+        if result.returncode != 0:
+            raise PhenixError(f"{cmd[0]} exited with {result.returncode}: {result.stderr.strip()[-500:]}")
+        return result.stdout
+
+    def resolution(self, mrc_file, cwd=None):
+        return parse_resolution(self.run([self.mtriage_command, os.path.abspath(mrc_file)], cwd))
+
+    def map_model_cc(self, pdb_file, mrc_file, resolution, cwd=None):
+        stdout = self.run([self.map_model_cc_command, os.path.abspath(pdb_file), os.path.abspath(mrc_file),
+                           f"resolution={resolution}"], cwd)
+        return parse_cc(stdout)
+
+
+def find_resolution(data):
+    # final_reconstruction.resolution of the EMDB entry, wherever it is nested
+    if isinstance(data, dict):
+        reconstruction = data.get("final_reconstruction")
+        if isinstance(reconstruction, dict):
+            resolution = reconstruction.get("resolution")
+            value = resolution.get("valueOf_") if isinstance(resolution, dict) else resolution
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                pass
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+    for value in values:
+        resolution = find_resolution(value)
+        if resolution is not None:
+            return resolution
+    return None
+
+
+def fetch_emdb_resolution(emdb_id, base_url=DEFAULT_EMDB_API_URL, session=None):
+    """Reported resolution of an EMDB entry from the EMDB API, None if unavailable."""
+    try:
+        response = (session or requests).get(f"{base_url.rstrip('/')}/{emdb_id.upper()}", timeout=30)
+        if response.status_code != 200:
+            print(f"EMDB API error for {emdb_id}: {response.status_code}")
+            return None
+        return find_resolution(response.json())
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error retrieving the resolution of {emdb_id}: {e}")
+        return None
+
+
+class ResolutionCache:
+    """
+    Resolutions by EMDB id in a CSV (emdb_id,resolution,source), the same columns as the
+    resolution CSVs read by zscoreCompute.py and motif_shards.py.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.resolutions = {}
+        if os.path.isfile(path):
+            with open(path, newline="") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        self.resolutions[row["emdb_id"].upper()] = float(row["resolution"])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+
+    @classmethod
+    def from_config(cls, path=None):
+        # "phenix"."resolutions" of config.json, relative to the repository
+        path = path or load_config().get("phenix", {}).get("resolutions", DEFAULT_RESOLUTIONS_PATH)
+        if not os.path.isabs(path):
+            path = os.path.normpath(os.path.join(REPO_DIR, path))
+        return cls(path)
+
+    def get(self, emdb_id):
+        return self.resolutions.get(emdb_id.upper())
+
+    def put(self, emdb_id, resolution, source):
+        self.resolutions[emdb_id.upper()] = resolution
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        f, writer = open_table(self.path, RESOLUTION_COLUMNS)
+        with f:
+            writer.writerow({"emdb_id": emdb_id.upper(), "resolution": resolution, "source": source})
+
+
+def resolve_resolutions(jobs, runner, cache, workers, seed_from_emdb=False, emdb_api_url=DEFAULT_EMDB_API_URL):
+    """
+    Resolution of every EMDB id of the jobs: from the cache, else from the EMDB entry metadata
+    (seed_from_emdb), else from phenix.mtriage on the first motif map of that id.
+    """
+    first_map = {}
+    for map_path, _ in jobs:
+        emdb_id = parse_key(map_path)[1].upper()
+        first_map.setdefault(emdb_id, map_path)
+    missing = [emdb_id for emdb_id in first_map if cache.get(emdb_id) is None]
+
+    if missing and seed_from_emdb:
+        session = requests.Session()
+        for emdb_id in list(missing):
+            resolution = fetch_emdb_resolution(emdb_id, emdb_api_url, session)
+            if resolution is not None:
+                cache.put(emdb_id, resolution, "emdb")
+                missing.remove(emdb_id)
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers) as pool, tempfile.TemporaryDirectory() as tmp:
+            futures = {}
+            for emdb_id in missing:
+                cwd = os.path.join(tmp, emdb_id)
+                os.makedirs(cwd)
+                futures[pool.submit(runner.resolution, first_map[emdb_id], cwd)] = emdb_id
+            for future in as_completed(futures):
+                emdb_id = futures[future]
+                try:
+                    resolution = future.result()
+                except PhenixError as e:
+                    print(f"mtriage failed for {emdb_id}: {e}")
+                    continue
+                if resolution is None:
+                    print(f"Could not find resolution in mtriage output for {emdb_id}.")
+                    continue
+                cache.put(emdb_id, resolution, "mtriage")
+    return {emdb_id: cache.get(emdb_id) for emdb_id in first_map}
+
+
+def completed_keys(output_csv):
+    if not os.path.isfile(output_csv):
+        return set()
+    with open(output_csv, newline="") as f:
+        return {row["key"] for row in csv.DictReader(f)}
+
+
+def run_batch(jobs, output_csv, runner, cache, workers=4, seed_from_emdb=False, emdb_api_url=DEFAULT_EMDB_API_URL):
+    """
+    Run phenix.map_model_cc for every (map_path, pdb_path) job with at most `workers`
+    concurrent subprocesses and append one row per motif to output_csv. Motifs already in
+    output_csv are skipped. Each subprocess runs in its own scratch directory.
+    :return Number of motifs processed in this run
+    """
+    done_keys = completed_keys(output_csv)
+    todo = [job for job in jobs if parse_key(job[0])[0] not in done_keys]
+    print(f"{len(jobs) - len(todo)} of {len(jobs)} motifs already done, {len(todo)} to go with {workers} workers")
+    if not todo:
+        return 0
+    resolutions = resolve_resolutions(todo, runner, cache, workers, seed_from_emdb, emdb_api_url)
+
+    def process(job, cwd):
+        map_path, pdb_path = job
+        key, emdb_id, pdb_id, motif_type, internal_id = parse_key(map_path)
+        row = {"key": key, "emdb_id": emdb_id, "pdb_id": pdb_id, "motif_type": motif_type,
+               "internal_id": internal_id, "resolution": resolutions.get(emdb_id.upper()), "status": "ok"}
+        row.update({column: "" for column in CC_COLUMNS})
+        if row["resolution"] is None:
+            row["status"] = "no_resolution"
+            return row
+        try:
+            row.update(runner.map_model_cc(pdb_path, map_path, row["resolution"], cwd))
+        except PhenixError as e:
+            print(f"map_model_cc failed for {key}: {e}")
+            row["status"] = "timeout" if "timed out" in str(e) else "failed"
+        return row
+
+    f, writer = open_table(output_csv, RESULT_COLUMNS)
+    start = time.time()
+    count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool, tempfile.TemporaryDirectory() as tmp:
+            futures = []
+            for i, job in enumerate(todo):
+                cwd = os.path.join(tmp, str(i))
+                os.makedirs(cwd)
+                futures.append(pool.submit(process, job, cwd))
+            for future in as_completed(futures):
+                writer.writerow(future.result())
+                f.flush()
+                count += 1
+                if count % 50 == 0 or count == len(todo):
+                    print(f"[{count}/{len(todo)}] {count / (time.time() - start):.2f} motifs/sec")
+    finally:
+        f.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run phenix.map_model_cc over segmented motifs in parallel")
+    parser.add_argument("source", help="manifest.csv of segment_driver.py or a folder of segmented .mrc maps")
+    parser.add_argument("output_csv", help="Table of resolution and CC_mask/CC_volume/CC_peaks/CC_box per motif")
+    parser.add_argument("--pdb-dir", default=None, help="Folder of the motif models if source is a folder")
+    parser.add_argument("--resolutions", default=None,
+                        help="Resolution cache CSV (emdb_id,resolution), default from config.json")
+    parser.add_argument("--seed-from-emdb", action="store_true", help="Use the resolution reported by EMDB first")
+    parser.add_argument("--workers", type=int, default=None, help="Concurrent Phenix processes")
+    parser.add_argument("--timeout", type=float, default=None, help="Timeout in seconds of each Phenix process")
+    parser.add_argument("--engine", choices=ENGINES, default="phenix",
+                        help="phenix.map_model_cc subprocesses or the in-process mapmodel_cc.py")
+    args = parser.parse_args()
+
+    config = load_config()
+    if args.engine == "native":
+        from mapmodel_cc import NativeRunner
+        runner = NativeRunner()
+    else:
+        runner = PhenixRunner.from_config()
+        if args.timeout:
+            runner.timeout = args.timeout
+    workers = args.workers or config.get("phenix", {}).get("workers", 4)
+    jobs = list_jobs(args.source, args.pdb_dir)
+    if not jobs:
+        print("No motifs found.")
+        sys.exit(1)
+    cache = ResolutionCache(args.resolutions) if args.resolutions else ResolutionCache.from_config()
+    run_batch(jobs, args.output_csv, runner, cache, workers, args.seed_from_emdb,
+              config.get("emdb_api_base_url", DEFAULT_EMDB_API_URL))
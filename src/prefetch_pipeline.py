@@ -0,0 +1,106 @@
+import os
+import time
+import shutil
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from artifact_store import load_config
+
+DEFAULT_DEPTH = 2
+DEFAULT_WORKERS = 2
+DEFAULT_MIN_FREE_BYTES = 10 * 1024 ** 3
+
+PrefetchedEntry = namedtuple("PrefetchedEntry", ["pdb_id", "emdb_id", "item", "structure_path", "map_path", "error"])
+
+
+def fetch_entry(store, pdb_id, emdb_id, decompress):
+    structure_path = store.fetch_structure(pdb_id)
+    map_path = store.fetch_map(emdb_id, decompress=decompress)
+    return structure_path, map_path
+
+
+def entry_bytes(paths):
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except (OSError, TypeError):
+            pass
+    return total
+
+
+class Prefetcher:
+    """
+    Iterates over (pdb_id, emdb_id, item) entries in order while the structures and maps of
+    the next `depth` entries are fetched into the artifact store on background threads, so
+    downloads overlap with the processing of the current entry.
+
+    Backpressure: a new fetch is only started while the fetched but not yet processed entries
+    take less than max_pending_bytes and the store's disk has min_free_bytes left. The next
+    entry is always fetched, so the pipeline never stalls.
+    """
+
+    def __init__(self, store, entries, depth=DEFAULT_DEPTH, workers=DEFAULT_WORKERS, max_pending_bytes=None,
+                 min_free_bytes=DEFAULT_MIN_FREE_BYTES, decompress=True):
+        self.store = store
+        self.entries = list(entries)
+        self.depth = max(1, depth)
+        self.workers = max(1, workers)
+        self.max_pending_bytes = max_pending_bytes
+        self.min_free_bytes = min_free_bytes
+        self.decompress = decompress
+        self.wait_time = 0.0
+
+    @classmethod
+    def from_config(cls, store, entries, depth=None):
+        config = load_config().get("prefetch", {})
+        max_pending_gb = config.get("max_pending_gb")
+        return cls(
+            store, entries,
+            depth=depth or config.get("depth", DEFAULT_DEPTH),
+            workers=config.get("workers", DEFAULT_WORKERS),
+            max_pending_bytes=None if max_pending_gb is None else int(max_pending_gb * 1024 ** 3),
+            min_free_bytes=int(config.get("min_free_gb", DEFAULT_MIN_FREE_BYTES / 1024 ** 3) * 1024 ** 3),
+        )
+
+    def has_room(self, window):
+        if len(window) >= self.depth:
+            return False
+        if not window:
+            return True
+        if self.max_pending_bytes is not None:
+            pending = sum(entry_bytes(future.result()) for _, future in window
+                          if future.done() and future.exception() is None)
+            if pending >= self.max_pending_bytes:
+                return False
+        if self.min_free_bytes:
+            if shutil.disk_usage(self.store.root).free < self.min_free_bytes:
+                return False
+        return True
+
+    def __iter__(self):
+        window = deque()
+        upcoming = deque(self.entries)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+
+            def fill():
+                while upcoming and self.has_room(window):
+                    pdb_id, emdb_id, item = upcoming.popleft()
+                    future = pool.submit(fetch_entry, self.store, pdb_id, emdb_id, self.decompress)
+                    window.append(((pdb_id, emdb_id, item), future))
+
+            fill()
+            while window:
+                (pdb_id, emdb_id, item), future = window.popleft()
+                start = time.time()
+                try:
+                    structure_path, map_path = future.result()
+                    error = None
+                except Exception as e:
+                    structure_path = map_path = None
+                    error = e
+                self.wait_time += time.time() - start
+
+                # Keep the next entries downloading while this one is processed
+                fill()
+                yield PrefetchedEntry(pdb_id, emdb_id, item, structure_path, map_path, error)
@@ -0,0 +1,115 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import qscore_engine
+from motif_jobs import parse_key, list_jobs, write_rows, open_table
+
+MOTIF_COLUMNS = ["key", "emdb_id", "pdb_id", "motif_type", "internal_id", "status", "atoms", "qscore"]
+RESIDUE_COLUMNS = ["key"] + qscore_engine.QSCORE_COLUMNS
+
+
+def motifs_path(output_csv):
+    return f"{os.path.splitext(output_csv)[0]}_motifs.csv"
+
+
+def load_completed(output_csv, retry_failed=False):
+    """
+    Keys recorded in the motif table of a previous run. Residue rows of motifs that were not
+    recorded (the run stopped while writing them) are dropped so they are not duplicated.
+    """
+    completed = set()
+    if os.path.isfile(motifs_path(output_csv)):
+        with open(motifs_path(output_csv), newline="") as f:
+            rows = list(csv.DictReader(f))
+        if retry_failed:
+            kept = [row for row in rows if row["status"] == "ok"]
+            if len(kept) != len(rows):
+                write_rows(motifs_path(output_csv), MOTIF_COLUMNS, kept)
+            rows = kept
+        completed = {row["key"] for row in rows}
+
+    if os.path.isfile(output_csv):
+        with open(output_csv, newline="") as f:
+            rows = list(csv.DictReader(f))
+        kept = [row for row in rows if row["key"] in completed]
+        if len(kept) != len(rows):
+            write_rows(output_csv, RESIDUE_COLUMNS, kept)
+    return completed
+
+
+def score_motif(job):
+    map_path, pdb_path = job
+    key, emdb_id, pdb_id, motif_type, internal_id = parse_key(map_path)
+    motif = {"key": key, "emdb_id": emdb_id, "pdb_id": pdb_id, "motif_type": motif_type,
+             "internal_id": internal_id, "status": "ok", "atoms": 0, "qscore": ""}
+    try:
+        rows, mean = qscore_engine.compute_qscore(pdb_path, map_path)
+    except Exception as e:
+        print(f"Error processing {map_path} and {pdb_path}: {e}")
+        motif["status"] = "failed"
+        return motif, []
+    motif["atoms"] = sum(row["atoms"] for row in rows)
+    motif["qscore"] = mean
+    return motif, [{"key": key, **row} for row in rows]
+
+
+def run_batch(jobs, output_csv, workers=os.cpu_count(), retry_failed=False, report_every=100):
+    """
+    Score every (map_path, pdb_path) job with qscore_engine in a process pool. Per-residue
+    Q-scores of all motifs are appended to output_csv and one row per motif (status and mean
+    Q-score) to <output>_motifs.csv, which also records the finished keys: a rerun skips them.
+    :return Number of motifs scored in this run
+    """
+    completed = load_completed(output_csv, retry_failed)
+    todo = [job for job in jobs if parse_key(job[0])[0] not in completed]
+    print(f"{len(jobs) - len(todo)} of {len(jobs)} motifs already scored, {len(todo)} to go with {workers} workers")
+    if not todo:
+        return 0
+
+    residue_file, residue_writer = open_table(output_csv, RESIDUE_COLUMNS)
+    motif_file, motif_writer = open_table(motifs_path(output_csv), MOTIF_COLUMNS)
+    start = time.time()
+    done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(score_motif, job) for job in todo]
+            for future in as_completed(futures):
+                motif, rows = future.result()
+                # Residue rows first, the motif row marks the key as finished
+                residue_writer.writerows(rows)
+                residue_file.flush()
+                motif_writer.writerow(motif)
+                motif_file.flush()
+                done += 1
+                if done % report_every == 0 or done == len(todo):
+                    elapsed = time.time() - start
+                    print(f"[{done}/{len(todo)}] {done / elapsed:.1f} motifs/sec")
+    finally:
+        residue_file.close()
+        motif_file.close()
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute Q-scores of segmented motifs in parallel")
+    parser.add_argument("source", help="manifest.csv of segment_driver.py or a folder of segmented .mrc maps")
+    parser.add_argument("output_csv", help="Consolidated per-residue output, motifs go to <output>_motifs.csv")
+    parser.add_argument("--pdb-dir", default=None, help="Folder of the motif models if source is a folder")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--retry-failed", action="store_true", help="Score motifs that failed in a previous run")
+    args = parser.parse_args()
+
+    jobs = list_jobs(args.source, args.pdb_dir)
+    if not jobs:
+        print("No motifs found.")
+        sys.exit(1)
+    start = time.time()
+    count = run_batch(jobs, args.output_csv, args.workers, args.retry_failed)
+    if count:
+        print(f"Scored {count} motifs in {time.time() - start:.0f}s ({count / (time.time() - start):.1f} motifs/sec)")
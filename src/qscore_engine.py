@@ -0,0 +1,199 @@
+import os
+import sys
+import csv
+import argparse
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from segment_engine import DensityMap, load_structure
+
+# Parameters of the ChimeraX run in qscoreCompute.computeQscore
+POINTS_PER_SHELL = 8
+SHELL_RADIUS_STEP = 0.1
+MAX_SHELL_RADIUS = 2.0
+REFERENCE_GAUSSIAN_SIGMA = 0.6
+# Candidate points per shell are increased through these multiples of POINTS_PER_SHELL until
+# enough of them are closer to the scored atom than to any other atom
+CANDIDATE_MULTIPLES = (1, 2, 4, 8, 16, 32)
+ATOM_BATCH = 2048
+QSCORE_COLUMNS = ["chain", "residue", "number", "atoms", "qscore"]
+
+
+def sphere_points(n):
+    """n points spread evenly on the unit sphere (Fibonacci lattice)."""
+    i = np.arange(n) + 0.5
+    phi = np.arccos(1 - 2 * i / n)
+    theta = np.pi * (1 + 5 ** 0.5) * i
+    return np.column_stack([np.cos(theta) * np.sin(phi), np.sin(theta) * np.sin(phi), np.cos(phi)])
+
+
+def shell_radii(step=SHELL_RADIUS_STEP, max_radius=MAX_SHELL_RADIUS):
+    return np.arange(int(round(max_radius / step)) + 1) * step
+
+
+def reference_gaussian(radii, mean, std, sigma=REFERENCE_GAUSSIAN_SIGMA):
+    # Reference profile of Pintilie et al. 2020: A * exp(-r^2 / 2 sigma^2) + B
+    a = mean + 10 * std
+    b = mean - std
+    return a * np.exp(-0.5 * (radii / sigma) ** 2) + b
+
+
+def shell_sample_points(coords, tree, radii, points_per_shell=POINTS_PER_SHELL):
+    """
+    Pick up to points_per_shell points on each shell of every atom that are closer to that
+    atom than to any other atom of the model. The shell of radius 0 is the atom centre.
+    :param coords: (n, 3) coordinates of the scored atoms, all of which are in tree
+    :return points (n, shells, points_per_shell, 3) and their validity mask (n, shells, points_per_shell)
+    """
+    n, shells = len(coords), len(radii)
+    points = np.repeat(coords[:, None, None, :], shells * points_per_shell, axis=1).reshape(
+        n, shells, points_per_shell, 3)
+    valid = np.zeros((n, shells, points_per_shell), dtype=bool)
+    valid[:, 0, :] = True
+    pending = np.ones((n, shells), dtype=bool)
+    pending[:, 0] = False
+
+    _, self_index = tree.query(coords, k=1)
+    for multiple in CANDIDATE_MULTIPLES:
+        atom_idx, shell_idx = np.nonzero(pending)
+        if atom_idx.size == 0:
+            break
+        unit = sphere_points(points_per_shell * multiple)
+        candidates = coords[atom_idx, None, :] + radii[shell_idx, None, None] * unit[None, :, :]
+        _, nearest = tree.query(candidates.reshape(-1, 3), k=1)
+        accepted = (nearest.reshape(len(atom_idx), -1) == self_index[atom_idx, None])
+
+        enough = accepted.sum(axis=1) >= points_per_shell
+        last = multiple == CANDIDATE_MULTIPLES[-1]
+        take = enough | last
+        # Keep the first points_per_shell accepted candidates of the shells that are done
+        rank = np.cumsum(accepted, axis=1) - 1
+        keep = accepted & (rank < points_per_shell) & take[:, None]
+        rows, cols = np.nonzero(keep)
+        slots = rank[rows, cols]
+        points[atom_idx[rows], shell_idx[rows], slots] = candidates[rows, cols]
+        valid[atom_idx[rows], shell_idx[rows], slots] = True
+        pending[atom_idx[take], shell_idx[take]] = False
+    return points, valid
+
+
+def map_indexes(density_map, points):
+    # (x, y, z) coordinates to fractional (z, y, x) array indexes
+    ijk = (points - density_map.origin) / density_map.voxel_size
+    return ijk[..., ::-1]
+
+
+def atom_qscores(density_map, coords, all_coords=None, points_per_shell=POINTS_PER_SHELL,
+                 shell_radius_step=SHELL_RADIUS_STEP, max_shell_radius=MAX_SHELL_RADIUS,
+                 sigma=REFERENCE_GAUSSIAN_SIGMA, map_mean=None, map_std=None):
+    """
+    Q-scores of atoms, the correlation of the map values on shells around each atom with
+    a reference Gaussian profile.
+    :param density_map: DensityMap
+    :param coords: (n, 3) coordinates of the atoms to score
+    :param all_coords: Coordinates of every atom of the model, used to discard shell points
+                       closer to another atom (defaults to coords)
+    :param map_mean, map_std: Statistics for the reference profile, defaults to the whole map
+    :return (n,) Q-scores, NaN where the sampled values are constant
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    all_coords = coords if all_coords is None else np.asarray(all_coords, dtype=np.float64).reshape(-1, 3)
+    radii = shell_radii(shell_radius_step, max_shell_radius)
+    if map_mean is None or map_std is None:
+        data = np.asarray(density_map.data, dtype=np.float64)
+        map_mean, map_std = data.mean(), data.std()
+    reference = reference_gaussian(radii, map_mean, map_std, sigma)
+
+    tree = cKDTree(all_coords)
+    data = np.asarray(density_map.data, dtype=np.float32)
+    scores = np.empty(len(coords))
+    for start in range(0, len(coords), ATOM_BATCH):
+        batch = coords[start:start + ATOM_BATCH]
+        points, valid = shell_sample_points(batch, tree, radii, points_per_shell)
+
+        # One trilinear interpolation of every shell point of the batch
+        indexes = map_indexes(density_map, points[valid]).T
+        values = np.zeros(valid.shape)
+        values[valid] = ndimage.map_coordinates(data, indexes, order=1, mode="constant", cval=0.0)
+
+        # Pearson correlation per atom over its valid points, vectorized with masked sums
+        v = np.broadcast_to(reference[None, :, None], valid.shape)
+        count = valid.sum(axis=(1, 2))
+        u_mean = values.sum(axis=(1, 2)) / count
+        v_mean = np.where(valid, v, 0).sum(axis=(1, 2)) / count
+        du = np.where(valid, values - u_mean[:, None, None], 0)
+        dv = np.where(valid, v - v_mean[:, None, None], 0)
+        numerator = (du * dv).sum(axis=(1, 2))
+        denominator = np.sqrt((du ** 2).sum(axis=(1, 2)) * (dv ** 2).sum(axis=(1, 2)))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores[start:start + len(batch)] = np.where(denominator > 0, numerator / denominator, np.nan)
+    return scores
+
+
+def model_atoms(structure, include_hydrogens=False):
+    """Atoms of the first model, hydrogens are excluded like the ChimeraX default."""
+    model = next(iter(structure))
+    atoms = [atom for atom in model.get_atoms() if include_hydrogens or atom.element not in ("H", "D")]
+    coords = np.array([atom.get_coord() for atom in atoms], dtype=np.float64).reshape(-1, 3)
+    return atoms, coords
+
+
+def residue_qscores(atoms, scores):
+    """Mean atom Q-score of every residue, in model order."""
+    residues = {}
+    for atom, score in zip(atoms, scores):
+        residue = atom.get_parent()
+        key = (residue.get_parent().id, residue.id)
+        if key not in residues:
+            residues[key] = {"chain": key[0], "residue": residue.get_resname().strip(),
+                             "number": f"{residue.id[1]}{residue.id[2].strip()}", "scores": []}
+        residues[key]["scores"].append(score)
+
+    rows = []
+    for row in residues.values():
+        scores = np.array(row.pop("scores"))
+        row["atoms"] = len(scores)
+        row["qscore"] = float(np.nanmean(scores)) if np.isfinite(scores).any() else float("nan")
+        rows.append(row)
+    return rows
+
+
+def compute_qscore(structure_path, map_path, output_csv=None, **params):
+    """
+    Per-residue Q-scores of a model in a map, the native equivalent of
+    qscoreCompute.computeQscore. Writes the residue table to output_csv if given.
+    :return Residue rows and the mean Q-score over all atoms
+    """
+    atoms, coords = model_atoms(load_structure(structure_path))
+    with DensityMap.open(map_path) as density_map:
+        scores = atom_qscores(density_map, coords, **params)
+    rows = residue_qscores(atoms, scores)
+    if output_csv:
+        with open(output_csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=QSCORE_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    mean = float(np.nanmean(scores)) if np.isfinite(scores).any() else float("nan")
+    return rows, mean
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute per-residue Q-scores without ChimeraX")
+    parser.add_argument("structure", help="PDB or mmCIF file of the model")
+    parser.add_argument("map", help="Density map (.mrc/.map/.map.gz)")
+    parser.add_argument("--output", default=None, help="CSV of per-residue Q-scores")
+    parser.add_argument("--points-per-shell", type=int, default=POINTS_PER_SHELL)
+    parser.add_argument("--shell-radius-step", type=float, default=SHELL_RADIUS_STEP)
+    parser.add_argument("--max-shell-radius", type=float, default=MAX_SHELL_RADIUS)
+    parser.add_argument("--sigma", type=float, default=REFERENCE_GAUSSIAN_SIGMA, help="Reference Gaussian sigma")
+    args = parser.parse_args()
+
+    rows, mean = compute_qscore(args.structure, args.map, args.output, points_per_shell=args.points_per_shell,
+                                shell_radius_step=args.shell_radius_step, max_shell_radius=args.max_shell_radius,
+                                sigma=args.sigma)
+    for row in rows:
+        print(f"{row['chain']}\t{row['residue']}\t{row['number']}\t{row['qscore']:.3f}")
+    print(f"Mean Q-score: {mean:.3f} over {sum(row['atoms'] for row in rows)} atoms")
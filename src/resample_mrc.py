@@ -1,5 +1,6 @@
 # from deeptracer.common.logging import Logger
 from copy import deepcopy
+from collections import namedtuple
 from scipy import sparse
 from scipy.sparse.linalg import spsolve_triangular
 import numpy as np
@@ -7,10 +8,19 @@ import math
 import time
 import mrcfile
 import sys
+import argparse
 
 TARGET_VOXEL = 0.5
+RESAMPLE_METHODS = ("gather", "legacy")
+SLAB_BYTES = 256 * 1024 * 1024
+PERCENTILE_BINS = 4096
+PERCENTILE_CANDIDATES = 1 << 20
 
-def resample_mrc(threshold_manual: float, input_filename: str, output_filename: str, voxelSize=0.5):
+# In-memory result of resample_mrc: (z, y, x) data, (x, y, z) origin of its first voxel and voxel size
+ResampledMap = namedtuple("ResampledMap", ["data", "origin", "voxel_size"])
+
+def resample_mrc(threshold_manual: float, input_filename: str, output_filename: str = None, voxelSize=0.5,
+                 method: str = "gather", with_metadata: bool = False):
     """
     Crops density map to area with high density values and reSamples map on grid
     with voxel size of 0.5.  Algorithm is based on triLinear interpolation, detail
@@ -21,7 +31,13 @@ def resample_mrc(threshold_manual: float, input_filename: str, output_filename:
     :param input_filename: Input directory of map file
     :param output_filename: Output directory of map file
     :param voxelSize: ReSampling output voxel size (Note: voxelSize=0.5 option is specifically designed for DeepTracer)
+    :param method: Interpolation engine, one of RESAMPLE_METHODS. "gather" is the default vectorized engine,
+                   "legacy" keeps the original coefficient/sparse solve implementation for regression comparison
+    :param with_metadata: Return a ResampledMap with the new origin and voxel size instead of the data only
+    :return ReSampled data, the map is only written to disk if output_filename is given
     """
+    if method not in RESAMPLE_METHODS:
+        raise ValueError(f"Unknown resampling method {method!r}, expected one of {RESAMPLE_METHODS}")
     np.set_printoptions(threshold=sys.maxsize)
     # print(f"Re-sampling density map on new grid with voxel size %s {voxelSize}")
     with mrcfile.open(input_filename) as mrc:
@@ -32,44 +48,309 @@ def resample_mrc(threshold_manual: float, input_filename: str, output_filename:
         nystart = deepcopy(mrc.header.nystart)
         nzstart = deepcopy(mrc.header.nzstart)
 
-    # If voxelSize=0.5, using DeepTracer standard. Only keep area of map which contains the highest 1% of values
+    resampledData, (new_ox, new_oy, new_oz) = resample_volume(
+        data, v, origin, (nxstart, nystart, nzstart), threshold_manual, voxelSize, method)
+
+    # Save the reSampled file into the output directory
+    if output_filename:
+        with mrcfile.new(output_filename, overwrite=True) as mrc:
+            mrc.set_data(resampledData)
+            # print(f"Resampled data {resampledData}")
+            set_resampled_header(mrc, (new_ox, new_oy, new_oz), voxelSize)
+            # print(f"Size of new map is {resampledData.shape} at output {output_filename}")
+            mrc.update_header_stats()
+    if with_metadata:
+        return ResampledMap(resampledData, (float(new_ox), float(new_oy), float(new_oz)), voxelSize)
+    return resampledData
+
+
+def resample_volume(data: np.ndarray, v, origin, nstart, threshold_manual: float = 0, voxelSize=0.5,
+                    method: str = "gather"):
+    """
+    In-memory core of resample_mrc for a density map that is already loaded
+    :param data: Original density map
+    :param v: Original voxel size
+    :param origin: Original header origin
+    :param nstart: Original (nxstart, nystart, nzstart)
+    :param threshold_manual: Density threshold, the 99th percentile is used if it is < 0
+    :param voxelSize: ReSampling output voxel size
+    :param method: Interpolation engine, one of RESAMPLE_METHODS
+    :return ReSampled data and its new (x, y, z) origin
+    """
+    if method not in RESAMPLE_METHODS:
+        raise ValueError(f"Unknown resampling method {method!r}, expected one of {RESAMPLE_METHODS}")
+    (old_ox, old_oy, old_oz), (new_ox, new_oy, new_oz), (depth, height, width) = resample_grid(
+        data, v, origin, nstart, threshold_manual, voxelSize)
+
+    # Pre-recording axis information
+    # xx, yy, zz records the corresponding index of each voxel in the original density map
+    # x_d, y_d, z_d records the remainder to each corresponding index (refer z_d, y_d, x_d in triLinear interpolation)
+    xx, x_d = axis_info(old_ox, new_ox, width, v.x, voxelSize)
+    yy, y_d = axis_info(old_oy, new_oy, height, v.y, voxelSize)
+    zz, z_d = axis_info(old_oz, new_oz, depth, v.z, voxelSize)
+
+    start_time = time.time()
+    if method == "gather":
+        resampledData = trilinear_gather(data, zz, z_d, yy, y_d, xx, x_d)
+    else:
+        meanVoxelSize = (v.x + v.y + v.z) / 3
+        resampledData = trilinear_legacy(data, zz, z_d, yy, y_d, xx, x_d, meanVoxelSize > voxelSize / 2)
+    myAlgorithmTime = time.time() - start_time
+    # print(f"Resampling finished. Runtime: {myAlgorithmTime}")
+
+    return resampledData, (new_ox, new_oy, new_oz)
+
+
+def resample_mrc_streaming(threshold_manual: float, input_filename: str, output_filename: str, voxelSize=0.5,
+                           slab_bytes: int = SLAB_BYTES):
+    """
+    Out-of-core version of resample_mrc for full size maps. The input map is memory-mapped and reSampled in
+    z-slabs (with a one voxel halo for the upper interpolation corner), and every slab is written directly into
+    a pre-allocated memory-mapped output file, so peak memory is bounded by slab_bytes instead of the map size.
+    (Note: If voxelSize=0.5 and threshold_manual < 0, the 99th percentile is also computed slab by slab, see
+    slab_percentile)
+
+    :param threshold_manual: Density threshold, the 99th percentile is used if it is < 0
+    :param input_filename: Input directory of map file
+    :param output_filename: Output directory of map file
+    :param voxelSize: ReSampling output voxel size
+    :param slab_bytes: Approximate memory budget of one slab in bytes
+    :return Shape of the reSampled map
+    """
+    with mrcfile.mmap(input_filename, mode='r') as mrc:
+        data = mrc.data
+        v = deepcopy(mrc.voxel_size)
+        origin = deepcopy(mrc.header.origin)
+        nstart = (int(mrc.header.nxstart), int(mrc.header.nystart), int(mrc.header.nzstart))
+
+        in_plane_bytes = data.shape[1] * data.shape[2] * 4
+        (old_ox, old_oy, old_oz), new_origin, (depth, height, width) = resample_grid(
+            data, v, origin, nstart, threshold_manual, voxelSize, max(1, slab_bytes // in_plane_bytes))
+
+        xx, x_d = axis_info(old_ox, new_origin[0], width, v.x, voxelSize)
+        yy, y_d = axis_info(old_oy, new_origin[1], height, v.y, voxelSize)
+        zz, z_d = axis_info(old_oz, new_origin[2], depth, v.z, voxelSize)
+
+        # Memory of one output plane: its share of the input slab and two float32 temporaries per interpolated axis
+        plane_bytes = in_plane_bytes * (voxelSize / v.z + 2) + 8 * height * (data.shape[2] + width)
+        slab_depth = max(1, int(slab_bytes // plane_bytes))
+
+        dmin, dmax, total, total_sq = np.inf, -np.inf, 0.0, 0.0
+        with mrcfile.new_mmap(output_filename, shape=(depth, height, width), mrc_mode=2, overwrite=True) as out:
+            for k0 in range(0, depth, slab_depth):
+                k1 = min(k0 + slab_depth, depth)
+                z_lo, z_hi = zz[k0], min(zz[k1 - 1] + 2, data.shape[0])
+                slab = trilinear_gather(data[z_lo:z_hi], zz[k0:k1] - z_lo, z_d[k0:k1], yy, y_d, xx, x_d)
+                out.data[k0:k1] = slab
+
+                dmin, dmax = min(dmin, slab.min()), max(dmax, slab.max())
+                total += slab.sum(dtype=np.float64)
+                total_sq += np.square(slab, dtype=np.float64).sum()
+
+            set_resampled_header(out, new_origin, voxelSize)
+            # Header statistics are accumulated per slab instead of update_header_stats reading the whole map
+            count = depth * height * width
+            out.header.dmin, out.header.dmax = dmin, dmax
+            out.header.dmean = total / count
+            out.header.rms = math.sqrt(max(total_sq / count - (total / count) ** 2, 0.0))
+    return depth, height, width
+
+
+def set_resampled_header(mrc, new_origin, voxelSize: float):
+    """
+    Set the origin and voxel size of a reSampled map
+    :param mrc: Output MrcFile
+    :param new_origin: New (x, y, z) origin
+    :param voxelSize: ReSampling output voxel size
+    """
+    mrc.header.nxstart, mrc.header.nystart, mrc.header.nzstart = 0, 0, 0
+    mrc.header.origin = np.array(tuple(new_origin),
+                                 dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4')]).view(np.recarray)
+    mrc.voxel_size = np.array((voxelSize, voxelSize, voxelSize),
+                              dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4')]).view(np.recarray)
+
+
+def resample_grid(data: np.ndarray, v, origin, nstart, threshold_manual: float, voxelSize: float,
+                  slab_depth: int = None):
+    """
+    Calculate the reSampling grid of a density map. If voxelSize=0.5, using DeepTracer standard and only keep
+    area of map which contains the highest 1% of values (or the values above threshold_manual if it is >= 0)
+    :param data: Original density map, may be a memory-mapped array
+    :param v: Original voxel size
+    :param origin: Original header origin
+    :param nstart: Original (nxstart, nystart, nzstart)
+    :param threshold_manual: Density threshold, the 99th percentile is used if it is < 0
+    :param voxelSize: ReSampling output voxel size
+    :param slab_depth: Number of z planes scanned at once when searching the high density area, the whole
+                       map is scanned at once if None
+    :return Old origin, new origin and new (depth, height, width)
+    """
+    nxstart, nystart, nzstart = nstart
+    old_ox = origin.x + nxstart * v.x
+    old_oy = origin.y + nystart * v.y
+    old_oz = origin.z + nzstart * v.z
+
     if voxelSize == 0.5:
-        temp_data = deepcopy(data)
-        threshold = np.percentile(temp_data, 99.0)
-        if (threshold_manual >= 0.0):
-            threshold = threshold_manual
+        threshold = threshold_manual
+        if threshold_manual < 0.0:
+            threshold = np.percentile(data, 99.0) if slab_depth is None else slab_percentile(data, 99.0, slab_depth)
         # print(f"Density threshold is set to {threshold}") # Let's get the threshold number
-        temp_data[temp_data < threshold] = 0
-        k_list, j_list, i_list = [sorted(i) for i in np.nonzero(temp_data)]
-        old_ox = origin.x + nxstart * v.x
-        old_oy = origin.y + nystart * v.y
-        old_oz = origin.z + nzstart * v.z
+        (k_min, k_max), (j_min, j_max), (i_min, i_max) = threshold_bounds(data, threshold, slab_depth)
 
         # New dimensions before reSampling
-        width = (int((i_list[-1] - i_list[0]) * v.x) + 10) * 2
-        height = (int((j_list[-1] - j_list[0]) * v.y) + 10) * 2
-        depth = (int((k_list[-1] - k_list[0]) * v.z) + 10) * 2
+        width = (int((i_max - i_min) * v.x) + 10) * 2
+        height = (int((j_max - j_min) * v.y) + 10) * 2
+        depth = (int((k_max - k_min) * v.z) + 10) * 2
 
         # New origin
-        new_ox = old_ox + (i_list[0] * v.x) - 5
-        new_oy = old_oy + (j_list[0] * v.y) - 5
-        new_oz = old_oz + (k_list[0] * v.z) - 5
-
-        # Delete variable to save memory
-        del temp_data, i_list, j_list, k_list
+        new_ox = old_ox + (i_min * v.x) - 5
+        new_oy = old_oy + (j_min * v.y) - 5
+        new_oz = old_oz + (k_min * v.z) - 5
     else:
-        new_ox = old_ox = origin.x + nxstart * v.x
-        new_oy = old_oy = origin.y + nystart * v.y
-        new_oz = old_oz = origin.z + nzstart * v.z
+        new_ox, new_oy, new_oz = old_ox, old_oy, old_oz
         width = math.floor((data.shape[2] * v.x) / voxelSize)
         height = math.floor((data.shape[1] * v.y) / voxelSize)
         depth = math.floor((data.shape[0] * v.z) / voxelSize)
 
-
     # Adjust the reSampling dimensions and origin if it is go beyond the original shape
     new_ox, width = adjust_dim(old_ox, new_ox, data.shape[2], width, v.x, voxelSize)
     new_oy, height = adjust_dim(old_oy, new_oy, data.shape[1], height, v.y, voxelSize)
     new_oz, depth = adjust_dim(old_oz, new_oz, data.shape[0], depth, v.z, voxelSize)
+    return (old_ox, old_oy, old_oz), (new_ox, new_oy, new_oz), (depth, height, width)
+
+
+def slab_percentile(data: np.ndarray, q: float, slab_depth: int = None, bins: int = PERCENTILE_BINS,
+                    max_candidates: int = PERCENTILE_CANDIDATES) -> float:
+    """
+    np.percentile(data, q) (linear interpolation) without loading the whole map. Every pass reads the map in
+    z-slabs and histograms the values of the current range, which is narrowed to the bin holding the two order
+    statistics around the percentile until at most max_candidates values remain, these are then sorted
+    :param data: Density map, may be a memory-mapped array
+    :param q: Percentile in [0, 100]
+    :param slab_depth: Number of z planes read at once, the whole map is read at once if None
+    :param bins: Histogram bins per pass
+    :param max_candidates: Largest number of values that are collected and sorted
+    :return Percentile as a float
+    """
+    slab_depth = slab_depth or data.shape[0]
+
+    def values_in(lo, hi):
+        for z0 in range(0, data.shape[0], slab_depth):
+            slab = np.asarray(data[z0:z0 + slab_depth], dtype=np.float64).ravel()
+            yield slab[(slab >= lo) & (slab < hi)]
+
+    position = q / 100.0 * (data.size - 1)
+    rank = int(math.floor(position))
+    next_rank, fraction = min(rank + 1, data.size - 1), position - rank
+
+    # Values are selected on the half-open range [lo, hi), below counts the values smaller than lo
+    lo = min(float(np.min(data[z0:z0 + slab_depth])) for z0 in range(0, data.shape[0], slab_depth))
+    hi = np.nextafter(max(float(np.max(data[z0:z0 + slab_depth])) for z0 in range(0, data.shape[0], slab_depth)),
+                      np.inf)
+    below = 0
+    while True:
+        edges = np.linspace(lo, hi, bins + 1)
+        counts = np.zeros(bins, dtype=np.int64)
+        for values in values_in(lo, hi):
+            counts += np.bincount(np.searchsorted(edges, values, side="right") - 1, minlength=bins)[:bins]
+        cumulative = np.cumsum(counts)
+        first = int(np.searchsorted(cumulative, rank - below, side="right"))
+        last = int(np.searchsorted(cumulative, next_rank - below, side="right"))
+        if first != last:
+            # The bins in between are empty, so the order statistics are the largest value of the first
+            # bin and the smallest value of the last one
+            low = max(v.max() for v in values_in(edges[first], edges[first + 1]) if v.size)
+            high = min(v.min() for v in values_in(edges[last], edges[last + 1]) if v.size)
+            return float(low + (high - low) * fraction)
+
+        below += int(cumulative[first - 1]) if first else 0
+        lo, hi = edges[first], edges[first + 1]
+        if np.nextafter(lo, np.inf) >= hi:
+            return float(lo)
+        if counts[first] <= max_candidates:
+            candidates = np.sort(np.concatenate(list(values_in(lo, hi))))
+            low, high = candidates[rank - below], candidates[next_rank - below]
+            return float(low + (high - low) * fraction)
+
+
+def threshold_bounds(data: np.ndarray, threshold: float, slab_depth: int = None):
+    """
+    Find the bounding box of the non-zero voxels whose value is >= threshold
+    :param data: Density map, may be a memory-mapped array
+    :param threshold: Density threshold
+    :param slab_depth: Number of z planes scanned at once, the whole map is scanned at once if None
+    :return (min, max) index of the bounding box along z, y and x
+    """
+    slab_depth = slab_depth or data.shape[0]
+    z_hits, y_hits, x_hits = [], np.zeros(data.shape[1], dtype=bool), np.zeros(data.shape[2], dtype=bool)
+    for z0 in range(0, data.shape[0], slab_depth):
+        slab = np.asarray(data[z0:z0 + slab_depth])
+        mask = (slab >= threshold) & (slab != 0)
+        z_hits.append(mask.any(axis=(1, 2)))
+        y_hits |= mask.any(axis=(0, 2))
+        x_hits |= mask.any(axis=(0, 1))
+    bounds = []
+    for hits in (np.concatenate(z_hits), y_hits, x_hits):
+        index = np.flatnonzero(hits)
+        if index.size == 0:
+            raise ValueError(f"No density values above threshold {threshold}")
+        bounds.append((index[0], index[-1]))
+    return bounds
+
+
+def trilinear_gather(data: np.ndarray, zz: np.ndarray, z_d: np.ndarray, yy: np.ndarray, y_d: np.ndarray,
+                     xx: np.ndarray, x_d: np.ndarray) -> np.ndarray:
+    """
+    Vectorized triLinear interpolation. Since the triLinear weights of the eight corners of a cube are separable,
+    the corners are gathered axis by axis (z, then y, then x) with fancy indexing and weighted by (1 - d, d) of that
+    axis. This gives the same result as summing the eight corner gathers, without the (depth, height, width, 8)
+    coefficient array or the sparse solve of trilinear_legacy.
+    :param data: Original density map
+    :param zz, yy, xx: Index of each new voxel in the original density map (see axis_info)
+    :param z_d, y_d, x_d: Remainder of each index (see axis_info)
+    :return ReSampled data
+    """
+    try:
+        resampledData = interpolate_axis(data, zz, z_d, 0)
+        resampledData = interpolate_axis(resampledData, yy, y_d, 1)
+        resampledData = interpolate_axis(resampledData, xx, x_d, 2)
+    except MemoryError as e:
+        raise MemoryError('Map is too large to allocate resampled array')
+    return resampledData
+
+
+def interpolate_axis(data: np.ndarray, indexes: np.ndarray, remainder: np.ndarray, axis: int) -> np.ndarray:
+    """
+    Linear interpolation of a 3D array along one axis
+    :param data: 3D array
+    :param indexes: Lower index of each new position along the axis
+    :param remainder: Remainder of each index
+    :param axis: Axis to interpolate along
+    :return Interpolated float32 array, only one temporary array of the output size is created
+    """
+    shape = [1, 1, 1]
+    shape[axis] = -1
+    upper = np.minimum(indexes + 1, data.shape[axis] - 1)
+    result = np.take(data, indexes, axis=axis).astype('float32', copy=False)
+    result *= (1 - remainder).reshape(shape)
+    temp = np.take(data, upper, axis=axis).astype('float32', copy=False)
+    temp *= remainder.reshape(shape)
+    result += temp
+    return result
+
+
+def trilinear_legacy(data: np.ndarray, zz: np.ndarray, z_d: np.ndarray, yy: np.ndarray, y_d: np.ndarray,
+                     xx: np.ndarray, x_d: np.ndarray, optimized: bool) -> np.ndarray:
+    """
+    Original triLinear interpolation, kept for regression comparison against trilinear_gather. Every output voxel
+    gets the 8 coefficients of its cube by solving the triLinear interpolation matrix with spsolve_triangular.
+    :param data: Original density map
+    :param zz, yy, xx: Index of each new voxel in the original density map (see axis_info)
+    :param z_d, y_d, x_d: Remainder of each index (see axis_info)
+    :param optimized: Use the runtime optimized approach, only valid when every original value is used at least once
+    :return ReSampled data
+    """
+    depth, height, width = len(zz), len(yy), len(xx)
 
     #  Try to create an array to resample the map onto
     try:
@@ -80,8 +361,6 @@ def resample_mrc(threshold_manual: float, input_filename: str, output_filename:
 
     # ReSampling method based on triLinear interpolation, detail information can be found in
     # https://en.wikipedia.org/wiki/Trilinear_interpolation
-    start_time = time.time()
-    # print('Running resampling ...')
     # Initializing triLinear interpolation matrix. A small modified version of the original triLinear interpolation M
     triLinearInterpolationM = sparse.csr_matrix([[1, 0, 0, 0, 0, 0, 0, 0],
                                                  [1, 1, 0, 0, 0, 0, 0, 0],
@@ -91,12 +370,6 @@ def resample_mrc(threshold_manual: float, input_filename: str, output_filename:
                                                  [1, 1, 0, 0, 1, 1, 0, 0],
                                                  [1, 0, 1, 0, 1, 0, 1, 0],
                                                  [1, 1, 1, 1, 1, 1, 1, 1]])
-    # Pre-recording axis information
-    # xx, yy, zz records the corresponding index of each voxel in the original density map
-    # x_d, y_d, z_d records the remainder to each corresponding index (refer z_d, y_d, x_d in triLinear interpolation)
-    xx, x_d = axis_info(old_ox, new_ox, width, v.x, voxelSize)
-    yy, y_d = axis_info(old_oy, new_oy, height, v.y, voxelSize)
-    zz, z_d = axis_info(old_oz, new_oz, depth, v.z, voxelSize)
     x_d = x_d.reshape((1, 1, width))
     y_d = y_d.reshape((1, height, 1))
     z_d = z_d.reshape((depth, 1, 1))
@@ -106,8 +379,7 @@ def resample_mrc(threshold_manual: float, input_filename: str, output_filename:
     # Approach explanation: If the original voxel size is > half of the target reSampling voxel size,
     # every value in the original density map will be used at least once, so using optimized method
     # is faster since it assumes every value will be used at least once, vice-versa.
-    meanVoxelSize = (v.x + v.y + v.z) / 3
-    if meanVoxelSize > voxelSize / 2:
+    if optimized:
         # Pre-calculate z direction index tuple used for array querying
         data = data[zz[0]:zz[-1] + 2, yy[0]:yy[-1] + 2, xx[0]:xx[-1] + 2]
         zz, yy, xx = zz - zz[0], yy - yy[0], xx - xx[0]
@@ -156,20 +428,6 @@ def resample_mrc(threshold_manual: float, input_filename: str, output_filename:
     resampledData = np.empty((depth, height, width), dtype='float32')
     resampledData[:, :, :] = s[:, :, :, 0] + s[:, :, :, 1] * z_d + (s[:, :, :, 2] + s[:, :, :, 3] * z_d) * y_d
     resampledData[:, :, :] += (s[:, :, :, 4] + s[:, :, :, 5] * z_d + (s[:, :, :, 6] + s[:, :, :, 7] * z_d) * y_d) * x_d
-    myAlgorithmTime = time.time() - start_time
-    # print(f"Resampling finished. Runtime: {myAlgorithmTime}")
-
-    # Save the reSampled file into the output directory
-    with mrcfile.new(output_filename, overwrite=True) as mrc:
-        mrc.set_data(resampledData)
-        # print(f"Resampled data {resampledData}")
-        mrc.header.nxstart, mrc.header.nystart, mrc.header.nzstart = 0, 0, 0
-        mrc.header.origin = np.array((new_ox, new_oy, new_oz),
-                                     dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4')]).view(np.recarray)
-        mrc.voxel_size = np.array((voxelSize, voxelSize, voxelSize),
-                                  dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4')]).view(np.recarray)
-        # print(f"Size of new map is {resampledData.shape} at output {output_filename}")
-        mrc.update_header_stats()
     return resampledData
 
 
@@ -209,11 +467,9 @@ def axis_info(old_ori: float, new_ori: float, new_dim: int, old_vox: float, new_
     :param new_vox: New voxel size
     :return The list of index and the list remainder of each index
     """
-    indexes, remainder = np.empty(new_dim, dtype='int'), np.empty(new_dim, dtype='float32')
-    for i in range(new_dim):
-        temp = (new_ori + i * new_vox - old_ori) / old_vox
-        remainder[i] = temp % 1
-        indexes[i] = math.floor(temp)
+    temp = (float(new_ori) + np.arange(new_dim) * new_vox - float(old_ori)) / float(old_vox)
+    indexes = np.floor(temp).astype('int')
+    remainder = (temp - indexes).astype('float32')
     return indexes, remainder
 
 
@@ -223,11 +479,29 @@ def index_range(array: np.array) -> np.array:
     number's starting index and ending index.
     :param array: 1D numpy ordered numpy array, array value must start from 0
     """
+    values = np.arange(array[-1] + 1)
     index = np.empty((array[-1] + 1, 2), dtype='int')
-    for i in range(array[-1] + 1):
-        temp = np.where(array == i)[0]
-        try:
-            index[i, 0], index[i, 1] = temp[0], temp[-1] + 1
-        except IndexError:
-            index[i, 0], index[i, 1] = 0, 0
-    return index
\ No newline at end of file
+    index[:, 0] = np.searchsorted(array, values, side='left')
+    index[:, 1] = np.searchsorted(array, values, side='right')
+    # Numbers that do not appear in the array get an empty range
+    index[index[:, 0] == index[:, 1]] = 0
+    return index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ReSample a density map with triLinear interpolation")
+    parser.add_argument("input", help="Input map file")
+    parser.add_argument("output", help="Output map file")
+    parser.add_argument("--voxel-size", type=float, default=TARGET_VOXEL, help="Output voxel size")
+    parser.add_argument("--threshold", type=float, default=-1.0,
+                        help="Density threshold for voxel size 0.5, the 99th percentile is used if < 0")
+    parser.add_argument("--stream", action="store_true", help="ReSample out-of-core in memory-mapped z-slabs")
+    parser.add_argument("--slab-mb", type=int, default=SLAB_BYTES // (1024 * 1024),
+                        help="Memory budget of one slab in MB when streaming")
+    args = parser.parse_args()
+
+    if args.stream:
+        shape = resample_mrc_streaming(args.threshold, args.input, args.output, args.voxel_size,
+                                       args.slab_mb * 1024 * 1024)
+    else:
+        shape = resample_mrc(args.threshold, args.input, args.output, args.voxel_size).shape
+    print(f"Wrote {args.output} with shape {shape}")
@@ -1,6 +1,4 @@
 import os
-import json
-import requests
 import sys
 import argparse
 import traceback
@@ -14,68 +12,34 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from qscoreCompute import computeQscore
 from zscoreCompute import computeZScore
+from emdb_resolver import get_emdb_id_from_pdb
+from artifact_store import default_store
 # from label import generateLabelMap
 
-# Load config
-with open("../configurations/config.json", "r") as config_file:
-    config = json.load(config_file)
-BASE_URL = config.get("rcsb_api_base_url", "https://data.rcsb.org/rest/v1/core/entry")
-
-#Return EMDB ID for a given PDB ID using RCSB API.
-def get_emdb_id_from_pdb(pdb_id):
-    url = f"{BASE_URL}/{pdb_id.lower()}"
-    try:
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"RCSB API error for PDB {pdb_id}: {response.status_code}")
-            return None
-        data = response.json()
-        references = data.get("rcsb_external_references", [])
-        for ref in references:
-            if ref.get("id", "").startswith("EMD"):
-                return ref["id"]
-        print(f"No EMDB reference found for {pdb_id}")
-        return None
-    except Exception as e:
-        print(f"Error retrieving EMDB ID for {pdb_id}: {e}")
-        return None
-
-#Download CryoEM map for a PDB ID and return local file path. You may also modify this to fetch command and run on any map file that is already prefetched
-def fetch_emdb_map(session, pdb_id):
-    emdb_id = get_emdb_id_from_pdb(pdb_id)
+#Download CryoEM map for a PDB ID into the local artifact store and return its path. Maps already in the store are not downloaded again
+def fetch_emdb_map(session, pdb_id, emdb_id=None):
+    emdb_id = emdb_id or get_emdb_id_from_pdb(pdb_id)
     if not emdb_id:
         return None
     try:
-        run(session, f"open emdb:{emdb_id[4:]}")
-        emdb_file = os.path.expanduser(f"~/Downloads/ChimeraX/EMDB/emd_{emdb_id[4:]}.map")
-        if os.path.exists(emdb_file):
-            return emdb_file
-        else:
-            print(f"Map file not found after download: {emdb_file}")
-            return None
+        return default_store().fetch_map(emdb_id, decompress=True)
     except Exception as e:
         print(f"Failed to fetch EMDB map: {e}")
         return None
 
-#Download PDB file for a given PDB ID and return local file path. Same as the map file you may modify it to fetch an already downloaded pdb file
+#Download the mmCIF file of a PDB ID into the local artifact store and return its path. Same as the map file, stored files are reused
 def fetch_pdb_file(session, pdb_id):
     try:
-        run(session, f"open {pdb_id}")
-        pdb_file = os.path.expanduser(f"~/Downloads/ChimeraX/PDB/{pdb_id.lower()}.cif")
-        if os.path.exists(pdb_file):
-            return pdb_file
-        else:
-            print(f"PDB file not found after download: {pdb_file}")
-            return None
+        return default_store().fetch_structure(pdb_id)
     except Exception as e:
         print(f"Failed to fetch PDB file: {e}")
         return None
 
 #Load PDB and EMDB map, select residues, and return path to segmented map.
-def segment_map(session, pdb_file_path, emdb_file_path, chain_ranges):
+def segment_map(session, pdb_file_path, emdb_file_path, chain_ranges, emdb_id=None):
     try:
         run(session, "close all")
-        run(session, f"open {pdb_file_path}")
+        run(session, f'open "{pdb_file_path}"')
         
         # Build selection string
         selections = []
@@ -91,7 +55,7 @@ def segment_map(session, pdb_file_path, emdb_file_path, chain_ranges):
         filename = f"outputPDBs/segmentedPDB.pdb"
         run(session, f"save {filename} format pdb selectedOnly true")
         
-        run(session, f"open {emdb_file_path}")
+        run(session, f'open "{emdb_file_path}"')
 
         structure_model = None
         volume_model = None
@@ -130,7 +94,7 @@ def segment_map(session, pdb_file_path, emdb_file_path, chain_ranges):
         run(session, f"save {output_path} #99")
 
         computeQscore(session,filename, output_path, f"qscoreOutput.csv")
-        computeZScore(output_path, filename, f"zscoreOutput.csv")
+        computeZScore(output_path, filename, f"zscoreOutput.csv", emdb_id=emdb_id)
         # generateLabelMap(output_path,filename,f"backboneLabel.mrc","backbone")
         # generateLabelMap(output_path,filename,f"riboseLabel.mrc","ribose")
         # generateLabelMap(output_path,filename,f"sugarLabel.mrc","sugar")
@@ -170,19 +134,14 @@ def main(session, pdb_id, emdb_id, chain_ranges):
         raise RuntimeError("Failed to fetch PDB file")
 
     # Fetch map
-    if emdb_id:
-        run(session, f"open emdb:{emdb_id.replace('EMD-', '')}")
-        emdb_file = os.path.expanduser(
-            f"~/Downloads/ChimeraX/EMDB/emd_{emdb_id.replace('EMD-', '')}.map"
-        )
-    else:
-        emdb_file = fetch_emdb_map(session, pdb_id)
+    emdb_id = emdb_id or get_emdb_id_from_pdb(pdb_id)
+    emdb_file = fetch_emdb_map(session, pdb_id, emdb_id)
 
     if not emdb_file or not os.path.exists(emdb_file):
         raise RuntimeError("Failed to fetch EMDB map")
 
     # Run segmentation 
-    output_map = segment_map( session, pdb_file, emdb_file, chain_ranges)
+    output_map = segment_map( session, pdb_file, emdb_file, chain_ranges, emdb_id)
 
 
     if output_map:
@@ -1,37 +1,21 @@
 import os
 import csv
-import requests
-import json
 from chimerax.core.commands import run
 import sys
 import traceback
 import io
 import re
+import time
+from itertools import groupby
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-with open("config.json", "r") as config_file:
-    config = json.load(config_file)
-BASE_URL = config.get("rcsb_api_base_url", "https://data.rcsb.org/rest/v1/core/entry")
+from segment_engine import DensityMap, zone_and_crop, write_map, read_motif_rows, group_by_pdb
+from emdb_resolver import get_emdb_id_from_pdb, prefetch_emdb_ids
+from artifact_store import default_store
+from prefetch_pipeline import Prefetcher
 
-def get_emdb_id_from_pdb(pdb_id):
-    url = f"{BASE_URL}/{pdb_id.lower()}"
-    try:
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"RCSB API error for PDB {pdb_id}: {response.status_code}")
-            return None
 
-        data = response.json()
-        references = data.get("rcsb_external_references", [])
-        for ref in references:
-            if ref.get("id", "").startswith("EMD"):
-                return ref["id"]
-        print(f"No EMDB reference found for {pdb_id}")
-        return None
-    except Exception as e:
-        print(f"Error retrieving EMDB ID for {pdb_id}: {e}")
-        return None
-    
 def get_model_by_id(session, target_id):
     for model in session.models.list():
         model_str = str(model)
@@ -64,40 +48,31 @@ def get_model_by_id(session, target_id):
 #     else:
 #         print("Level not found in info output.")
 #         return None
-def cleanupfiles(pdb_id,emdb_id):
-    try:
-        emdb_file = os.path.expanduser(f"~/Downloads/ChimeraX/EMDB/emd_{emdb_id[4:]}.map")
-        if os.path.exists(emdb_file):
-            os.remove(emdb_file)
-            print(f"Deleted EMDB file: {emdb_file}")
-    except Exception as e:
-        print(f"Failed to delete EMDB file: {emdb_file}. Error: {e}")
-
-    try:
-        pdb_file = os.path.expanduser(f"~/Downloads/ChimeraX/PDB/{pdb_id.lower()}.cif")
-        if os.path.exists(pdb_file):
-            os.remove(pdb_file)
-            print(f"Deleted PDB file: {pdb_file}")
-    except Exception as e:
-        print(f"Failed to delete PDB file: {pdb_file}. Error: {e}")
 
 
-def segment_density_map(session, pdb_id, aseq, bseq, internal_id, motif_type):
-    emdb_id = get_emdb_id_from_pdb(pdb_id)
+def segment_density_map(session, pdb_id, aseq, bseq, internal_id, motif_type, emdb_id=None,
+                        structure_path=None, map_path=None):
+    emdb_id = emdb_id or get_emdb_id_from_pdb(pdb_id)
     if not emdb_id:
         print(f"No EMDB map found for {pdb_id}")
         return
 
     try:
+        # Structure and map come from the local store, downloaded only on the first use
+        if not structure_path or not map_path:
+            store = default_store()
+            structure_path = store.fetch_structure(pdb_id)
+            map_path = store.fetch_map(emdb_id, decompress=True)
+
         run(session, "close all")
-        run(session, f"open {pdb_id}")
+        run(session, f'open "{structure_path}"')
         run(session, f"select /{aseq} /{bseq}")
 
         os.makedirs("outputPDBs", exist_ok=True)
         filename = f"outputPDBs/{pdb_id}_{motif_type}_{internal_id}.pdb"
         run(session, f"save {filename} format pdb selectedOnly true")
 
-        run(session, f"open emdb:{emdb_id[4:]}")
+        run(session, f'open "{map_path}"')
         structure_model = None
         volume_model = None
         for m in session.models.list():
@@ -138,6 +113,7 @@ def segment_density_map(session, pdb_id, aseq, bseq, internal_id, motif_type):
         traceback.print_exc()
 
 def run_all_from_csv(session, csv_path):
+    prefetch_emdb_ids(motif["pdb_id"] for motif in read_motif_rows(csv_path))
     with open(csv_path, newline='') as csvfile:
         reader = csv.DictReader(csvfile)
         current_pdb = None
@@ -155,9 +131,8 @@ def run_all_from_csv(session, csv_path):
                 current_pdb = pdb_id
 
             if pdb_id != current_pdb:
-                cleanupfiles(current_pdb, current_emdb)
                 current_pdb = pdb_id
-                current_emdb = None  # reset EMDB after cleanup
+                current_emdb = None  # resolve the EMDB id of the next entry
 
             if current_emdb is None:
                 current_emdb = get_emdb_id_from_pdb(pdb_id)
@@ -166,11 +141,126 @@ def run_all_from_csv(session, csv_path):
                     continue
 
             print(f"\n--- Processing {pdb_id} ---")
-            segment_density_map(session, pdb_id, aseq, bseq, internal_id, motif_type)
+            segment_density_map(session, pdb_id, aseq, bseq, internal_id, motif_type, current_emdb)
+
+
+def segment_structure_motifs(session, pdb_id, emdb_id, motifs, zone_range=5.0, structure_path=None, map_path=None):
+    """
+    Open the structure and map of one PDB entry once and segment all of its motifs
+    from the in-memory map. Returns the number of segmented maps written.
+    """
+    from chimerax.map import Volume
+    from chimerax.atomic import selected_atoms
+
+    if not structure_path or not map_path:
+        store = default_store()
+        structure_path = store.fetch_structure(pdb_id)
+        map_path = store.fetch_map(emdb_id, decompress=True)
 
-        # Final cleanup after last batch
-        if current_pdb and current_emdb:
-            cleanupfiles(current_pdb, current_emdb)
+    run(session, "close all")
+    run(session, f'open "{structure_path}"')
+    run(session, f'open "{map_path}"')
+
+    volumes = [m for m in session.models.list() if isinstance(m, Volume)]
+    if not volumes:
+        print(f"Failed to identify volume model for {pdb_id}")
+        return 0
+    volume_model = volumes[0]
+    grid = volume_model.data
+    density_map = DensityMap(volume_model.full_matrix(), grid.step, grid.origin)
+
+    os.makedirs("outputPDBs", exist_ok=True)
+    os.makedirs("outputMaps", exist_ok=True)
+    written = 0
+    for motif in motifs:
+        motif_type, internal_id = motif["motif_type"], motif["internal_id"]
+        try:
+            run(session, f"select /{motif['aseq']} /{motif['bseq']}")
+            filename = f"outputPDBs/{pdb_id}_{motif_type}_{internal_id}.pdb"
+            run(session, f"save {filename} format pdb selectedOnly true")
+
+            data, origin = zone_and_crop(density_map, selected_atoms(session).scene_coords, zone_range)
+            if data is None:
+                print("All voxels are zero.")
+                continue
+
+            output_path = f"outputMaps/{emdb_id}_{pdb_id}_{motif_type}_{internal_id}.mrc"
+            write_map(output_path, data, origin, grid.step)
+            written += 1
+            print(f"Segmented map saved to: {output_path}")
+        except Exception as e:
+            print(f"Segmentation failed for {pdb_id} {motif_type} {internal_id}: {e}")
+            traceback.print_exc()
+
+    run(session, "close all")
+    return written
+
+
+def run_all_from_csv_batched(session, csv_path):
+    """
+    Batched version of run_all_from_csv: rows are grouped by PDB id, the EMDB id is
+    resolved once per entry and the structure and map are loaded once for all motifs.
+    """
+    groups = group_by_pdb(read_motif_rows(csv_path))
+    emdb_ids = prefetch_emdb_ids(pdb_id for pdb_id, _ in groups)
+    for pdb_id, motifs in groups:
+        emdb_id = emdb_ids[pdb_id]
+        if not emdb_id:
+            print(f"Skipping {pdb_id} due to missing EMDB ID.")
+            continue
+
+        print(f"\n--- Processing {pdb_id} ({len(motifs)} motifs) ---")
+        try:
+            segment_structure_motifs(session, pdb_id, emdb_id, motifs)
+        except Exception as e:
+            print(f"Segmentation failed for {pdb_id}: {e}")
+            traceback.print_exc()
+
+
+def run_all_from_csv_pipelined(session, csv_path, depth=None, batched=False):
+    """
+    run_all_from_csv (or the batched version) with the structures and maps of the next
+    `depth` entries downloaded into the store in the background while the current entry
+    is segmented.
+    """
+    motifs = read_motif_rows(csv_path)
+    if batched:
+        groups = group_by_pdb(motifs)
+    else:
+        # Consecutive rows of one entry, in CSV order like run_all_from_csv
+        groups = [(pdb_id, list(group)) for pdb_id, group in groupby(motifs, key=lambda m: m["pdb_id"])]
+    emdb_ids = prefetch_emdb_ids(pdb_id for pdb_id, _ in groups)
+
+    entries = []
+    for pdb_id, group in groups:
+        emdb_id = emdb_ids[pdb_id.upper()]
+        if not emdb_id:
+            print(f"Skipping {pdb_id} due to missing EMDB ID.")
+            continue
+        entries.append((pdb_id, emdb_id, group))
+
+    prefetcher = Prefetcher.from_config(default_store(), entries, depth)
+    start = time.time()
+    for entry in prefetcher:
+        if entry.error:
+            print(f"Failed to fetch {entry.pdb_id}/{entry.emdb_id}: {entry.error}")
+            continue
+
+        print(f"\n--- Processing {entry.pdb_id} ({len(entry.item)} motifs) ---")
+        try:
+            if batched:
+                segment_structure_motifs(session, entry.pdb_id, entry.emdb_id, entry.item,
+                                         structure_path=entry.structure_path, map_path=entry.map_path)
+            else:
+                for motif in entry.item:
+                    segment_density_map(session, motif["pdb_id"], motif["aseq"], motif["bseq"],
+                                        motif["internal_id"], motif["motif_type"], entry.emdb_id,
+                                        entry.structure_path, entry.map_path)
+        except Exception as e:
+            print(f"Segmentation failed for {entry.pdb_id}: {e}")
+            traceback.print_exc()
+    print(f"Processed {len(entries)} entries in {time.time() - start:.0f}s, "
+          f"{prefetcher.wait_time:.0f}s of it waiting for downloads")
 
 
 #def run_all_from_csv(session, csv_path):
@@ -189,9 +279,35 @@ def run_all_from_csv(session, csv_path):
 #            segment_density_map(session, pdb_id, aseq, bseq,internal_id)
 
 #run_all_from_csv(session, "Sample1.csv")
-if len(sys.argv) != 2:
-    print("Usage: chimerax --script \"runscript segmentMRC.py <input_filename|path>.csv\"")
+def parse_arguments(argv):
+    # <csv> [--batched] [--prefetch K]
+    csv_file, batched, prefetch = None, False, None
+    args = iter(argv)
+    for arg in args:
+        if arg == "--batched":
+            batched = True
+        elif arg == "--prefetch":
+            prefetch = int(next(args))
+        elif csv_file is None:
+            csv_file = arg
+        else:
+            return None
+    return (csv_file, batched, prefetch) if csv_file else None
+
+
+try:
+    arguments = parse_arguments(sys.argv[1:])
+except (StopIteration, ValueError):
+    arguments = None
+
+if arguments is None:
+    print("Usage: chimerax --script \"runscript segmentMRC.py <input_filename|path>.csv [--batched] [--prefetch K]\"")
 else:
-    csv_file = sys.argv[1]
+    csv_file, batched, prefetch = arguments
     print(f"file{csv_file}")
-    run_all_from_csv(session, csv_file)
+    if prefetch:
+        run_all_from_csv_pipelined(session, csv_file, prefetch, batched)
+    elif batched:
+        run_all_from_csv_batched(session, csv_file)
+    else:
+        run_all_from_csv(session, csv_file)
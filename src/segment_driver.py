@@ -0,0 +1,218 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import subprocess
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from segment_engine import (
+    ZONE_RANGE, DensityMap, load_structure, parse_chain_ranges, segment_motif, read_motif_rows, group_by_pdb
+)
+from emdb_resolver import get_emdb_id_from_pdb, prefetch_emdb_ids
+from artifact_store import ArtifactStore, STORE_ENV
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+SEGMENT_SCRIPT = os.path.join(SRC_DIR, "segmentMRC.py")
+ENGINES = ("python", "chimerax")
+MANIFEST_FILE = "manifest.csv"
+MANIFEST_COLUMNS = ["pdb_id", "emdb_id", "motif_type", "internal_id", "map_path", "pdb_path", "status"]
+MOTIF_COLUMNS = ["pdb", "Aseq_selection", "Bseq_selection", "InternalID", "motif_type"]
+
+
+def motif_record(pdb_id, emdb_id, motif, map_path="", pdb_path="", status="ok"):
+    return {
+        "pdb_id": pdb_id,
+        "emdb_id": emdb_id or "",
+        "motif_type": motif["motif_type"],
+        "internal_id": motif["internal_id"],
+        "map_path": map_path,
+        "pdb_path": pdb_path,
+        "status": status,
+    }
+
+
+def segment_group_python(pdb_id, motifs, work_dir, store_dir=None, zone_range=ZONE_RANGE):
+    """
+    Segment all motifs of one PDB entry with segment_engine. The structure and map are
+    read from the local artifact store and downloaded into it on a miss.
+    """
+    emdb_id = get_emdb_id_from_pdb(pdb_id)
+    if not emdb_id:
+        return [motif_record(pdb_id, None, motif, status="no_emdb") for motif in motifs]
+
+    records = []
+    try:
+        store = ArtifactStore.from_config(store_dir)
+        structure = load_structure(store.fetch_structure(pdb_id), pdb_id)
+        # The decompressed copy is memory-mapped, a .map.gz would be read whole into every worker
+        with DensityMap.open(store.fetch_map(emdb_id, decompress=True)) as density_map:
+            for motif in motifs:
+                name = f"{pdb_id}_{motif['motif_type']}_{motif['internal_id']}"
+                output_pdb = os.path.join(work_dir, "outputPDBs", f"{name}.pdb")
+                output_map = os.path.join(work_dir, "outputMaps", f"{emdb_id}_{name}.mrc")
+                try:
+                    chain_ranges = parse_chain_ranges([motif["aseq"], motif["bseq"]])
+                    written = segment_motif(structure, density_map, chain_ranges, output_map, output_pdb, zone_range)
+                except Exception as e:
+                    print(f"Segmentation failed for {name}: {e}")
+                    records.append(motif_record(pdb_id, emdb_id, motif, status="failed"))
+                    continue
+                if written:
+                    records.append(motif_record(pdb_id, emdb_id, motif, output_map, output_pdb))
+                else:
+                    records.append(motif_record(pdb_id, emdb_id, motif, pdb_path=output_pdb, status="empty"))
+    except Exception as e:
+        print(f"Segmentation failed for {pdb_id}: {e}")
+        traceback.print_exc()
+        done = {record["internal_id"] for record in records}
+        records.extend(motif_record(pdb_id, emdb_id, motif, status="failed")
+                       for motif in motifs if motif["internal_id"] not in done)
+    return records
+
+
+def write_motif_csv(motifs, csv_path):
+    with open(csv_path, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(MOTIF_COLUMNS)
+        for motif in motifs:
+            writer.writerow([motif["pdb_id"], motif["aseq"], motif["bseq"], motif["internal_id"], motif["motif_type"]])
+
+
+def segment_group_chimerax(pdb_id, motifs, work_dir, chimerax="chimerax", timeout=None, store_dir=None):
+    """
+    Segment all motifs of one PDB entry in a headless ChimeraX running segmentMRC.py --batched.
+    The working directory of each instance is work_dir, so the outputMaps/ and outputPDBs/
+    of concurrent instances never collide.
+    """
+    csv_path = os.path.join(work_dir, "motifs.csv")
+    write_motif_csv(motifs, csv_path)
+    command = [chimerax, "--nogui", "--exit", "--cmd", f'runscript "{SEGMENT_SCRIPT}" "{csv_path}" --batched']
+
+    env = dict(os.environ)
+    if store_dir:
+        env[STORE_ENV] = store_dir
+
+    status = "ok"
+    with open(os.path.join(work_dir, "chimerax.log"), "w") as log:
+        try:
+            result = subprocess.run(command, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                    timeout=timeout)
+            if result.returncode != 0:
+                status = "failed"
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"ChimeraX failed for {pdb_id}: {e}")
+            status = "failed"
+
+    # segmentMRC.py names the maps <emdb_id>_<pdb_id>_<motif_type>_<internal_id>.mrc
+    maps = {}
+    map_dir = os.path.join(work_dir, "outputMaps")
+    if os.path.isdir(map_dir):
+        for name in os.listdir(map_dir):
+            emdb_id, _, rest = name.partition("_")
+            maps[rest] = (emdb_id, os.path.join(map_dir, name))
+
+    records = []
+    for motif in motifs:
+        name = f"{motif['pdb_id']}_{motif['motif_type']}_{motif['internal_id']}"
+        output_pdb = os.path.join(work_dir, "outputPDBs", f"{name}.pdb")
+        output_pdb = output_pdb if os.path.isfile(output_pdb) else ""
+        if f"{name}.mrc" in maps:
+            emdb_id, output_map = maps[f"{name}.mrc"]
+            records.append(motif_record(pdb_id, emdb_id, motif, output_map, output_pdb))
+        else:
+            records.append(motif_record(pdb_id, None, motif, pdb_path=output_pdb,
+                                        status=status if status != "ok" else "empty"))
+    return records
+
+
+def segment_group(task):
+    pdb_id, motifs, options = task
+    work_dir = os.path.join(options["output_dir"], "work", pdb_id)
+    os.makedirs(work_dir, exist_ok=True)
+    if options["engine"] == "chimerax":
+        return segment_group_chimerax(pdb_id, motifs, work_dir, options["chimerax"], options["timeout"],
+                                      options["store_dir"])
+    return segment_group_python(pdb_id, motifs, work_dir, options["store_dir"], options["zone_range"])
+
+
+def write_manifest(records, manifest_path):
+    records = sorted(records, key=lambda r: (r["pdb_id"], r["motif_type"], r["internal_id"]))
+    with open(manifest_path, "w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=MANIFEST_COLUMNS)
+        writer.writeheader()
+        writer.writerows(records)
+    return manifest_path
+
+
+def run_parallel(csv_path, output_dir, workers=os.cpu_count(), engine="python", chimerax="chimerax",
+                 store_dir=None, zone_range=ZONE_RANGE, timeout=None):
+    """
+    Segment every motif of a CoSSMos CSV with a pool of worker processes. The rows are
+    sharded by PDB id, each PDB entry is one task on the pool's queue and writes into its
+    own output_dir/work/<PDB_ID>/ directory. A merged manifest.csv of all motifs is
+    written to output_dir at the end.
+    :return Path of the manifest and the list of records
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    options = {
+        "output_dir": os.path.abspath(output_dir),
+        "engine": engine,
+        "chimerax": chimerax,
+        "store_dir": os.path.abspath(store_dir) if store_dir else None,
+        "zone_range": zone_range,
+        "timeout": timeout,
+    }
+    # Largest entries first so a long tail does not leave the pool idle
+    groups = sorted(group_by_pdb(read_motif_rows(csv_path)), key=lambda g: -len(g[1]))
+    total = sum(len(motifs) for _, motifs in groups)
+    # Resolve every entry up front with pooled requests, the workers then hit the shared cache
+    prefetch_emdb_ids(pdb_id for pdb_id, _ in groups)
+    print(f"Segmenting {total} motifs of {len(groups)} PDB entries with {workers} {engine} workers")
+
+    records = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(segment_group, (pdb_id, motifs, options)): (pdb_id, motifs)
+                   for pdb_id, motifs in groups}
+        for done, future in enumerate(as_completed(futures), 1):
+            pdb_id, motifs = futures[future]
+            try:
+                group_records = future.result()
+            except Exception as e:
+                print(f"Worker failed for {pdb_id}: {e}")
+                group_records = [motif_record(pdb_id, None, motif, status="failed") for motif in motifs]
+            records.extend(group_records)
+            segmented = sum(record["status"] == "ok" for record in group_records)
+            print(f"[{done}/{len(groups)}] {pdb_id}: {segmented}/{len(motifs)} motifs segmented "
+                  f"({time.time() - start:.0f}s)")
+
+    manifest_path = write_manifest(records, os.path.join(output_dir, MANIFEST_FILE))
+    return manifest_path, records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segment the motifs of a CoSSMos CSV in parallel")
+    parser.add_argument("csv_file", help="CSV with pdb, Aseq_selection, Bseq_selection, InternalID, motif_type")
+    parser.add_argument("output_dir", help="Destination of the per-entry outputs and manifest.csv")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--engine", choices=ENGINES, default="python",
+                        help="python: segment_engine, chimerax: headless ChimeraX running segmentMRC.py")
+    parser.add_argument("--chimerax", default="chimerax", help="ChimeraX executable")
+    parser.add_argument("--store", default=None, help="Structure/map store directory (default from config.json)")
+    parser.add_argument("--range", type=float, default=ZONE_RANGE, help="Zone range in Angstrom")
+    parser.add_argument("--timeout", type=float, default=None, help="Timeout in seconds of each ChimeraX instance")
+    args = parser.parse_args()
+
+    manifest_path, records = run_parallel(args.csv_file, args.output_dir, args.workers, args.engine, args.chimerax,
+                                          args.store, args.range, args.timeout)
+    segmented = sum(record["status"] == "ok" for record in records)
+    print(f"Segmented {segmented}/{len(records)} motifs, manifest written to {manifest_path}")
+    if segmented == 0:
+        sys.exit(1)
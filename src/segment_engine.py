@@ -0,0 +1,229 @@
+import os
+import sys
+import csv
+import argparse
+from itertools import groupby
+import numpy as np
+import mrcfile
+from Bio import PDB
+from scipy.spatial import cKDTree
+
+ZONE_RANGE = 5.0
+
+
+def parse_chain_ranges(chain_range_args):
+    parsed = []
+
+    for entry in chain_range_args:
+        chain, ranges = entry.lstrip("/").split(":")
+        res_ranges = []
+        for r in ranges.split(","):
+            start, end = r.split("-") if "-" in r[1:] else (r, r)
+            res_ranges.append((int(start), int(end)))
+        parsed.append((chain, res_ranges))
+
+    return parsed
+
+
+def read_motif_rows(csv_path):
+    motifs = []
+    with open(csv_path, newline='') as csvfile:
+        for row in csv.DictReader(csvfile):
+            motifs.append({
+                "pdb_id": row['pdb'].strip(),
+                "aseq": row['Aseq_selection'].strip(),
+                "bseq": row['Bseq_selection'].strip(),
+                "internal_id": row['InternalID'].strip(),
+                "motif_type": row['motif_type'].strip(),
+            })
+    return motifs
+
+
+def group_by_pdb(motifs):
+    # Stable sort keeps the CSV order of the motifs within each structure
+    motifs = sorted(motifs, key=lambda m: m["pdb_id"].upper())
+    return [(pdb_id, list(group)) for pdb_id, group in groupby(motifs, key=lambda m: m["pdb_id"].upper())]
+
+
+#Load a PDB or mmCIF structure with Bio.PDB.
+def load_structure(structure_path, structure_id="model"):
+    name = structure_path.lower()
+    if name.endswith(".cif") or name.endswith(".mmcif"):
+        parser = PDB.MMCIFParser(QUIET=True)
+    else:
+        parser = PDB.PDBParser(QUIET=True)
+    return parser.get_structure(structure_id, structure_path)
+
+
+class ResidueRangeSelect(PDB.Select):
+    # Selects the residues of [(chain_id, [(start, end), ...]), ...] in the first model
+    def __init__(self, chain_ranges):
+        self.chain_ranges = {}
+        for chain_id, residue_ranges in chain_ranges:
+            self.chain_ranges.setdefault(chain_id, []).extend(residue_ranges)
+
+    def accept_model(self, model):
+        return model.serial_num == 1 or model.id == 0
+
+    def accept_chain(self, chain):
+        return chain.id in self.chain_ranges
+
+    def accept_residue(self, residue):
+        number = residue.id[1]
+        return any(start <= number <= end for start, end in self.chain_ranges.get(residue.get_parent().id, []))
+
+
+def select_atoms(structure, chain_ranges):
+    """
+    Return the atoms of the selected residues, the same selection as
+    ChimeraX "select /A:10-25,40-52 /C:5-18" on the first model.
+    """
+    selector = ResidueRangeSelect(chain_ranges)
+    model = next(iter(structure))
+    atoms = []
+    for chain in model:
+        if not selector.accept_chain(chain):
+            continue
+        for residue in chain:
+            if selector.accept_residue(residue):
+                atoms.extend(residue.get_atoms())
+    return atoms
+
+
+def save_selection(structure, chain_ranges, output_pdb):
+    io = PDB.PDBIO()
+    io.set_structure(structure)
+    io.save(output_pdb, ResidueRangeSelect(chain_ranges))
+    return output_pdb
+
+
+class DensityMap:
+    """
+    A density map opened for zoning. The data stays memory-mapped, so only the voxels
+    around the selected atoms are read. Origin follows the ChimeraX convention: the
+    header origin if it is set, otherwise nstart * voxel size.
+    """
+
+    def __init__(self, data, voxel_size, origin):
+        self.data = data
+        self.voxel_size = np.asarray(voxel_size, dtype=np.float64)  # (x, y, z)
+        self.origin = np.asarray(origin, dtype=np.float64)  # (x, y, z) of voxel [0, 0, 0]
+        self._mrc = None
+
+    @classmethod
+    def open(cls, map_path):
+        if map_path.lower().endswith(".gz"):
+            mrc = mrcfile.open(map_path, mode='r', permissive=True)
+        else:
+            mrc = mrcfile.mmap(map_path, mode='r', permissive=True)
+        voxel = np.array(mrc.voxel_size.tolist(), dtype=np.float64)
+        origin = np.array(mrc.header.origin.tolist(), dtype=np.float64)
+        if not origin.any():
+            nstart = np.array([mrc.header.nxstart, mrc.header.nystart, mrc.header.nzstart], dtype=np.float64)
+            origin = nstart * voxel
+        density_map = cls(mrc.data, voxel, origin)
+        density_map._mrc = mrc
+        return density_map
+
+    def close(self):
+        if self._mrc is not None:
+            self._mrc.close()
+            self._mrc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def zone_and_crop(density_map, coords, zone_range=ZONE_RANGE):
+    """
+    Equivalent of ChimeraX "volume zone #map near sel range 5.0 newMap true" followed by
+    "volume copy subregion" of the non-zero bounding box. The distance to the atoms is
+    only evaluated inside the atoms' bounding box padded by zone_range.
+    :param density_map: DensityMap
+    :param coords: (N, 3) atom coordinates in (x, y, z)
+    :param zone_range: Distance from the atoms in Angstrom
+    :return Cropped float32 data in (z, y, x) order and the (x, y, z) origin of its first voxel,
+            or (None, None) if the zone is empty
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    if len(coords) == 0:
+        return None, None
+
+    shape_xyz = np.array(density_map.data.shape[::-1])
+    lo = np.floor((coords.min(axis=0) - zone_range - density_map.origin) / density_map.voxel_size).astype(int)
+    hi = np.ceil((coords.max(axis=0) + zone_range - density_map.origin) / density_map.voxel_size).astype(int) + 1
+    lo, hi = np.clip(lo, 0, shape_xyz), np.clip(hi, 0, shape_xyz)
+    if np.any(hi <= lo):
+        return None, None
+
+    box = np.array(density_map.data[lo[2]:hi[2], lo[1]:hi[1], lo[0]:hi[0]], dtype=np.float32)
+
+    # World coordinates of every voxel in the box, (z, y, x) grid flattened to (x, y, z) points
+    axes = [density_map.origin[i] + np.arange(lo[i], hi[i]) * density_map.voxel_size[i] for i in range(3)]
+    zz, yy, xx = np.meshgrid(axes[2], axes[1], axes[0], indexing="ij")
+    points = np.column_stack([xx.ravel(), yy.ravel(), zz.ravel()])
+    distance, _ = cKDTree(coords).query(points, k=1, distance_upper_bound=zone_range + 1e-6)
+    box[(~np.isfinite(distance)).reshape(box.shape)] = 0
+
+    nonzero = np.argwhere(box != 0)
+    if nonzero.size == 0:
+        return None, None
+    (min_z, min_y, min_x), (max_z, max_y, max_x) = nonzero.min(axis=0), nonzero.max(axis=0)
+    cropped = box[min_z:max_z + 1, min_y:max_y + 1, min_x:max_x + 1]
+    origin = density_map.origin + (lo + np.array([min_x, min_y, min_z])) * density_map.voxel_size
+    return np.ascontiguousarray(cropped), origin
+
+
+def write_map(output_path, data, origin, voxel_size):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with mrcfile.new(output_path, overwrite=True) as mrc:
+        mrc.set_data(data)
+        mrc.voxel_size = tuple(voxel_size)
+        mrc.header.nxstart, mrc.header.nystart, mrc.header.nzstart = 0, 0, 0
+        mrc.header.origin = tuple(origin)
+        mrc.update_header_stats()
+    return output_path
+
+
+def segment_motif(structure, density_map, chain_ranges, output_map, output_pdb=None, zone_range=ZONE_RANGE):
+    """
+    Zone and crop density_map around the selected residues and write the segmented map
+    (and the selected residues if output_pdb is given).
+    :return output_map, or None if nothing was selected or the zone is empty
+    """
+    atoms = select_atoms(structure, chain_ranges)
+    if not atoms:
+        print(f"No atoms selected for {chain_ranges}")
+        return None
+
+    if output_pdb:
+        os.makedirs(os.path.dirname(output_pdb) or ".", exist_ok=True)
+        save_selection(structure, chain_ranges, output_pdb)
+
+    data, origin = zone_and_crop(density_map, np.array([atom.get_coord() for atom in atoms]), zone_range)
+    if data is None:
+        print("All voxels are zero.")
+        return None
+    return write_map(output_map, data, origin, density_map.voxel_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segment a motif density map without ChimeraX")
+    parser.add_argument("structure", help="PDB or mmCIF file of the atomic model")
+    parser.add_argument("map", help="Density map (.mrc/.map)")
+    parser.add_argument("chains", nargs="+", help="<chain:start-end[,start-end]> selections")
+    parser.add_argument("--output-map", default="outputMaps/segmentedMap.mrc", help="Segmented map path")
+    parser.add_argument("--output-pdb", default="outputPDBs/segmentedPDB.pdb", help="Selected residues path")
+    parser.add_argument("--range", type=float, default=ZONE_RANGE, help="Zone range in Angstrom")
+    args = parser.parse_args()
+
+    structure = load_structure(args.structure)
+    with DensityMap.open(args.map) as density_map:
+        output_map = segment_motif(structure, density_map, parse_chain_ranges(args.chains),
+                                   args.output_map, args.output_pdb, args.range)
+    if not output_map:
+        sys.exit(1)
+    print(f"Segmented map saved to: {output_map}")
@@ -1,16 +1,43 @@
 import os
+import copy
+import json
+import time
 import glob
+import argparse
 import random
 import numpy as np
 import mrcfile
 import torch
 import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import Dataset, DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from contextlib import nullcontext
 import resample_mrc
-import sys
+import volume_cache
+import label_io
+import motif_shards
+import distributed_training
 import pandas as pd
 import traceback
 
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "configurations", "config.json")
+# Matches the original loop: 29 epochs of batch 4 with 2 workers, Adam at 1e-3
+TRAINING_DEFAULTS = {
+    "epochs": 29,
+    "batch_size": 4,
+    "num_workers": 2,
+    "persistent_workers": True,
+    "prefetch_factor": 2,
+    "lr": 1e-3,
+    "accumulation_steps": 1,
+    "channels_last": True,
+    "compile": False,
+    "val_every": 1,
+    "dist_backend": "gloo",
+    "threads": None,
+}
+
 SYMMETRIC = {"1x1", "2x2", "3x3", "4x4", "5x5"}
 BULGES = {"bulge1", "bulge2", "bulge3", "bulge4", "bulge5"}
 HAIRPINS = {"hairpin3", "hairpin4", "hairpin5", "hairpin6", "hairpin7"}
@@ -61,10 +88,40 @@ def pad_to_same_box(a, b):
     return pad_to_target(a, target), pad_to_target(b, target)
 
 
+def find_label_map(density_path):
+    # expected convention: backbone_label.mrc next to density, or the packed labels.mrc / labels.npz
+    label_path = density_path.replace(
+        "densityMap", "labelMap"
+    ).replace(".mrc", "/backbone_label.mrc")
+
+    if os.path.isfile(label_path):
+        return label_path
+    return label_io.find_packed_labels(os.path.dirname(label_path))
+
+
+def resample_backbone_label(label_path):
+    if os.path.basename(label_path) == "backbone_label.mrc":
+        return resample_mrc.resample_mrc(
+            0, label_path, None, resample_mrc.TARGET_VOXEL
+        )
+
+    labels = label_io.load_label_volume(label_path)
+    try:
+        backbone = labels.mask("backbone").astype(np.float32)
+        label_resampled, _ = resample_mrc.resample_volume(
+            backbone, labels.voxel_size, labels.origin, labels.nstart, 0, resample_mrc.TARGET_VOXEL
+        )
+    finally:
+        labels.close()
+    return label_resampled
+
+
 class CryoVoxelMotifDataset(Dataset):
-    def __init__(self, csv_file, use_labeled_maps=False):
+    def __init__(self, csv_file, use_labeled_maps=False, cache=None):
         self.df = pd.read_csv(csv_file)
         self.use_labeled_maps = use_labeled_maps
+        # Optional volume_cache.VolumeCache serving preprocessed patches for label-less samples
+        self.cache = cache
 
     def __len__(self):
         return len(self.df)
@@ -81,32 +138,23 @@ class CryoVoxelMotifDataset(Dataset):
 
             label_path = None
             if self.use_labeled_maps and not is_unknown:
-                # expected convention: backbone_label.mrc next to density
-                label_path = density_path.replace(
-                    "densityMap", "labelMap"
-                ).replace(".mrc", "/backbone_label.mrc")
+                label_path = find_label_map(density_path)
+
+                if label_path is None:
+                    print(f"[WARN] Missing label map for: {density_path}")
 
-                if not os.path.isfile(label_path):
-                    print(f"[WARN] Missing label map: {label_path}")
-                    label_path = None
+            if self.cache is not None and label_path is None:
+                patch = torch.tensor(self.cache.get(density_path), dtype=torch.float32).unsqueeze(0)
+                return patch, torch.tensor(class_id, dtype=torch.long)
 
             density_resampled = resample_mrc.resample_mrc(
                 0, density_path, outputPath, resample_mrc.TARGET_VOXEL
             )
 
-            use_labels = self.use_labeled_maps and (not is_unknown)
-            if use_labels:
-                label_path = density_path.replace(
-                    "densityMap", "labelMap"
-                ).replace(".mrc", "/backbone_label.mrc")
-
-                if not os.path.isfile(label_path):
-                    use_labels = False
+            use_labels = label_path is not None
 
             if use_labels:
-                label_resampled = resample_mrc.resample_mrc(
-                    0, label_path, "tmp_lab.mrc", resample_mrc.TARGET_VOXEL
-                )
+                label_resampled = resample_backbone_label(label_path)
 
                 label_resampled, density_resampled = pad_to_same_box(
                     label_resampled, density_resampled
@@ -137,84 +185,227 @@ class CryoVoxelMotifDataset(Dataset):
             return None
 
     def extract_patch(self, volume, cx, cy, cz, size):
-        half = size // 2
-        vol = np.pad(volume, size, mode="constant")
-        cx += size; cy += size; cz += size
-        return vol[cx-half:cx+half, cy-half:cy+half, cz-half:cz+half]
-
-def train_motif_classifier(train_csv,validation_csv,destination_dir):
-    USE_LABELED_MAPS = False
-
-    train_ds = CryoVoxelMotifDataset(
-        csv_file=train_csv,
-        use_labeled_maps=USE_LABELED_MAPS
-    )
-
-    val_ds = CryoVoxelMotifDataset(
-        csv_file=validation_csv,
-        use_labeled_maps=USE_LABELED_MAPS
-    )
-
-    train_loader = DataLoader(
-        train_ds,
-        batch_size=4,
-        shuffle=True,
-        num_workers=2,
-        pin_memory=True,
-        collate_fn=collate_skip_none
+        return volume_cache.center_crop(volume, size, (cx, cy, cz))
+
+def make_dataset(source, use_labeled_maps=False, cache=None):
+    # A directory written by motif_shards.py, otherwise a CSV of filepath,label
+    if motif_shards.is_shard_dir(source):
+        return motif_shards.ShardedMotifDataset(source)
+    return CryoVoxelMotifDataset(
+        csv_file=source,
+        use_labeled_maps=use_labeled_maps,
+        cache=cache
     )
 
-    val_loader = DataLoader(
-        val_ds,
-        batch_size=4,
-        shuffle=False,
-        num_workers=2,
-        pin_memory=True,
-        collate_fn=collate_skip_none
+def load_training_config(config_path=None, **overrides):
+    """
+    TRAINING_DEFAULTS updated with the "training" section of config_path (configurations/config.json
+    by default) and then with the overrides that are not None.
+    """
+    config = dict(TRAINING_DEFAULTS)
+    if config_path:
+        # A dedicated file may hold the options at the top level or under "training"
+        with open(config_path, "r") as config_file:
+            section = json.load(config_file)
+        section = section.get("training", section)
+        unknown = set(section) - set(config)
+        if unknown:
+            raise ValueError(f"Unknown training options in {config_path}: {', '.join(sorted(unknown))}")
+    else:
+        try:
+            with open(CONFIG_PATH, "r") as config_file:
+                section = json.load(config_file).get("training", {})
+        except (OSError, ValueError):
+            section = {}
+    config.update((key, value) for key, value in section.items() if key in config)
+    config.update((key, value) for key, value in overrides.items() if value is not None)
+    return config
+
+
+def make_loader(dataset, config, device, shuffle=False, sampler=None):
+    workers = config["num_workers"]
+    options = {}
+    if workers > 0:
+        # Keep the workers (and their memory-mapped shards) alive across epochs
+        options = {"persistent_workers": config["persistent_workers"], "prefetch_factor": config["prefetch_factor"]}
+    return DataLoader(
+        dataset,
+        batch_size=config["batch_size"],
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        num_workers=workers,
+        pin_memory=device.type == "cuda",
+        collate_fn=collate_skip_none,
+        **options
     )
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = Motif3DCNN(num_classes=5).to(device)
-    opt = torch.optim.Adam(model.parameters(), lr=1e-3)
-    loss_fn = nn.CrossEntropyLoss()
 
-    for epoch in range(1, 30):
+def compile_model(model, example=None):
+    """
+    torch.compile needs torch 2 and a working C++ toolchain, fall back to eager otherwise.
+    Compilation is lazy, so backend failures only surface on the first call. With an example
+    batch a training step and an eval forward are run here to compile both graphs, after which
+    the weights, buffers and gradients of the model are restored.
+    """
+    if not hasattr(torch, "compile"):
+        print("torch.compile is not available in this torch version, training eagerly")
+        return model
+    state = copy.deepcopy(model.state_dict())
+    try:
+        compiled = torch.compile(model)
+        if example is not None:
+            model.train()
+            compiled(example).float().sum().backward()
+            model.eval()
+            with torch.no_grad():
+                compiled(example)
+    except Exception as e:
+        print(f"torch.compile failed, training eagerly: {e}")
+        return model
+    finally:
+        model.zero_grad(set_to_none=True)
+        model.load_state_dict(state)
         model.train()
-        train_loss = 0.0
-
-        for batch in train_loader:
+    return compiled
+
+
+def to_device(batch, device, memory_format):
+    patches, labels = batch
+    non_blocking = device.type == "cuda"
+    patches = patches.to(device, non_blocking=non_blocking).contiguous(memory_format=memory_format)
+    return patches, labels.to(device, non_blocking=non_blocking)
+
+
+def train_epoch(model, loader, opt, loss_fn, device, memory_format, accumulation_steps=1, distributed=False):
+    """
+    One pass over the training loader, stepping the optimizer every accumulation_steps batches.
+    With DDP the gradients are only all-reduced on the stepping batch, and a batch whose samples
+    all failed to load runs as a zero-weighted dummy so every rank joins each all-reduce.
+    :return dict with the summed loss, sample count and the seconds spent waiting on the loader
+            (data_s) and in forward/backward/step (compute_s)
+    """
+    model.train()
+    stats = {"loss": 0.0, "samples": 0, "data_s": 0.0, "compute_s": 0.0}
+    opt.zero_grad(set_to_none=True)
+    pending = 0
+    last = len(loader)
+
+    wait_start = time.perf_counter()
+    for index, batch in enumerate(loader, 1):
+        start = time.perf_counter()
+        stats["data_s"] += start - wait_start
+        weight = 1.0
+        if batch is None and distributed:
+            batch, weight = (torch.zeros(1, 1, 64, 64, 64), torch.zeros(1, dtype=torch.long)), 0.0
+        if batch is not None:
+            patches, labels = to_device(batch, device, memory_format)
+            pending += 1
+            # The last batch also steps, so a partial group is all-reduced before the epoch ends
+            stepping = pending == accumulation_steps or index == last
+            with nullcontext() if stepping or not distributed else model.no_sync():
+                loss = loss_fn(model(patches), labels)
+                (loss * weight / accumulation_steps).backward()
+            if stepping:
+                opt.step()
+                opt.zero_grad(set_to_none=True)
+                pending = 0
+            if weight:
+                stats["loss"] += loss.item()
+                stats["samples"] += labels.size(0)
+        wait_start = time.perf_counter()
+        stats["compute_s"] += wait_start - start
+
+    if pending:
+        start = time.perf_counter()
+        opt.step()
+        opt.zero_grad(set_to_none=True)
+        stats["compute_s"] += time.perf_counter() - start
+    return stats
+
+
+def validate(model, loader, device, memory_format):
+    model.eval()
+    correct = total = 0
+    with torch.no_grad():
+        for batch in loader:
             if batch is None:
                 continue
+            patches, labels = to_device(batch, device, memory_format)
+            correct += (model(patches).argmax(1) == labels).sum().item()
+            total += labels.size(0)
+    return correct, total
+
+
+def train_motif_classifier(train_csv,validation_csv,destination_dir,cache_dir=None,config=None):
+    """
+    Runs as one process, or as one rank of a DDP job when launched by torchrun (or
+    distributed_training.launch_local). Each rank then trains on its DistributedSampler share
+    of the data, and only rank 0 logs and writes checkpoints.
+    :param config: Training options (see TRAINING_DEFAULTS), load_training_config() if None
+    """
+    USE_LABELED_MAPS = False
+    config = config or load_training_config()
+    context = distributed_training.init_distributed(config["dist_backend"], config["threads"])
+    distributed = context.world_size > 1
+    main_process = context.rank == 0
+    cache = volume_cache.VolumeCache.from_config(cache_dir) if cache_dir else None
 
-            patches, labels = batch
-            patches, labels = patches.to(device), labels.to(device)
-
-            preds = model(patches)
-            loss = loss_fn(preds, labels)
-
-            opt.zero_grad()
-            loss.backward()
-            opt.step()
-
-            train_loss += loss.item()
-
-        model.eval()
-        correct = total = 0
-        with torch.no_grad():
-            for batch in val_loader:
-                if batch is None:
-                    continue
-                patches, labels = batch
-                patches, labels = patches.to(device), labels.to(device)
-
-                preds = model(patches)
-                correct += (preds.argmax(1) == labels).sum().item()
-                total += labels.size(0)
-
-        acc = correct / total if total else 0
-        print(f"Epoch {epoch} | TrainLoss {train_loss:.4f} | ValAcc {acc:.4f}")
+    train_ds = make_dataset(train_csv, USE_LABELED_MAPS, cache)
+    val_ds = make_dataset(validation_csv, USE_LABELED_MAPS, cache)
 
-        torch.save(model.state_dict(), f"./{destination_dir}/label_less_classifier_epoch{epoch}.pth")
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if distributed and device.type == "cuda":
+        device = torch.device("cuda", context.local_rank)
+    train_sampler = DistributedSampler(train_ds, shuffle=True, seed=0) if distributed else None
+    # Validation is sharded too, DistributedSampler pads it to a multiple of the world size
+    val_sampler = DistributedSampler(val_ds, shuffle=False) if distributed else None
+    train_loader = make_loader(train_ds, config, device, shuffle=True, sampler=train_sampler)
+    val_loader = make_loader(val_ds, config, device, sampler=val_sampler)
+
+    memory_format = torch.channels_last_3d if config["channels_last"] else torch.contiguous_format
+    model = Motif3DCNN(num_classes=5).to(device, memory_format=memory_format)
+    # Checkpoints are saved from the eager module so their keys load into a plain Motif3DCNN
+    step_model = model
+    if distributed:
+        step_model = DistributedDataParallel(model, device_ids=[device.index] if device.type == "cuda" else None)
+    if config["compile"]:
+        example = torch.zeros(1, 1, 64, 64, 64, device=device).contiguous(memory_format=memory_format)
+        step_model = compile_model(step_model, example)
+    opt = torch.optim.Adam(model.parameters(), lr=config["lr"])
+    loss_fn = nn.CrossEntropyLoss()
+    if main_process:
+        os.makedirs(destination_dir, exist_ok=True)
+        if distributed:
+            print(f"DDP training on {context.world_size} processes ({config['dist_backend']}), "
+                  f"{torch.get_num_threads()} threads each")
+
+    try:
+        for epoch in range(1, config["epochs"] + 1):
+            if train_sampler is not None:
+                train_sampler.set_epoch(epoch)
+            stats = train_epoch(step_model, train_loader, opt, loss_fn, device, memory_format,
+                                config["accumulation_steps"], distributed)
+            loss, samples = distributed_training.all_reduce_sum([stats["loss"], stats["samples"]])
+
+            message = f"Epoch {epoch} | TrainLoss {loss:.4f}"
+            val_s = 0.0
+            if epoch % config["val_every"] == 0 or epoch == config["epochs"]:
+                start = time.perf_counter()
+                correct, total = distributed_training.all_reduce_sum(
+                    validate(step_model, val_loader, device, memory_format))
+                val_s = time.perf_counter() - start
+                message += f" | ValAcc {correct / total if total else 0:.4f}"
+
+            if main_process:
+                # Times are those of rank 0, throughput counts the samples of all ranks
+                train_s = stats["data_s"] + stats["compute_s"]
+                print(f"{message} | data {stats['data_s']:.1f}s compute {stats['compute_s']:.1f}s val {val_s:.1f}s "
+                      f"({100 * stats['data_s'] / train_s if train_s else 0:.0f}% waiting on data, "
+                      f"{samples / train_s if train_s else 0:.1f} samples/s)")
+                torch.save(model.state_dict(),
+                           os.path.join(destination_dir, f"label_less_classifier_epoch{epoch}.pth"))
+    finally:
+        distributed_training.cleanup()
 
 class Motif3DCNN(nn.Module):
     def __init__(self, num_classes):
@@ -295,7 +486,41 @@ def collate_skip_none(batch):
 #         print("Saved", save_path)
 
 if __name__ == "__main__":
-    train_csv=sys.argv[1]
-    val_csv = sys.argv[2]
-    destination_dir = sys.argv[3]
-    train_motif_classifier(train_csv,val_csv,destination_dir)
+    parser = argparse.ArgumentParser(description="Train the Motif3DCNN coarse motif classifier")
+    parser.add_argument("train_csv", help="Training CSV (filepath,label) or motif_shards.py directory")
+    parser.add_argument("val_csv", help="Validation CSV (filepath,label) or motif_shards.py directory")
+    parser.add_argument("destination_dir", help="Directory of the per-epoch .pth checkpoints")
+    parser.add_argument("cache_dir", nargs="?", default=None, help="Preprocessed volume cache (see volume_cache.py)")
+    parser.add_argument("--config", default=None,
+                        help="JSON file with training options (default: \"training\" in configurations/config.json)")
+    parser.add_argument("--epochs", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--workers", dest="num_workers", type=int, default=None, help="DataLoader worker processes")
+    parser.add_argument("--prefetch-factor", type=int, default=None, help="Batches loaded in advance per worker")
+    parser.add_argument("--persistent-workers", action=argparse.BooleanOptionalAction, default=None,
+                        help="Keep DataLoader workers alive between epochs")
+    parser.add_argument("--lr", type=float, default=None, help="Adam learning rate")
+    parser.add_argument("--accumulation-steps", type=int, default=None,
+                        help="Batches whose gradients are accumulated per optimizer step")
+    parser.add_argument("--channels-last", action=argparse.BooleanOptionalAction, default=None,
+                        help="Channels-last-3d memory format for the model and batches")
+    parser.add_argument("--compile", action=argparse.BooleanOptionalAction, default=None,
+                        help="Wrap the model in torch.compile when available")
+    parser.add_argument("--val-every", type=int, default=None, help="Validate every N epochs (and after the last)")
+    parser.add_argument("--dist-backend", default=None, help="torch.distributed backend of DDP runs (gloo)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Torch threads per DDP process (default: the node's cores / its processes)")
+    parser.add_argument("--nproc", type=int, default=1,
+                        help="Start this many DDP processes on this machine (torchrun sets them up otherwise)")
+    args = parser.parse_args()
+
+    options = vars(args)
+    nproc = options.pop("nproc")
+    paths = [options.pop(key) for key in ("train_csv", "val_csv", "destination_dir", "cache_dir")]
+    config = load_training_config(options.pop("config"), **options)
+    if distributed_training.env_context().rank == 0:
+        print("Training options: " + ", ".join(f"{key}={value}" for key, value in config.items()))
+    if nproc > 1:
+        distributed_training.launch_local(train_motif_classifier, nproc, *paths, config=config)
+    else:
+        train_motif_classifier(*paths, config=config)
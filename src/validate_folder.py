@@ -1,8 +1,12 @@
 import os
 import sys
+import csv
+import time
 import random
+import argparse
 import numpy as np
 import inference_single
+from batch_inference import preprocessed, PROB_COLUMNS
 
 COARSE_LABELS = [
     "symmetricloop",
@@ -39,41 +43,9 @@ def extract_true_motif(filepath):
     return "unknown"
 
 
-def confusion_matrix(y_true, y_pred, num_classes):
-    cm = np.zeros((num_classes, num_classes), dtype=int)
-    for t, p in zip(y_true, y_pred):
-        cm[t, p] += 1
-    return cm
-
-
-def sensitivity_specificity(cm):
-    metrics = {}
-
-    for i, label in enumerate(COARSE_LABELS):
-        TP = cm[i, i]
-        FN = cm[i, :].sum() - TP
-        FP = cm[:, i].sum() - TP
-        TN = cm.sum() - (TP + FN + FP)
-
-        sensitivity = TP / (TP + FN + 1e-8)
-        specificity = TN / (TN + FP + 1e-8)
-
-        metrics[label] = {
-            "sensitivity": sensitivity,
-            "specificity": specificity
-        }
-
-    return metrics
-
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python validate_folder.py <folder_path> <checkpoint.pth>")
-        sys.exit(1)
-
-    folder_path = sys.argv[1]
-    checkpoint_path = sys.argv[2]
-
-    MAX_PER_CLASS = 90
+def list_class_files(folder_path, max_per_class=None, seed=None):
+    # (path, label) of the .mrc files in the <folder_path>/<label>/ folders, at most max_per_class random files per class
+    rng = random.Random(seed)
     all_files = []
 
     for label in COARSE_LABELS:
@@ -83,18 +55,19 @@ if __name__ == "__main__":
             print(f"Warning: missing folder {class_dir}")
             continue
 
-        class_files = [
+        # Sorted first so that a seed picks the same files whatever the directory order
+        class_files = sorted(
             os.path.join(class_dir, f)
             for f in os.listdir(class_dir)
             if f.lower().endswith(".mrc")
-        ]
+        )
 
         if len(class_files) == 0:
             print(f"Warning: no .mrc files in {class_dir}")
             continue
 
-        random.shuffle(class_files)
-        class_files = class_files[:MAX_PER_CLASS]
+        rng.shuffle(class_files)
+        class_files = class_files[:max_per_class]
 
         all_files.extend(
             [(path, label) for path in class_files]
@@ -102,53 +75,162 @@ if __name__ == "__main__":
 
         print(f"{label:15s}: using {len(class_files)} files")
 
-    if len(all_files) == 0:
-        print("No .mrc files found in class folders.")
-        sys.exit(1)
+    return all_files
 
-    random.shuffle(all_files)
-    eval_files = all_files
 
-    print(f"Evaluating {len(eval_files)} files...\n")
-
-    model = inference_single.load_model(checkpoint_path)
-
-    y_true = []
-    y_pred = []
-
-    for path, true_label in eval_files:
-        try:
-            vol = inference_single.load_mrc_as_numpy(path)
-            pred_label, _ = inference_single.classify_vol(vol, model)
-
-            y_true.append(LABEL_TO_IDX[true_label])
-            y_pred.append(LABEL_TO_IDX[pred_label])
-
-            print(os.path.basename(path))
-            print(f"  True: {true_label}")
-            print(f"  Pred: {pred_label}")
-            print(f"  Match: {true_label == pred_label}\n")
-
-        except Exception as e:
-            print(f"Error processing {path}: {e}\n")
+def confusion_matrix(y_true, y_pred, num_classes):
+    cm = np.zeros((num_classes, num_classes), dtype=int)
+    np.add.at(cm, (np.asarray(y_true, dtype=int), np.asarray(y_pred, dtype=int)), 1)
+    return cm
 
-    cm = confusion_matrix(y_true, y_pred, NUM_CLASSES)
 
+def sensitivity_specificity(cm):
+    TP = np.diag(cm)
+    FN = cm.sum(axis=1) - TP
+    FP = cm.sum(axis=0) - TP
+    TN = cm.sum() - (TP + FN + FP)
+
+    sensitivity = TP / (TP + FN + 1e-8)
+    specificity = TN / (TN + FP + 1e-8)
+
+    return {
+        label: {"sensitivity": float(sensitivity[i]), "specificity": float(specificity[i])}
+        for i, label in enumerate(COARSE_LABELS)
+    }
+
+
+class RunningMetrics:
+    """Confusion matrix (rows = true, cols = predicted) updated batch by batch."""
+
+    def __init__(self, num_classes=NUM_CLASSES):
+        self.cm = np.zeros((num_classes, num_classes), dtype=int)
+
+    def update(self, y_true, y_pred):
+        np.add.at(self.cm, (np.asarray(y_true, dtype=int), np.asarray(y_pred, dtype=int)), 1)
+
+    @property
+    def total(self):
+        return int(self.cm.sum())
+
+    def accuracy(self):
+        return float(np.trace(self.cm) / self.total) if self.total else 0.0
+
+    def per_class(self):
+        return sensitivity_specificity(self.cm)
+
+    def macro(self):
+        metrics = self.per_class()
+        return (float(np.mean([m["sensitivity"] for m in metrics.values()])),
+                float(np.mean([m["specificity"] for m in metrics.values()])))
+
+    def summary(self):
+        macro_sens, macro_spec = self.macro()
+        return (f"accuracy {self.accuracy():.3f}, macro sensitivity {macro_sens:.3f}, "
+                f"macro specificity {macro_spec:.3f}")
+
+
+PREDICTION_COLUMNS = ["path", "true", "pred", "match"] + PROB_COLUMNS
+
+
+def evaluate(files, model, batch_size=32, workers=os.cpu_count(), cache_dir=None, predictions_path=None,
+             report_every=10, verbose=False):
+    """
+    Classify (path, true label) files in batches while a process pool preprocesses the next
+    ones, updating the confusion matrix as every batch comes in. Per-sample predictions are
+    written to predictions_path (CSV) if given.
+    :return RunningMetrics and the number of files that could not be processed
+    """
+    metrics = RunningMetrics()
+    truths = dict(files)
+    failed = batches = 0
+    start = time.time()
+    predictions = open(predictions_path, "w", newline="") if predictions_path else None
+    writer = csv.DictWriter(predictions, fieldnames=PREDICTION_COLUMNS) if predictions else None
+    if writer:
+        writer.writeheader()
+
+    def run_batch(paths, patches):
+        nonlocal batches
+        labels, probs = inference_single.classify_batch(np.stack(patches), model)
+        metrics.update([LABEL_TO_IDX[truths[path]] for path in paths], [LABEL_TO_IDX[label] for label in labels])
+        for path, label, p in zip(paths, labels, probs):
+            if writer:
+                writer.writerow({"path": path, "true": truths[path], "pred": label, "match": truths[path] == label,
+                                 **{column: f"{value:.6f}" for column, value in zip(PROB_COLUMNS, p)}})
+            if verbose:
+                print(os.path.basename(path))
+                print(f"  True: {truths[path]}")
+                print(f"  Pred: {label}")
+                print(f"  Match: {truths[path] == label}\n")
+        if predictions:
+            predictions.flush()
+        batches += 1
+        if batches % report_every == 0:
+            print(f"[{metrics.total}/{len(files)}] {metrics.total / (time.time() - start):.1f} files/sec, "
+                  f"{metrics.summary()}")
+
+    try:
+        paths, patches = [], []
+        for path, patch, error in preprocessed([path for path, _ in files], workers, cache_dir, 2 * batch_size):
+            if error is not None:
+                print(f"Error processing {path}: {error}\n")
+                failed += 1
+                continue
+            paths.append(path)
+            patches.append(patch)
+            if len(patches) == batch_size:
+                run_batch(paths, patches)
+                paths, patches = [], []
+        if patches:
+            run_batch(paths, patches)
+    finally:
+        if predictions:
+            predictions.close()
+    return metrics, failed
+
+
+def print_report(metrics):
     print("\nConfusion Matrix")
     print("Rows = True, Cols = Pred")
     print("Labels:", COARSE_LABELS)
-    print(cm)
-
-    metrics = sensitivity_specificity(cm)
+    print(metrics.cm)
 
     print("\nPer-class Sensitivity & Specificity:")
-    for label, m in metrics.items():
+    for label, m in metrics.per_class().items():
         print(f"{label:15s} "
               f"Sensitivity: {m['sensitivity']:.3f} "
               f"Specificity: {m['specificity']:.3f}")
 
-    macro_sens = np.mean([m["sensitivity"] for m in metrics.values()])
-    macro_spec = np.mean([m["specificity"] for m in metrics.values()])
+    macro_sens, macro_spec = metrics.macro()
+    print(f"\nAccuracy: {metrics.accuracy():.3f}")
+    print(f"Macro Sensitivity: {macro_sens:.3f}")
+    print(f"Macro Specificity: {macro_spec:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a classifier on a folder of <label>/*.mrc test files")
+    parser.add_argument("folder_path", help="Folder with one sub-folder of .mrc files per class")
+    parser.add_argument("checkpoint", help="Model weights (.pth) or a TorchScript export")
+    parser.add_argument("cache_dir", nargs="?", default=None, help="Preprocessed volume cache (see volume_cache.py)")
+    parser.add_argument("--max-per-class", type=int, default=90, help="Files sampled from every class")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the per-class sampling")
+    parser.add_argument("--batch-size", type=int, default=32, help="Files per forward pass")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Preprocessing worker processes")
+    parser.add_argument("--predictions", default=None, help="CSV of per-sample predictions")
+    parser.add_argument("--verbose", action="store_true", help="Print every prediction")
+    args = parser.parse_args()
+
+    eval_files = list_class_files(args.folder_path, args.max_per_class, args.seed)
+
+    if len(eval_files) == 0:
+        print("No .mrc files found in class folders.")
+        sys.exit(1)
+
+    print(f"Evaluating {len(eval_files)} files...\n")
 
-    print(f"\nMacro Sensitivity: {macro_sens:.3f}")
-    print(f"Macro Specificity: {macro_spec:.3f}")
\ No newline at end of file
+    model = inference_single.load_model(args.checkpoint)
+    start = time.time()
+    metrics, failed = evaluate(eval_files, model, args.batch_size, args.workers, args.cache_dir, args.predictions,
+                               verbose=args.verbose)
+    print(f"\nEvaluated {metrics.total} files ({failed} failed) in {time.time() - start:.0f}s")
+    print_report(metrics)
@@ -0,0 +1,250 @@
+import io
+import os
+import sys
+import csv
+import json
+import glob
+import hashlib
+import tempfile
+import argparse
+import numpy as np
+from mrcfile.mrcinterpreter import MrcInterpreter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import resample_mrc
+
+# Bump whenever preprocess_volume changes so that stale entries are never served
+CACHE_VERSION = 1
+PATCH_SIZE = 64
+NORM_EPS = 1e-6
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "configurations", "config.json")
+
+
+def load_config():
+    try:
+        with open(CONFIG_PATH, "r") as config_file:
+            return json.load(config_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def center_crop(vol, size=PATCH_SIZE, center=None):
+    # size^3 crop around center (the middle voxel by default), zero padded where it leaves the volume
+    c = np.array(vol.shape) // 2 if center is None else np.array(center)
+    half = size // 2
+    vol = np.pad(vol, size, mode="constant")
+    c += size
+    return vol[c[0]-half:c[0]+half,
+               c[1]-half:c[1]+half,
+               c[2]-half:c[2]+half]
+
+
+def preprocess_volume(path, voxel_size=resample_mrc.TARGET_VOXEL, threshold=0, size=PATCH_SIZE):
+    """
+    Resample a density map, z-score it and center crop it to a size^3 float32 patch.
+    This is the preprocessing shared by training, inference and validation.
+    """
+    vol = resample_mrc.resample_mrc(threshold, path, None, voxel_size)
+    return normalize_patch(vol, size)
+
+
+def preprocess_mrc_bytes(payload, voxel_size=resample_mrc.TARGET_VOXEL, threshold=0, size=PATCH_SIZE):
+    """preprocess_volume of an MRC file given as bytes, e.g. received over the network."""
+    with MrcInterpreter(io.BytesIO(payload), permissive=True) as mrc:
+        if mrc.data is None:
+            raise ValueError("No volume data in MRC payload")
+        header = mrc.header
+        vol, _ = resample_mrc.resample_volume(mrc.data, mrc.voxel_size, header.origin,
+                                              (header.nxstart, header.nystart, header.nzstart), threshold, voxel_size)
+    return normalize_patch(vol, size)
+
+
+def normalize_patch(vol, size=PATCH_SIZE):
+    vol = (vol - vol.mean()) / (vol.std() + NORM_EPS)
+    return np.ascontiguousarray(center_crop(vol, size), dtype=np.float32)
+
+
+class VolumeCache:
+    """
+    Content-addressed on-disk cache of preprocessed patches stored as .npy files.
+
+    Entries are keyed by the sha1 of the input file and every preprocessing parameter,
+    so a changed map, parameter or CACHE_VERSION never hits a stale entry. The access
+    time of an entry is its file mtime, and the least recently used entries are evicted
+    once the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, voxel_size=resample_mrc.TARGET_VOXEL,
+                 threshold=0, size=PATCH_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.params = {
+            "voxel_size": voxel_size,
+            "threshold": threshold,
+            "size": size,
+            "normalization": "zscore",
+            "eps": NORM_EPS,
+            "version": CACHE_VERSION,
+        }
+        self._digests = {}
+        self._size = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, cache_dir=None):
+        config = load_config().get("volume_cache", {})
+        cache_dir = cache_dir or config.get("path", "./cache/volumes")
+        max_bytes = int(config.get("max_gb", DEFAULT_MAX_BYTES / 1024 ** 3) * 1024 ** 3)
+        return cls(cache_dir, max_bytes=max_bytes)
+
+    def file_digest(self, path):
+        # Hash each file once per process, re-hash only if it changed on disk
+        st = os.stat(path)
+        stamp = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+        digest = self._digests.get(stamp)
+        if digest is None:
+            h = hashlib.sha1()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+            self._digests[stamp] = digest
+        return digest
+
+    def key(self, path):
+        payload = json.dumps({"input": self.file_digest(path), **self.params}, sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def get(self, path):
+        """Return the preprocessed patch of path, computing and storing it on a miss."""
+        entry = self.entry_path(self.key(path))
+        if os.path.isfile(entry):
+            try:
+                vol = np.load(entry, mmap_mode="r")
+                os.utime(entry)
+                return vol
+            except (OSError, ValueError):
+                # Corrupt or concurrently evicted entry, rebuild it
+                pass
+
+        vol = preprocess_volume(
+            path, self.params["voxel_size"], self.params["threshold"], self.params["size"]
+        )
+        self.put(entry, vol)
+        return vol
+
+    def put(self, entry, vol):
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, vol)
+        os.replace(tmp, entry)
+
+        if self._size is None:
+            self._size = self.total_bytes()
+        else:
+            self._size += os.path.getsize(entry)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        return glob.glob(os.path.join(self.cache_dir, "*", "*.npy"))
+
+    def total_bytes(self):
+        total = 0
+        for entry in self.entries():
+            try:
+                total += os.path.getsize(entry)
+            except OSError:
+                pass
+        return total
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        stats = []
+        for entry in self.entries():
+            try:
+                st = os.stat(entry)
+            except OSError:
+                continue
+            stats.append((st.st_mtime, st.st_size, entry))
+        stats.sort()
+
+        total = sum(size for _, size, _ in stats)
+        for _, size, entry in stats:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(entry)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+
+def list_inputs(source):
+    # A training CSV with a filepath column, or a folder searched recursively for .mrc files
+    if os.path.isfile(source) and source.lower().endswith(".csv"):
+        with open(source, newline="") as csvfile:
+            return [row["filepath"] for row in csv.DictReader(csvfile)]
+    return sorted(glob.glob(os.path.join(source, "**", "*.mrc"), recursive=True))
+
+
+# VolumeCache of a pool worker, set once by init_worker so its size and digests carry over between maps
+_worker_cache = None
+
+
+def init_worker(cache):
+    global _worker_cache
+    _worker_cache = cache
+
+
+def worker_cache():
+    return _worker_cache
+
+
+def _warm_one(path):
+    _worker_cache.get(path)
+    return path
+
+
+def warm_up(cache, paths, workers=os.cpu_count()):
+    done = failed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cache,)) as pool:
+        futures = {pool.submit(_warm_one, path): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done += 1
+            except Exception as e:
+                failed += 1
+                print(f"Failed to preprocess {futures[future]}: {e}")
+    # Workers track their own sizes, enforce the bound once over the whole cache
+    cache.evict()
+    return done, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-populate the preprocessed volume cache")
+    parser.add_argument("sources", nargs="+", help="Training CSVs or folders of .mrc files")
+    parser.add_argument("--cache-dir", default=None, help="Cache directory (default from config.json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    args = parser.parse_args()
+
+    cache = VolumeCache.from_config(args.cache_dir)
+    paths = []
+    for source in args.sources:
+        paths.extend(list_inputs(source))
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        print("No input maps found.")
+        sys.exit(1)
+
+    print(f"Warming {cache.cache_dir} with {len(paths)} maps using {args.workers} workers")
+    done, failed = warm_up(cache, paths, args.workers)
+    print(f"Cached {done} maps, {failed} failed, {cache.total_bytes() / 1024 ** 2:.1f} MB on disk")
@@ -1,56 +1,50 @@
 import os
 import csv
-import subprocess
 import sys
-import re
 
-def getResolution(mrc_file):
-    cmd = ["phenix.mtriage",mrc_file]
-    print(f" Running: {' '.join(cmd)}")
-    result = subprocess.run(cmd,stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    match = re.search(r"Resolution set to \s*([\d\.]+)", result.stdout)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-    if match:
-        resolution = float(match.group(1))
-        return resolution
-    else:
-        print("Could not find resolution in mtriage output.")
-        print(result.stdout)
+from phenix_batch import PhenixRunner, PhenixError, ResolutionCache, CC_COLUMNS
+from motif_jobs import parse_key
+
+#Resolution of the map of an EMDB entry, from the resolution cache. mtriage runs only on a miss and its result is cached
+def getResolution(mrc_file, runner=None, emdb_id=None, cache=None):
+    emdb_id = emdb_id or parse_key(mrc_file)[1]
+    if emdb_id:
+        cache = cache or ResolutionCache.from_config()
+        resolution = cache.get(emdb_id)
+        if resolution is not None:
+            return resolution
+    runner = runner or PhenixRunner.from_config()
+    try:
+        resolution = runner.resolution(mrc_file)
+    except PhenixError as e:
+        print(e)
         return None
+    if resolution is None:
+        print("Could not find resolution in mtriage output.")
+    elif emdb_id:
+        cache.put(emdb_id, resolution, "mtriage")
+    return resolution
     
-def computeZScore( mrc_file="outputMaps/segmentedMap.mrc", pdb_name = "outputPDBs/segmentedPDB.pdb", output_csv="output.csv"):
+def computeZScore( mrc_file="outputMaps/segmentedMap.mrc", pdb_name = "outputPDBs/segmentedPDB.pdb", output_csv="output.csv", runner=None, emdb_id=None, cache=None):
+    runner = runner or PhenixRunner.from_config()
     with open(output_csv, "w", newline="") as outfile:
         writer = csv.writer(outfile)
-        writer.writerow(["resolution", "CC_mask", "CC_volume", "CC_peaks", "CC_box"])
-        resolution = getResolution(mrc_file)
+        writer.writerow(["resolution"] + CC_COLUMNS)
+        resolution = getResolution(mrc_file, runner, emdb_id, cache)
         if not resolution:
             print(f" No resolution found for {pdb_name}")
             return
 
-        cmd = [
-            "phenix.map_model_cc",
-            f"./{pdb_name}",
-            f"./{mrc_file}",
-            f"resolution={resolution}",
-        ]
-
-        print(f" Running: {' '.join(cmd)}")
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-        cc_mask = re.search(r"CC_mask\s*:\s*([0-9.]+)", result.stdout)
-        cc_volume = re.search(r"CC_volume\s*:\s*([0-9.]+)", result.stdout)
-        cc_peaks = re.search(r"CC_peaks\s*:\s*([0-9.]+)", result.stdout)
-        cc_box = re.search(r"CC_box\s*:\s*([0-9.]+)", result.stdout)
+        try:
+            cc = runner.map_model_cc(pdb_name, mrc_file, resolution)
+        except PhenixError as e:
+            print(e)
+            cc = {column: "" for column in CC_COLUMNS}
 
-        writer.writerow([
-            resolution,
-            cc_mask.group(1) if cc_mask else "",
-            cc_volume.group(1) if cc_volume else "",
-            cc_peaks.group(1) if cc_peaks else "",
-            cc_box.group(1) if cc_box else "",
-        ])
-        print(f"{resolution} done — CC_mask={cc_mask.group(1) if cc_mask else 'NA'} \n")
-        print(result.stdout)
+        writer.writerow([resolution] + [cc[column] for column in CC_COLUMNS])
+        print(f"{resolution} done — CC_mask={cc['CC_mask'] or 'NA'} \n")
 
 if sys.argv!=2:
     print("Usage missing folder names python3 zscoreCompute.py <rootDirectory> <csvfile_with_resolutions>")
@@ -0,0 +1,62 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC_DIR)
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample", "EMD-20353_6PJ6_hairpin3_2606")
+SAMPLE_MAP = os.path.join(SAMPLE_DIR, "EMD-20353_6PJ6_hairpin3_2606.mrc")
+SAMPLE_PDB = os.path.join(SAMPLE_DIR, "6PJ6_hairpin3_2606.pdb")
+
+
+@pytest.fixture
+def sample_map():
+    return SAMPLE_MAP
+
+
+@pytest.fixture
+def sample_pdb():
+    return SAMPLE_PDB
+
+
+@pytest.fixture
+def make_checkpoint(tmp_path):
+    # Saves the weights of a seeded random Motif3DCNN and returns the checkpoint path
+    import inference_single
+    import train
+
+    def make(seed=0, name=None):
+        torch.manual_seed(seed)
+        checkpoint = str(tmp_path / (name or f"model{seed}.pth"))
+        torch.save(train.Motif3DCNN(num_classes=inference_single.NUM_CLASSES).state_dict(), checkpoint)
+        return checkpoint
+    return make
+
+
+@pytest.fixture
+def random_model(make_checkpoint):
+    import inference_single
+    return inference_single.load_model(make_checkpoint())
+
+
+@pytest.fixture
+def make_shard_dir():
+    # A single shard of random patches in the motif_shards.py layout
+    import motif_shards
+
+    def make(path, count, seed=0):
+        rng = np.random.default_rng(seed)
+        os.makedirs(path)
+        np.save(os.path.join(path, motif_shards.shard_name(0)),
+                rng.normal(size=(count, 64, 64, 64)).astype(np.float32))
+        pd.DataFrame({
+            "shard": 0, "offset": np.arange(count), "class_id": np.arange(count) % 5, "label": "hairpin",
+            "motif": "hairpin4", "emdb_id": "", "pdb_id": "", "internal_id": "", "resolution": np.nan,
+            "filepath": [f"sample{i}.mrc" for i in range(count)],
+        }).to_csv(os.path.join(path, motif_shards.INDEX_FILE), index=False)
+        return str(path)
+    return make
@@ -0,0 +1,151 @@
+import os
+import sys
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import mrcfile
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import artifact_store
+from segment_engine import DensityMap
+
+SAMPLE_MAP = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "sample",
+    "EMD-20353_6PJ6_hairpin3_2606", "EMD-20353_6PJ6_hairpin3_2606.mrc"
+)
+
+
+def make_files():
+    with open(SAMPLE_MAP, "rb") as f:
+        map_bytes = f.read()
+    return {
+        "/download/6pj6.cif": b"data_6PJ6\n#\n",
+        "/download/1abc.cif": b"data_1ABC\n" + b"#" * 4096 + b"\n",
+        "/emdb/EMD-20353/map/emd_20353.map.gz": gzip.compress(map_bytes),
+    }
+
+
+class StubFileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubFileHandler)
+    httpd.requests = []
+    httpd.files = make_files()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_store(tmp_path, server, **kwargs):
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    return artifact_store.ArtifactStore(
+        str(tmp_path / "store"), rcsb_files_url=f"{url}/download", emdb_files_url=f"{url}/emdb", **kwargs
+    )
+
+
+def test_fetch_reuses_stored_files(tmp_path, server):
+    store = make_store(tmp_path, server)
+    path = store.fetch_structure("6PJ6")
+    assert open(path, "rb").read() == server.files["/download/6pj6.cif"]
+    assert make_store(tmp_path, server).fetch_structure("6pj6") == path
+    assert server.requests == ["/download/6pj6.cif"]
+    assert store.record("PDB/6pj6.cif")["sha256"] == artifact_store.sha256_file(path)
+
+
+def test_corrupt_file_is_fetched_again(tmp_path, server):
+    store = make_store(tmp_path, server)
+    path = store.fetch_structure("6PJ6")
+    with open(path, "r+b") as f:
+        f.write(b"X")
+    assert store.fetch_structure("6PJ6") == path
+    assert open(path, "rb").read() == server.files["/download/6pj6.cif"]
+    assert len(server.requests) == 2
+
+
+def test_checksum_verified_once_per_instance(tmp_path, server, monkeypatch):
+    hashed = []
+    sha256_file = artifact_store.sha256_file
+    monkeypatch.setattr(artifact_store, "sha256_file", lambda path: hashed.append(path) or sha256_file(path))
+    store = make_store(tmp_path, server)
+    path = store.fetch_map("EMD-20353")
+    for _ in range(3):
+        assert store.fetch_map("EMD-20353") == path
+    assert len(hashed) == 1
+
+    other = make_store(tmp_path, server)
+    for _ in range(3):
+        other.fetch_map("EMD-20353")
+    assert len(hashed) == 2
+
+    # A rewritten file is hashed again, and refetched if it no longer matches
+    with open(path, "r+b") as f:
+        f.write(b"X")
+    os.utime(path, ns=(0, 0))
+    assert store.fetch_map("EMD-20353") == path
+    assert open(path, "rb").read() == server.files["/emdb/EMD-20353/map/emd_20353.map.gz"]
+    assert len(server.requests) == 2
+
+
+def test_missing_file_raises(tmp_path, server):
+    store = make_store(tmp_path, server)
+    with pytest.raises(Exception):
+        store.fetch_structure("9ZZZ")
+    assert store.entries() == []
+
+
+def test_lru_eviction(tmp_path, server):
+    store = make_store(tmp_path, server, min_age=0)
+    store.fetch_structure("6PJ6")
+    store.fetch_map("EMD-20353")
+    store.fetch_structure("6PJ6")
+    store.max_bytes = store.total_bytes() - 1
+    store.evict()
+    assert [key for key, _, _ in store.entries()] == ["PDB/6pj6.cif"]
+    assert not os.path.exists(store.path("EMDB/emd_20353.map.gz"))
+
+
+def test_recently_used_entries_are_kept(tmp_path, server):
+    store = make_store(tmp_path, server, max_bytes=1)
+    store.fetch_structure("6PJ6")
+    store.fetch_structure("1ABC")
+    assert len(store.entries()) == 2
+
+
+def test_gzipped_map_is_read_transparently(tmp_path, server):
+    store = make_store(tmp_path, server)
+    gz_path = store.fetch_map("EMD-20353")
+    with mrcfile.open(SAMPLE_MAP) as expected, DensityMap.open(gz_path) as gz_map:
+        np.testing.assert_array_equal(gz_map.data, expected.data)
+
+    map_path = store.fetch_map("EMD-20353", decompress=True)
+    assert gz_path.endswith(".map.gz") and map_path.endswith(".map")
+    with mrcfile.open(SAMPLE_MAP) as expected, DensityMap.open(map_path) as plain_map:
+        np.testing.assert_array_equal(plain_map.data, expected.data)
+    assert server.requests == ["/emdb/EMD-20353/map/emd_20353.map.gz"]
+
+    # Only the decompressed copy is kept, and it is served without fetching the archive again
+    assert [key for key, _, _ in store.entries()] == ["EMDB/emd_20353.map"]
+    assert not os.path.exists(gz_path)
+    assert make_store(tmp_path, server).fetch_map("EMD-20353", decompress=True) == map_path
+    assert server.requests == ["/emdb/EMD-20353/map/emd_20353.map.gz"]
@@ -0,0 +1,87 @@
+import os
+import sys
+import csv
+import json
+import shutil
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import batch_inference
+import inference_single
+import volume_cache
+
+def make_maps(folder, count, sample_map):
+    folder.mkdir()
+    for i in range(count):
+        shutil.copy(sample_map, folder / f"EMD-20353_6PJ6_hairpin3_{i}.mrc")
+    (folder / "EMD-1_1ABC_hairpin3_broken.mrc").write_bytes(b"not a map")
+    return str(folder)
+
+
+def test_list_inputs(tmp_path, sample_map):
+    folder = make_maps(tmp_path / "maps", 2, sample_map)
+    paths = batch_inference.list_inputs(folder)
+    assert len(paths) == 3
+    assert batch_inference.list_inputs(os.path.join(folder, "*_0.mrc")) == [os.path.join(folder, "EMD-20353_6PJ6_hairpin3_0.mrc")]
+
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text(f"pdb_id,map_path,status\n6PJ6,{paths[0]},ok\n6PJ6,,failed\n")
+    assert batch_inference.list_inputs(str(manifest)) == [paths[0]]
+    listing = tmp_path / "maps.txt"
+    listing.write_text("\n".join(paths) + "\n")
+    assert batch_inference.list_inputs(str(listing)) == paths
+
+
+def test_batches_match_single_inference(tmp_path, sample_map, random_model):
+    model = random_model
+    paths = batch_inference.list_inputs(make_maps(tmp_path / "maps", 5, sample_map))
+    expected_label, expected_probs = inference_single.classify_vol(volume_cache.preprocess_volume(sample_map), model)
+
+    output = str(tmp_path / "predictions.csv")
+    assert batch_inference.classify_paths(paths, model, output, batch_size=2, workers=2) == (5, 1)
+    with open(output, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row["path"] for row in rows) == sorted(paths)
+    for row in rows:
+        if row["path"].endswith("broken.mrc"):
+            assert row["label"] == "" and row["error"]
+            continue
+        assert row["label"] == expected_label
+        probs = [float(row[column]) for column in batch_inference.PROB_COLUMNS]
+        np.testing.assert_allclose(probs, expected_probs, atol=1e-5)
+
+    output = str(tmp_path / "predictions.jsonl")
+    batch_inference.classify_paths(paths, model, output, batch_size=4, workers=0)
+    with open(output) as f:
+        records = {record["path"]: record for record in map(json.loads, f)}
+    assert len(records) == 6
+    assert records[paths[-1]]["label"] == expected_label
+    assert sorted(records[paths[-1]]["probabilities"]) == sorted(inference_single.COARSE_LABELS)
+
+
+def test_cache_is_kept_per_worker(tmp_path, sample_map, monkeypatch):
+    paths = batch_inference.list_inputs(make_maps(tmp_path / "maps", 3, sample_map))[1:]
+    for i, path in enumerate(paths):
+        with open(path, "ab") as f:
+            f.write(bytes([i]))
+
+    # Workers are forked, so they log their cache scans to a file
+    log = tmp_path / "scans.log"
+    total_bytes = volume_cache.VolumeCache.total_bytes
+
+    def logged_total_bytes(self):
+        with open(log, "a") as f:
+            f.write("scan\n")
+        return total_bytes(self)
+
+    monkeypatch.setattr(volume_cache.VolumeCache, "total_bytes", logged_total_bytes)
+    expected = volume_cache.preprocess_volume(sample_map)
+    for workers, cache_dir in [(1, tmp_path / "cache1"), (0, tmp_path / "cache0")]:
+        log.write_text("")
+        results = list(batch_inference.preprocessed(paths, workers, str(cache_dir)))
+        assert [path for path, _, _ in results] == paths
+        for _, patch, error in results:
+            assert error is None
+            np.testing.assert_array_equal(patch, expected)
+        assert log.read_text().splitlines() == ["scan"]
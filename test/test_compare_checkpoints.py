@@ -0,0 +1,45 @@
+import os
+import sys
+import csv
+import shutil
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import compare_checkpoints
+import inference_single
+import validate_folder
+import volume_cache
+
+def test_expand_checkpoints_in_epoch_order(tmp_path):
+    for epoch in (1, 2, 10, 9):
+        (tmp_path / f"label_less_classifier_epoch{epoch}.pth").write_bytes(b"")
+    checkpoints = compare_checkpoints.expand_checkpoints([str(tmp_path / "*.pth")])
+    assert [os.path.basename(c) for c in checkpoints] == [
+        f"label_less_classifier_epoch{epoch}.pth" for epoch in (1, 2, 9, 10)]
+
+
+def test_checkpoints_share_preprocessing(tmp_path, monkeypatch, sample_map, make_checkpoint):
+    for label in validate_folder.COARSE_LABELS:
+        (tmp_path / "test" / label).mkdir(parents=True)
+        shutil.copy(sample_map, tmp_path / "test" / label / f"EMD-20353_6PJ6_{label}_1.mrc")
+    checkpoints = [make_checkpoint(seed, f"epoch{seed}.pth") for seed in (0, 1)]
+
+    calls = []
+    preprocess_volume = volume_cache.preprocess_volume
+    monkeypatch.setattr(volume_cache, "preprocess_volume", lambda path: calls.append(path) or preprocess_volume(path))
+    files = validate_folder.list_class_files(str(tmp_path / "test"), seed=0)
+    patches, y_true, paths = compare_checkpoints.load_patches(files, workers=0)
+    output = str(tmp_path / "comparison.csv")
+    rows = compare_checkpoints.compare_checkpoints(checkpoints + [str(tmp_path / "missing.pth")], patches, y_true,
+                                                   batch_size=2, output_csv=output)
+    assert len(calls) == 5 and patches.shape == (5, 64, 64, 64)
+
+    assert [row["checkpoint"] for row in rows] == checkpoints
+    for checkpoint, row in zip(checkpoints, rows):
+        expected, _ = validate_folder.evaluate(files, inference_single.load_model(checkpoint), workers=0)
+        assert row["accuracy"] == expected.accuracy()
+        assert np.isclose(row["macro_sensitivity"], expected.macro()[0])
+    with open(output, newline="") as f:
+        table = list(csv.DictReader(f))
+    assert len(table) == 2 and list(table[0]) == compare_checkpoints.TABLE_COLUMNS
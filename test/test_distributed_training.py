@@ -0,0 +1,60 @@
+import os
+import sys
+import torch
+import torch.distributed as dist
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import distributed_training
+import train
+
+
+def _train_rank(output_dir):
+    # Every rank trains on its own batches, and DDP must keep the replicas identical
+    context = distributed_training.init_distributed("gloo", threads=1)
+    torch.manual_seed(0)
+    model = train.Motif3DCNN(num_classes=5)
+    ddp = torch.nn.parallel.DistributedDataParallel(model)
+    opt = torch.optim.Adam(model.parameters(), lr=1e-3)
+    generator = torch.Generator().manual_seed(context.rank)
+    batches = [(torch.randn(2, 1, 64, 64, 64, generator=generator), torch.tensor([0, context.rank]))
+               for _ in range(3)]
+    batches.insert(context.rank, None)
+    stats = train.train_epoch(ddp, batches, opt, torch.nn.CrossEntropyLoss(), torch.device("cpu"),
+                              torch.contiguous_format, accumulation_steps=2, distributed=True)
+    checksum = [float(sum(p.double().sum() for p in model.parameters())), stats["samples"]]
+    gathered = [None] * context.world_size
+    dist.all_gather_object(gathered, checksum)
+    if context.rank == 0:
+        with open(os.path.join(output_dir, "checksums.txt"), "w") as f:
+            f.write(repr(gathered))
+    distributed_training.cleanup()
+
+
+def test_env_context_single_process(monkeypatch):
+    monkeypatch.delenv("WORLD_SIZE", raising=False)
+    assert distributed_training.init_distributed() == distributed_training.SINGLE_PROCESS
+    assert distributed_training.all_reduce_sum([1.5, 2]) == [1.5, 2]
+
+
+def test_ddp_replicas_stay_in_sync(tmp_path):
+    distributed_training.launch_local(_train_rank, 2, str(tmp_path))
+    (first, samples), (second, other_samples) = eval((tmp_path / "checksums.txt").read_text())
+    assert abs(first - second) < 1e-6
+    assert samples == other_samples == 6
+
+
+def test_ddp_training_checkpoints_on_rank_zero(tmp_path, capfd, make_shard_dir):
+    train_dir = make_shard_dir(tmp_path / "train", 8)
+    val_dir = make_shard_dir(tmp_path / "val", 5, seed=1)
+    destination = str(tmp_path / "models")
+    config = dict(train.TRAINING_DEFAULTS, epochs=2, batch_size=2, num_workers=0, threads=1)
+    distributed_training.launch_local(train.train_motif_classifier, 2, train_dir, val_dir, destination,
+                                      config=config)
+
+    out = capfd.readouterr().out
+    assert out.count("DDP training on 2 processes") == 1
+    assert sum(line.startswith("Epoch") for line in out.splitlines()) == 2
+    assert sorted(os.listdir(destination)) == ["label_less_classifier_epoch1.pth", "label_less_classifier_epoch2.pth"]
+    model = train.Motif3DCNN(num_classes=5)
+    model.load_state_dict(torch.load(os.path.join(destination, "label_less_classifier_epoch2.pth")))
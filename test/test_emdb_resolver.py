@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import emdb_resolver
+
+ENTRIES = {
+    "6pj6": {"rcsb_external_references": [{"id": "EMD-20353", "type": "EMDB"}]},
+    "1abc": {"rcsb_external_references": [{"id": "1ABC", "type": "OTHER"}]},
+}
+
+
+class StubRCSBHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        pdb_id = self.path.rstrip("/").split("/")[-1]
+        self.server.requests.append(pdb_id)
+        if pdb_id == "5xxx":
+            self.send_response(503)
+            self.end_headers()
+            return
+        if pdb_id == "7bad":
+            body = b"<html>Bad gateway</html>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        entry = ENTRIES.get(pdb_id)
+        body = json.dumps(entry or {"status": 404}).encode()
+        self.send_response(200 if entry else 404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubRCSBHandler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_resolver(tmp_path, server, **kwargs):
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/rest/v1/core/entry"
+    return emdb_resolver.EMDBResolver(str(tmp_path / "ids.sqlite"), base_url=base_url, **kwargs)
+
+
+def test_resolve_is_cached(tmp_path, server):
+    resolver = make_resolver(tmp_path, server)
+    assert resolver.resolve("6PJ6") == "EMD-20353"
+    assert resolver.resolve("6pj6") == "EMD-20353"
+    # A new resolver on the same file shares the cache
+    assert make_resolver(tmp_path, server).resolve("6PJ6") == "EMD-20353"
+    assert server.requests == ["6pj6"]
+
+
+def test_prefetch_caches_missing_references(tmp_path, server):
+    resolver = make_resolver(tmp_path, server, workers=4)
+    results = resolver.prefetch(["6PJ6", "1ABC", "9ZZZ", "6pj6"])
+    assert results == {"6PJ6": "EMD-20353", "1ABC": None, "9ZZZ": None}
+    assert sorted(server.requests) == ["1abc", "6pj6", "9zzz"]
+
+    resolver.prefetch(["6PJ6", "1ABC", "9ZZZ"])
+    assert len(server.requests) == 3
+
+
+def test_errors_are_not_cached(tmp_path, server):
+    resolver = make_resolver(tmp_path, server)
+    assert resolver.resolve("5XXX") is None
+    assert resolver.resolve("5XXX") is None
+    assert server.requests.count("5xxx") == 2
+    assert resolver.cached(["5XXX"]) == {}
+
+
+def test_invalid_json_is_not_cached(tmp_path, server):
+    resolver = make_resolver(tmp_path, server, workers=4)
+    assert resolver.prefetch(["7BAD", "6PJ6"]) == {"7BAD": None, "6PJ6": "EMD-20353"}
+    assert resolver.cached(["7BAD"]) == {}
+    resolver.resolve("7BAD")
+    assert server.requests.count("7bad") == 2
+
+
+def test_ttl_expiry(tmp_path, server):
+    make_resolver(tmp_path, server).resolve("6PJ6")
+    resolver = make_resolver(tmp_path, server, ttl=0)
+    assert resolver.resolve("6PJ6") == "EMD-20353"
+    assert server.requests == ["6pj6", "6pj6"]
+
+
+def test_offline_serves_only_from_cache(tmp_path, server):
+    make_resolver(tmp_path, server).resolve("6PJ6")
+    offline = make_resolver(tmp_path, server, ttl=0, offline=True)
+    assert offline.resolve("6PJ6") == "EMD-20353"
+    assert offline.resolve("1ABC") is None
+    assert server.requests == ["6pj6"]
@@ -0,0 +1,78 @@
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import inference_server
+import inference_single
+import volume_cache
+
+def start_server(model, **kwargs):
+    server = inference_server.InferenceServer(("127.0.0.1", 0), model, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, model, f"http://127.0.0.1:{server.server_port}"
+
+
+def npy_bytes(patch):
+    buffer = io.BytesIO()
+    np.save(buffer, patch)
+    return buffer.getvalue()
+
+
+def test_requests_are_batched(random_model):
+    server, model, url = start_server(random_model, max_batch=8, max_wait_ms=200)
+    try:
+        rng = np.random.default_rng(0)
+        patches = rng.normal(size=(8, 64, 64, 64)).astype(np.float32)
+        _, expected = inference_single.classify_batch(patches, model)
+
+        def post(patch):
+            return requests.post(f"{url}/classify", data=npy_bytes(patch),
+                                 headers={"Content-Type": "application/x-npy"}, timeout=60).json()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(post, patches))
+        for result, probs in zip(results, expected):
+            np.testing.assert_allclose([result["probabilities"][label] for label in inference_single.COARSE_LABELS],
+                                       probs, atol=1e-5)
+
+        metrics = requests.get(f"{url}/metrics", timeout=10).json()
+        assert metrics["requests"] == 8 and metrics["samples"] == 8
+        assert metrics["batches"] < 8 and metrics["mean_batch_size"] > 1
+        assert metrics["latency_p99_ms"] >= metrics["latency_p50_ms"] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_paths_bytes_and_errors(tmp_path, random_model, sample_map):
+    server, model, url = start_server(random_model, max_batch=4, max_wait_ms=5)
+    try:
+        label, probs = inference_single.classify_vol(volume_cache.preprocess_volume(sample_map), model)
+
+        result = requests.post(f"{url}/classify", json={"path": sample_map}, timeout=60).json()
+        assert result["label"] == label
+        np.testing.assert_allclose(list(result["probabilities"].values()), probs, atol=1e-5)
+
+        with open(sample_map, "rb") as f:
+            result = requests.post(f"{url}/classify", data=f.read(),
+                                   headers={"Content-Type": "application/octet-stream"}, timeout=60).json()
+        assert result["label"] == label
+
+        results = requests.post(f"{url}/classify", json={"paths": [sample_map] * 3}, timeout=60).json()["results"]
+        assert [r["label"] for r in results] == [label] * 3
+
+        response = requests.post(f"{url}/classify", json={"path": str(tmp_path / "missing.mrc")}, timeout=60)
+        assert response.status_code == 400 and "error" in response.json()
+        response = requests.post(f"{url}/classify", data=npy_bytes(np.zeros((8, 8, 8))),
+                                 headers={"Content-Type": "application/x-npy"}, timeout=60)
+        assert response.status_code == 400
+        assert requests.get(f"{url}/metrics", timeout=10).json()["errors"] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,117 @@
+import os
+import sys
+import numpy as np
+import mrcfile
+import pytest
+from Bio import PDB
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import label
+
+SAMPLE_LABEL_MAPS = {"backbone": label.BACKBONE_ATOMS, "ribose": label.RIBOSE_ATOMS, "sugar": label.BASE_ATOMS}
+
+
+def baseline_label_maps(map_path, pdb_path):
+    # The per-atom loop generate_label_maps replaced, with negative indexes counted as outside the map
+    with mrcfile.open(map_path) as org_map:
+        shape, origin, voxel = org_map.data.shape, org_map.header.origin, org_map.voxel_size
+    maps = {prefix: np.zeros(shape, dtype=np.float32) for prefix in SAMPLE_LABEL_MAPS}
+    outside = set()
+    for atom in PDB.PDBParser(QUIET=True).get_structure("model", pdb_path).get_atoms():
+        x, y, z = atom.get_coord()
+        index = (int(label.get_index(z, origin['z'], voxel['z'])), int(label.get_index(y, origin['y'], voxel['y'])),
+                 int(label.get_index(x, origin['x'], voxel['x'])))
+        for prefix, names in SAMPLE_LABEL_MAPS.items():
+            if atom.get_name() in names:
+                if all(0 <= i < n for i, n in zip(index, shape)):
+                    maps[prefix][index] = 1.0
+                else:
+                    outside.add(index)
+    return maps, len(outside)
+
+
+def move_atoms(pdb_path, output, moves):
+    # Rewrite the coordinates of the ATOM records whose serial number is in moves
+    with open(pdb_path) as f, open(output, "w") as out:
+        for line in f:
+            if line.startswith(("ATOM", "HETATM")) and int(line[6:11]) in moves:
+                line = line[:30] + "".join(f"{c:8.3f}" for c in moves[int(line[6:11])]) + line[54:]
+            out.write(line)
+
+
+def read_label_maps(base_name):
+    maps = {}
+    for prefix in SAMPLE_LABEL_MAPS:
+        with mrcfile.open(f"{prefix}_label_{base_name}.mrc") as mrc:
+            maps[prefix] = mrc.data.copy()
+    return maps
+
+
+def test_hard_labels_match_checked_in_maps(tmp_path, monkeypatch, sample_map, sample_pdb):
+    monkeypatch.chdir(tmp_path)
+    label.generate_label_maps(sample_map, sample_pdb, sample_map)
+    base_name = os.path.splitext(os.path.basename(sample_map))[0]
+    for prefix, labels in read_label_maps(base_name).items():
+        with mrcfile.open(os.path.join(os.path.dirname(sample_map), f"{prefix}_label_{base_name}.mrc")) as expected:
+            np.testing.assert_array_equal(labels, expected.data)
+
+
+def test_hard_labels_match_baseline_loop(tmp_path, monkeypatch, capsys, sample_map, sample_pdb):
+    with mrcfile.open(sample_map) as mrc:
+        shape, origin, voxel = mrc.data.shape, mrc.header.origin, mrc.voxel_size
+    atoms = list(PDB.PDBParser(QUIET=True).get_structure("model", sample_pdb).get_atoms())
+    phosphates = [atom.get_serial_number() for atom in atoms if atom.get_name() == "P"]
+    # One voxel before the first x plane (the old loop wrapped it to the last plane) and one past the last z plane
+    moves = {
+        phosphates[0]: (origin['x'] - voxel['x'], origin['y'] + 5, origin['z'] + 5),
+        phosphates[1]: (origin['x'] + 5, origin['y'] + 5, origin['z'] + shape[0] * voxel['z']),
+    }
+    moved_pdb = str(tmp_path / "moved.pdb")
+    move_atoms(sample_pdb, moved_pdb, moves)
+
+    monkeypatch.chdir(tmp_path)
+    label.generate_label_maps(sample_map, moved_pdb, "moved.mrc")
+    expected, outside = baseline_label_maps(sample_map, moved_pdb)
+    assert outside == 2
+    assert "2 atoms were outside map bounds." in capsys.readouterr().out
+    for prefix, labels in read_label_maps("moved").items():
+        np.testing.assert_array_equal(labels, expected[prefix])
+    assert not read_label_maps("moved")["backbone"][:, :, -1].any()
+
+
+def naive_stamps(positions, voxel, radius, shape, mode, sigma=None):
+    # Every voxel against every atom, with distances to the exact (fractional) atom position
+    volume = np.zeros(shape, dtype=np.float64)
+    grid = np.indices(shape).reshape(3, -1).T
+    for position in positions:
+        dist2 = (((grid - position) * voxel) ** 2).sum(axis=1)
+        weights = np.exp(-dist2 / (2 * (sigma or radius / 2) ** 2)) if mode == "gaussian" else np.ones(len(grid))
+        weights[dist2 > radius ** 2] = 0
+        volume = np.maximum(volume, weights.reshape(shape))
+    return volume
+
+
+@pytest.mark.parametrize("mode,radius,sigma", [("sphere", 1.3, None), ("gaussian", 1.5, None), ("gaussian", 2.0, 0.6)])
+def test_render_stamps_match_naive_loop(mode, radius, sigma):
+    shape = (9, 11, 10)
+    voxel_size = {'x': 0.8, 'y': 0.7, 'z': 0.9}
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(0, 1, size=(25, 3)) * (np.array(shape) - 1)
+    # Atoms on and just past the volume edges, and two overlapping atoms a fraction of a voxel apart
+    positions = np.vstack([positions, [[0, 0, 0], [8.4, 10.6, 9.5], [-0.8, 5, 5], [4, 11.3, 2], [4, 4, 4.2], [4, 4, 4.6]]])
+    rendered = label.render_stamps(positions, voxel_size, radius, shape, mode, sigma, batch=64)
+    expected = naive_stamps(positions, np.array([0.9, 0.7, 0.8]), radius, shape, mode, sigma)
+    assert rendered.dtype == np.float32
+    np.testing.assert_allclose(rendered, expected, atol=1e-6)
+    assert rendered[0, 0, 0] == 1.0
+
+
+def test_stamps_follow_sub_voxel_position():
+    voxel_size = {'x': 1.0, 'y': 1.0, 'z': 1.0}
+    # An atom half a voxel off the grid labels both neighbouring voxels equally
+    rendered = label.render_stamps(np.array([[3.0, 3.0, 3.49]]), voxel_size, 0.6, (7, 7, 7))
+    assert rendered[3, 3, 3] == rendered[3, 3, 4] == 1.0
+    assert rendered.sum() == 2
+    gaussian = label.render_stamps(np.array([[3.0, 3.0, 3.5]]), voxel_size, 2.0, (7, 7, 7), "gaussian")
+    assert gaussian[3, 3, 3] == pytest.approx(gaussian[3, 3, 4])
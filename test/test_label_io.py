@@ -0,0 +1,37 @@
+import os
+import sys
+import numpy as np
+import mrcfile
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import label_io
+
+
+@pytest.mark.parametrize("output_format", ["packed", "sparse"])
+def test_round_trip(tmp_path, monkeypatch, output_format):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    bits = np.zeros((12, 10, 8), dtype=np.uint8)
+    for prefix in label_io.LABEL_PREFIXES:
+        bits[rng.random(bits.shape) < 0.05] |= label_io.LABEL_BITS[prefix]
+
+    with mrcfile.new("map.mrc") as mrc:
+        mrc.set_data(np.zeros(bits.shape, dtype=np.float32))
+        mrc.voxel_size = 0.8
+        mrc.header.origin = (1.0, 2.0, 3.0)
+
+    with mrcfile.open("map.mrc") as org_map:
+        fnames = label_io.write_label_maps(bits, org_map, "map", output_format)
+
+    labels = label_io.load_label_volume(fnames[0])
+    assert labels.shape == bits.shape
+    assert labels.origin.x == pytest.approx(1.0) and labels.origin.z == pytest.approx(3.0)
+    assert labels.voxel_size.y == pytest.approx(0.8)
+    for prefix, flag in label_io.LABEL_BITS.items():
+        expected = (bits & flag) > 0
+        np.testing.assert_array_equal(labels.mask(prefix), expected)
+        assert len(labels.coordinates(prefix)) == expected.sum()
+    np.testing.assert_array_equal(labels.bits, bits)
+    labels.close()
@@ -0,0 +1,79 @@
+import os
+import sys
+import csv
+import shutil
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import mapmodel_cc
+import phenix_batch
+from segment_engine import DensityMap
+
+def grid_points(shape, origin, voxel_size):
+    # (x, y, z) coordinates of every voxel of a (z, y, x) grid
+    z, y, x = np.indices(shape)
+    return np.stack([x, y, z], axis=-1) * voxel_size + origin
+
+
+def random_atoms(rng, count=30, size=24.0):
+    coords = rng.uniform(5, size - 5, size=(count, 3))
+    weights = rng.choice([6.0, 7.0, 8.0, 15.0], size=count)
+    return coords, weights
+
+
+def test_model_map_matches_dense_sum():
+    rng = np.random.default_rng(1)
+    coords, weights = random_atoms(rng)
+    shape, origin, voxel = (30, 28, 26), np.array([0.5, -0.3, 0.2]), np.array([0.9, 0.9, 0.9])
+    resolution = 3.0
+    sigma = mapmodel_cc.SIGMA_FACTOR * resolution
+
+    points = grid_points(shape, origin, voxel)
+    expected = np.zeros(shape)
+    for coord, weight in zip(coords, weights):
+        d2 = ((points - coord) ** 2).sum(axis=-1)
+        expected += np.where(d2 <= (mapmodel_cc.SPLAT_CUTOFF * sigma) ** 2, weight * np.exp(-0.5 * d2 / sigma ** 2), 0)
+    np.testing.assert_allclose(mapmodel_cc.model_map(shape, origin, voxel, coords, weights, resolution), expected)
+
+    radius = mapmodel_cc.mask_radius(resolution)
+    distance = np.sqrt(((points[..., None, :] - coords) ** 2).sum(axis=-1)).min(axis=-1)
+    np.testing.assert_array_equal(mapmodel_cc.molecular_mask(shape, origin, voxel, coords, radius), distance <= radius)
+
+
+def test_correlations():
+    rng = np.random.default_rng(2)
+    coords, weights = random_atoms(rng)
+    shape, origin, voxel = (30, 30, 30), np.zeros(3), np.ones(3) * 0.8
+    calc = mapmodel_cc.model_map(shape, origin, voxel, coords, weights, 3.5)
+
+    perfect = mapmodel_cc.map_model_cc(DensityMap(calc, voxel, origin), coords, weights, 3.5)
+    assert all(abs(value - 1) < 1e-9 for value in perfect.values())
+
+    noisy = DensityMap(calc + rng.normal(scale=calc.std(), size=shape), voxel, origin)
+    fitted = mapmodel_cc.map_model_cc(noisy, coords, weights, 3.5)
+    shifted = mapmodel_cc.map_model_cc(noisy, coords + 2.0, weights, 3.5)
+    assert all(0.3 < value < 1 for value in fitted.values())
+    assert fitted["CC_mask"] > shifted["CC_mask"] + 0.2
+
+
+def test_native_batch(tmp_path, sample_map, sample_pdb):
+    folder = tmp_path / "motifs"
+    folder.mkdir()
+    shutil.copy(sample_map, folder / "EMD-20353_6PJ6_hairpin_1.mrc")
+    shutil.copy(sample_pdb, folder / "6PJ6_hairpin_1.pdb")
+    shutil.copy(sample_map, folder / "EMD-1_1ABC_hairpin_2.mrc")
+    jobs = phenix_batch.list_jobs(str(folder))
+    cache = phenix_batch.ResolutionCache(str(tmp_path / "resolutions.csv"))
+    cache.put("EMD-20353", 3.5, "manual")
+    cache.put("EMD-1", 3.5, "manual")
+    output = str(tmp_path / "cc.csv")
+
+    phenix_batch.run_batch(jobs, output, mapmodel_cc.NativeRunner(), cache, workers=2)
+    with open(output, newline="") as f:
+        rows = {row["key"]: row for row in csv.DictReader(f)}
+    assert rows["EMD-1_1ABC_hairpin_2"]["status"] == "failed"
+    row = rows["EMD-20353_6PJ6_hairpin_1"]
+    assert row["status"] == "ok"
+    assert row == {**row, **mapmodel_cc.compute_cc(sample_pdb, sample_map, 3.5)}
+    assert 0 < float(row["CC_mask"]) < 1
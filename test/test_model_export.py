@@ -0,0 +1,56 @@
+import os
+import sys
+import subprocess
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC_DIR)
+
+import inference_single
+import model_export
+import model_runtime
+
+
+def test_torchscript_matches_eager(tmp_path, make_checkpoint):
+    checkpoint = make_checkpoint()
+    eager = inference_single.load_model(checkpoint)
+    output = str(tmp_path / "model.pt")
+    model_export.export_torchscript(eager, output)
+
+    assert model_runtime.is_torchscript(output)
+    assert not model_runtime.is_torchscript(checkpoint)
+    scripted = inference_single.load_model(output)
+    assert isinstance(scripted, model_runtime.ScriptedClassifier)
+    assert scripted.labels == inference_single.COARSE_LABELS
+
+    patches = np.random.default_rng(0).normal(size=(3, 64, 64, 64)).astype(np.float32)
+    expected_labels, expected = inference_single.classify_batch(patches, eager)
+    labels, probs = scripted.classify_batch(patches)
+    assert labels == expected_labels
+    np.testing.assert_allclose(probs, expected, atol=1e-5)
+    _, probs = inference_single.classify_batch(patches, scripted)
+    np.testing.assert_allclose(probs, expected, atol=1e-5)
+
+
+def test_quantized_parity(tmp_path, random_model):
+    eager = random_model
+    scripted = model_export.export_torchscript(eager, str(tmp_path / "model_int8.pt"), quantize=True)
+    assert scripted.metadata["quantized"]
+
+    samples = [(patch, "hairpin") for patch, _ in model_export.random_samples(10)]
+    report = model_export.parity_check(eager, scripted, samples, batch_size=4)
+    assert report["samples"] == 10
+    assert report["max_prob_diff"] < 0.01
+    assert report["eager_accuracy"] is not None
+
+
+def test_runtime_does_not_import_train(tmp_path, random_model):
+    output = str(tmp_path / "model.pt")
+    model_export.export_torchscript(random_model, output)
+    script = (f"import sys; sys.path.append({SRC_DIR!r}); import numpy as np; import inference_single; "
+              f"model = inference_single.load_model({output!r}); "
+              "print(model.classify_batch(np.zeros((1, 64, 64, 64)))[0][0], 'train' in sys.modules)")
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    label, imported = result.stdout.split()
+    assert label in inference_single.COARSE_LABELS
+    assert imported == "False"
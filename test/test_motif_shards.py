@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import motif_shards
+import volume_cache
+from train import CSV_LABEL_TO_CLASS
+
+
+def test_pack_and_read_round_trip(tmp_path, sample_map):
+    maps = tmp_path / "maps"
+    maps.mkdir()
+    rows = []
+    for i, label in enumerate(["hairpin", "bulge", "symmetricloop", "unknown", "asymmetricloop"]):
+        emdb_id = "EMD-20353" if i % 2 == 0 else "EMD-1"
+        path = maps / f"{emdb_id}_6PJ6_{label}{i}_{i}.mrc"
+        shutil.copy(sample_map, path)
+        rows.append((str(path), label.capitalize()))
+    # A map that fails to preprocess is skipped without shifting the other rows
+    (maps / "EMD-2_1ABC_bulge1_9.mrc").write_bytes(b"not a map")
+    rows.insert(2, (str(maps / "EMD-2_1ABC_bulge1_9.mrc"), "bulge"))
+    csv_file = tmp_path / "train.csv"
+    pd.DataFrame(rows, columns=["filepath", "label"]).to_csv(csv_file, index=False)
+    resolutions = tmp_path / "resolutions.csv"
+    resolutions.write_text("emdb_id,resolution\nEMD-20353,2.8\n")
+
+    output = str(tmp_path / "shards")
+    count, shards = motif_shards.pack_shards(str(csv_file), output, shard_size=2, dtype="float16",
+                                             resolution_csv=str(resolutions), workers=1)
+    assert (count, shards) == (5, 3)
+    assert motif_shards.is_shard_dir(output)
+    assert sorted(f for f in os.listdir(output) if f.endswith(".npy")) == [motif_shards.shard_name(i) for i in range(3)]
+    with open(os.path.join(output, motif_shards.META_FILE)) as f:
+        meta = json.load(f)
+    assert meta["dtype"] == "float16" and meta["num_samples"] == 5 and meta["num_shards"] == 3
+    assert np.load(os.path.join(output, motif_shards.shard_name(2))).shape == (1, 64, 64, 64)
+
+    index = pd.read_csv(os.path.join(output, motif_shards.INDEX_FILE))
+    assert list(index.columns) == motif_shards.INDEX_COLUMNS
+    assert list(zip(index["shard"], index["offset"])) == [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0)]
+    assert "EMD-2_1ABC_bulge1_9.mrc" not in " ".join(index["filepath"])
+    assert list(index["emdb_id"]) == ["EMD-20353", "EMD-1", "EMD-20353", "EMD-1", "EMD-20353"]
+    assert list(index["motif"]) == ["hairpin0", "bulge1", "symmetricloop2", "unknown3", "asymmetricloop4"]
+    np.testing.assert_allclose(index["resolution"].to_numpy(), [2.8, np.nan, 2.8, np.nan, 2.8])
+
+    expected = volume_cache.preprocess_volume(sample_map).astype(np.float16).astype(np.float32)
+    dataset = motif_shards.ShardedMotifDataset(output)
+    assert len(dataset) == 5
+    for i, label in enumerate(index["label"]):
+        patch, class_id = dataset[i]
+        assert patch.dtype == torch.float32 and patch.shape == (1, 64, 64, 64)
+        np.testing.assert_array_equal(patch[0].numpy(), expected)
+        assert int(class_id) == CSV_LABEL_TO_CLASS[label]
+
+    # Memory maps are not pickled into DataLoader workers
+    copy = pickle.loads(pickle.dumps(dataset))
+    assert copy._shards == {} and dataset._shards
+    np.testing.assert_array_equal(copy[4][0].numpy(), dataset[4][0].numpy())
+
+    # Packing through the volume cache gives the same shards, the identical maps share one entry
+    cached = str(tmp_path / "cached_shards")
+    assert motif_shards.pack_shards(str(csv_file), cached, shard_size=2, dtype="float16",
+                                    cache_dir=str(tmp_path / "cache"), workers=1) == (5, 3)
+    for i in range(3):
+        np.testing.assert_array_equal(np.load(os.path.join(cached, motif_shards.shard_name(i))),
+                                      np.load(os.path.join(output, motif_shards.shard_name(i))))
+    assert len(volume_cache.VolumeCache(str(tmp_path / "cache")).entries()) == 1
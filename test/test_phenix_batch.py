@@ -0,0 +1,139 @@
+import os
+import sys
+import csv
+import stat
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import phenix_batch
+import zscoreCompute
+
+MTRIAGE = """
+import os, sys
+with open(os.environ["STUB_LOG"], "a") as log:
+    log.write(sys.argv[1] + "\\n")
+print("Map resolution estimates")
+print("Resolution set to 3.2")
+"""
+
+MAP_MODEL_CC = """
+import sys, time
+if "slow" in sys.argv[1]:
+    time.sleep(5)
+if "broken" in sys.argv[1]:
+    sys.exit("cannot read model")
+print("  CC_mask  : 0.8123")
+print("  CC_volume: 0.7940")
+print("  CC_peaks : 0.6512")
+print("  CC_box   : 0.7001")
+"""
+
+
+def make_stub(path, source):
+    path.write_text(f"#!{sys.executable}\n{source}")
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return str(path)
+
+
+def make_runner(tmp_path, monkeypatch, timeout=60):
+    monkeypatch.setenv("STUB_LOG", str(tmp_path / "mtriage.log"))
+    return phenix_batch.PhenixRunner(mtriage=make_stub(tmp_path / "mtriage", MTRIAGE),
+                                     map_model_cc=make_stub(tmp_path / "map_model_cc", MAP_MODEL_CC),
+                                     timeout=timeout)
+
+
+def make_jobs(folder, names):
+    folder.mkdir()
+    jobs = []
+    for name in names:
+        emdb_id, pdb_id, motif_type, internal_id = name.split("_")
+        (folder / f"{name}.mrc").write_bytes(b"")
+        (folder / f"{pdb_id}_{motif_type}_{internal_id}.pdb").write_text("END\n")
+        jobs.append((str(folder / f"{name}.mrc"), str(folder / f"{pdb_id}_{motif_type}_{internal_id}.pdb")))
+    return jobs
+
+
+def read(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_parsers():
+    assert phenix_batch.parse_resolution("Resolution set to 3.2\n") == 3.2
+    assert phenix_batch.parse_resolution("nothing here") is None
+    cc = phenix_batch.parse_cc("CC_mask  : 0.81\nCC_box   : 0.70\n")
+    assert cc == {"CC_mask": "0.81", "CC_volume": "", "CC_peaks": "", "CC_box": "0.70"}
+
+    entry = {"admin": {}, "structure_determination_list": {"structure_determination": [
+        {"image_processing": [{"final_reconstruction": {"resolution": {"valueOf_": "2.9", "units": "Å"}}}]}]}}
+    assert phenix_batch.find_resolution(entry) == 2.9
+    assert phenix_batch.find_resolution({"admin": {}}) is None
+
+
+def test_batch_resolution_once_per_entry_and_resume(tmp_path, monkeypatch):
+    runner = make_runner(tmp_path, monkeypatch)
+    jobs = make_jobs(tmp_path / "motifs", ["EMD-1_1ABC_hairpin_1", "EMD-1_1ABC_hairpin_2", "EMD-2_2DEF_internal_7"])
+    cache = phenix_batch.ResolutionCache(str(tmp_path / "resolutions.csv"))
+    cache.put("EMD-2", 4.1, "manual")
+    output = str(tmp_path / "cc.csv")
+
+    assert phenix_batch.run_batch(jobs, output, runner, cache, workers=3) == 3
+    rows = {row["key"]: row for row in read(output)}
+    assert {row["status"] for row in rows.values()} == {"ok"}
+    assert rows["EMD-1_1ABC_hairpin_2"]["resolution"] == "3.2"
+    assert rows["EMD-2_2DEF_internal_7"]["resolution"] == "4.1"
+    assert rows["EMD-1_1ABC_hairpin_1"]["CC_mask"] == "0.8123"
+    # mtriage ran once, for the entry that was not cached
+    assert len((tmp_path / "mtriage.log").read_text().splitlines()) == 1
+
+    assert phenix_batch.run_batch(jobs, output, runner, phenix_batch.ResolutionCache(cache.path), workers=3) == 0
+    assert phenix_batch.ResolutionCache(cache.path).get("emd-1") == 3.2
+
+
+def test_timeouts_and_failures(tmp_path, monkeypatch):
+    runner = make_runner(tmp_path, monkeypatch, timeout=1)
+    jobs = make_jobs(tmp_path / "motifs", ["EMD-1_slow_hairpin_1", "EMD-1_broken_hairpin_2", "EMD-1_1ABC_hairpin_3"])
+    output = str(tmp_path / "cc.csv")
+    cache = phenix_batch.ResolutionCache(str(tmp_path / "resolutions.csv"))
+
+    phenix_batch.run_batch(jobs, output, runner, cache, workers=3)
+    status = {row["key"]: row["status"] for row in read(output)}
+    assert status == {"EMD-1_slow_hairpin_1": "timeout", "EMD-1_broken_hairpin_2": "failed",
+                      "EMD-1_1ABC_hairpin_3": "ok"}
+
+
+def test_missing_executable(tmp_path):
+    runner = phenix_batch.PhenixRunner(mtriage=str(tmp_path / "missing"), map_model_cc=str(tmp_path / "missing"))
+    jobs = make_jobs(tmp_path / "motifs", ["EMD-1_1ABC_hairpin_1"])
+    output = str(tmp_path / "cc.csv")
+    phenix_batch.run_batch(jobs, output, runner, phenix_batch.ResolutionCache(str(tmp_path / "res.csv")), workers=1)
+    assert read(output)[0]["status"] == "no_resolution"
+
+
+def test_zscore_resolution_from_cache(tmp_path, monkeypatch):
+    runner = make_runner(tmp_path, monkeypatch)
+    jobs = make_jobs(tmp_path / "motifs", ["EMD-1_1ABC_hairpin_1", "EMD-1_1ABC_hairpin_2"])
+    cache_path = str(tmp_path / "resolutions.csv")
+    for i, (map_path, pdb_path) in enumerate(jobs):
+        output = str(tmp_path / f"zscore{i}.csv")
+        zscoreCompute.computeZScore(map_path, pdb_path, output, runner, cache=phenix_batch.ResolutionCache(cache_path))
+        assert read(output) == [{"resolution": "3.2", "CC_mask": "0.8123", "CC_volume": "0.7940",
+                                 "CC_peaks": "0.6512", "CC_box": "0.7001"}]
+    # mtriage ran for the first motif only, later motifs of the entry read the cache
+    assert len((tmp_path / "mtriage.log").read_text().splitlines()) == 1
+    assert phenix_batch.ResolutionCache(cache_path).get("EMD-1") == 3.2
+
+    # Maps without the EMDB id in their name (segment.py) pass it explicitly
+    cache = phenix_batch.ResolutionCache(cache_path)
+    cache.put("EMD-2", 4.1, "manual")
+    assert zscoreCompute.getResolution(str(tmp_path / "segmentedMap.mrc"), runner, "EMD-2", cache) == 4.1
+    assert len((tmp_path / "mtriage.log").read_text().splitlines()) == 1
+
+
+def test_resolution_cache_defaults_to_the_cache_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(phenix_batch, "REPO_DIR", str(tmp_path))
+    monkeypatch.setattr(phenix_batch, "load_config", lambda: {})
+    cache = phenix_batch.ResolutionCache.from_config()
+    assert cache.path == str(tmp_path / "cache" / "resolutions.csv")
+    cache.put("EMD-1", 3.2, "mtriage")
+    assert phenix_batch.ResolutionCache(cache.path).get("EMD-1") == 3.2
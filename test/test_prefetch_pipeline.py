@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from prefetch_pipeline import Prefetcher
+
+
+class SlowStore:
+    # Writes one file per fetch after a delay, like a download into the artifact store
+    def __init__(self, root, delay=0.05, size=1024, fail=()):
+        self.root = str(root)
+        self.delay = delay
+        self.size = size
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.fetched = []
+
+    def _fetch(self, name):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if name in self.fail:
+                raise OSError(f"download of {name} failed")
+            path = os.path.join(self.root, name)
+            with open(path, "wb") as f:
+                f.write(b"\0" * self.size)
+            with self.lock:
+                self.fetched.append(name)
+            return path
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def fetch_structure(self, pdb_id):
+        return self._fetch(f"{pdb_id}.cif")
+
+    def fetch_map(self, emdb_id, decompress=False):
+        return self._fetch(f"{emdb_id}.map")
+
+
+def make_entries(n):
+    return [(f"P{i}", f"EMD-{i}", i) for i in range(n)]
+
+
+def test_entries_are_yielded_in_order(tmp_path):
+    store = SlowStore(tmp_path)
+    entries = list(Prefetcher(store, make_entries(5), depth=3, min_free_bytes=0))
+    assert [entry.item for entry in entries] == list(range(5))
+    assert all(os.path.isfile(entry.map_path) and entry.error is None for entry in entries)
+
+
+def test_downloads_overlap_processing(tmp_path):
+    store = SlowStore(tmp_path, delay=0.1)
+    prefetcher = Prefetcher(store, make_entries(4), depth=2, workers=2, min_free_bytes=0)
+    start = time.time()
+    for _ in prefetcher:
+        time.sleep(0.2)
+    elapsed = time.time() - start
+    # Sequential would take 4 * (2 * 0.1 + 0.2) = 1.6s
+    assert elapsed < 1.3
+    assert prefetcher.wait_time < 0.5
+
+
+def test_failed_fetch_is_reported(tmp_path):
+    store = SlowStore(tmp_path, fail={"EMD-1.map"})
+    entries = list(Prefetcher(store, make_entries(3), min_free_bytes=0))
+    assert [entry.error is None for entry in entries] == [True, False, True]
+    assert entries[1].map_path is None
+
+
+def test_pending_bytes_limit(tmp_path):
+    store = SlowStore(tmp_path, size=1000)
+    prefetcher = Prefetcher(store, [], depth=4, max_pending_bytes=1500, min_free_bytes=0)
+    done = Future()
+    done.set_result((store.fetch_structure("P0"), store.fetch_map("EMD-0")))
+    running = Future()
+
+    assert prefetcher.has_room(deque())
+    assert prefetcher.has_room(deque([(None, running)]))
+    # 2000 fetched but unprocessed bytes stop new fetches until the entry is consumed
+    assert not prefetcher.has_room(deque([(None, done)]))
+    assert not prefetcher.has_room(deque([(None, running)] * 4))
+
+
+def test_free_disk_limit_fetches_one_entry_at_a_time(tmp_path):
+    store = SlowStore(tmp_path, delay=0.02)
+    prefetcher = Prefetcher(store, make_entries(4), depth=4, workers=4, min_free_bytes=1 << 62)
+    assert [entry.item for entry in prefetcher] == list(range(4))
+    assert store.max_active <= 1
@@ -0,0 +1,54 @@
+import os
+import sys
+import csv
+import shutil
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import qscore_batch
+
+def make_motifs(folder, count, sample_map, sample_pdb):
+    folder.mkdir()
+    for i in range(1, count + 1):
+        shutil.copy(sample_map, folder / f"EMD-20353_6PJ6_hairpin_{i}.mrc")
+        shutil.copy(sample_pdb, folder / f"6PJ6_hairpin_{i}.pdb")
+    return str(folder)
+
+
+def read(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_batch_and_resume(tmp_path, sample_map, sample_pdb):
+    jobs = qscore_batch.list_jobs(make_motifs(tmp_path / "motifs", 3, sample_map, sample_pdb))
+    output = str(tmp_path / "qscores.csv")
+    assert qscore_batch.run_batch(jobs, output, workers=2) == 3
+
+    motifs = read(qscore_batch.motifs_path(output))
+    residues = read(output)
+    assert sorted(row["key"] for row in motifs) == [f"EMD-20353_6PJ6_hairpin_{i}" for i in (1, 2, 3)]
+    assert {row["status"] for row in motifs} == {"ok"}
+    assert len(residues) % 3 == 0 and len(residues) > 0
+    assert len({row["qscore"] for row in motifs}) == 1
+
+    assert qscore_batch.run_batch(jobs, output, workers=2) == 0
+
+    # A run that stopped after writing the residues but before recording the motif
+    qscore_batch.write_rows(qscore_batch.motifs_path(output), qscore_batch.MOTIF_COLUMNS, motifs[:2])
+    assert qscore_batch.run_batch(jobs, output, workers=2) == 1
+    assert len(read(output)) == len(residues)
+    assert len(read(qscore_batch.motifs_path(output))) == 3
+
+
+def test_failed_motifs_are_recorded(tmp_path, sample_map, sample_pdb):
+    folder = make_motifs(tmp_path / "motifs", 2, sample_map, sample_pdb)
+    os.remove(os.path.join(folder, "6PJ6_hairpin_2.pdb"))
+    jobs = qscore_batch.list_jobs(folder)
+    output = str(tmp_path / "qscores.csv")
+    qscore_batch.run_batch(jobs, output, workers=1)
+
+    status = {row["key"]: row["status"] for row in read(qscore_batch.motifs_path(output))}
+    assert status == {"EMD-20353_6PJ6_hairpin_1": "ok", "EMD-20353_6PJ6_hairpin_2": "failed"}
+    assert qscore_batch.run_batch(jobs, output, workers=1) == 0
+    assert qscore_batch.run_batch(jobs, output, workers=1, retry_failed=True) == 1
@@ -0,0 +1,71 @@
+import os
+import sys
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import qscore_engine
+from segment_engine import DensityMap, load_structure
+
+def naive_qscores(density_map, coords, count):
+    # Atom by atom, shell by shell reference of atom_qscores for the first count atoms
+    tree = cKDTree(coords)
+    radii = qscore_engine.shell_radii()
+    data = np.asarray(density_map.data, dtype=np.float64)
+    reference = qscore_engine.reference_gaussian(radii, data.mean(), data.std())
+    n = qscore_engine.POINTS_PER_SHELL
+    scores = []
+    for i, center in enumerate(coords[:count]):
+        u, v = [], []
+        for radius, ref in zip(radii, reference):
+            if radius == 0:
+                points = [center] * n
+            else:
+                for multiple in qscore_engine.CANDIDATE_MULTIPLES:
+                    candidates = center + radius * qscore_engine.sphere_points(n * multiple)
+                    points = [p for p in candidates if tree.query(p)[1] == i][:n]
+                    if len(points) == n:
+                        break
+            for point in points:
+                index = ((point - density_map.origin) / density_map.voxel_size)[::-1]
+                u.append(ndimage.map_coordinates(data, index.reshape(3, 1), order=1, mode="constant")[0])
+                v.append(ref)
+        scores.append(np.corrcoef(u, v)[0, 1])
+    return np.array(scores)
+
+
+def test_matches_naive_implementation(sample_map, sample_pdb):
+    _, coords = qscore_engine.model_atoms(load_structure(sample_pdb))
+    with DensityMap.open(sample_map) as density_map:
+        scores = qscore_engine.atom_qscores(density_map, coords)
+        expected = naive_qscores(density_map, coords, 40)
+    np.testing.assert_allclose(scores[:40], expected, atol=1e-6)
+    assert np.all((scores >= -1) & (scores <= 1))
+
+
+def test_gaussian_atoms_score_high():
+    # Well separated atoms rendered as Gaussians with the reference sigma
+    coords = np.array([[6.0, 6.0, 6.0], [12.0, 7.0, 9.0], [8.0, 13.0, 12.0]])
+    voxel = 0.5
+    grid = np.indices((40, 40, 40)).astype(np.float64) * voxel  # (z, y, x)
+    data = np.zeros((40, 40, 40))
+    for x, y, z in coords:
+        r2 = (grid[2] - x) ** 2 + (grid[1] - y) ** 2 + (grid[0] - z) ** 2
+        data += np.exp(-0.5 * r2 / qscore_engine.REFERENCE_GAUSSIAN_SIGMA ** 2)
+    density_map = DensityMap(data.astype(np.float32), (voxel, voxel, voxel), (0, 0, 0))
+
+    assert np.all(qscore_engine.atom_qscores(density_map, coords) > 0.95)
+
+    noise = DensityMap(np.random.default_rng(0).normal(size=(40, 40, 40)).astype(np.float32),
+                       (voxel, voxel, voxel), (0, 0, 0))
+    assert np.all(np.abs(qscore_engine.atom_qscores(noise, coords)) < 0.8)
+
+
+def test_residue_table(tmp_path, sample_map, sample_pdb):
+    output = tmp_path / "qscores.csv"
+    rows, mean = qscore_engine.compute_qscore(sample_pdb, sample_map, str(output))
+    assert len(rows) == len(output.read_text().splitlines()) - 1
+    assert sum(row["atoms"] for row in rows) == len(qscore_engine.model_atoms(load_structure(sample_pdb))[0])
+    assert 0 < mean < 1
@@ -0,0 +1,71 @@
+import os
+import sys
+import numpy as np
+import mrcfile
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import resample_mrc
+
+SAMPLE_MAP = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "sample",
+    "EMD-20353_6PJ6_hairpin3_2606", "EMD-20353_6PJ6_hairpin3_2606.mrc"
+)
+
+
+@pytest.mark.parametrize("voxel_size", [0.5, 0.7, 1.0, 2.5])
+def test_gather_matches_legacy(tmp_path, voxel_size):
+    legacy = resample_mrc.resample_mrc(
+        0, SAMPLE_MAP, str(tmp_path / "legacy.mrc"), voxel_size, method="legacy"
+    )
+    gather = resample_mrc.resample_mrc(
+        0, SAMPLE_MAP, str(tmp_path / "gather.mrc"), voxel_size, method="gather"
+    )
+    assert gather.shape == legacy.shape
+    assert gather.dtype == np.float32
+    np.testing.assert_allclose(gather, legacy, rtol=1e-5, atol=1e-5)
+
+
+def test_unknown_method(tmp_path):
+    with pytest.raises(ValueError):
+        resample_mrc.resample_mrc(0, SAMPLE_MAP, str(tmp_path / "out.mrc"), method="cubic")
+
+
+@pytest.mark.parametrize("threshold,voxel_size", [(0, 0.5), (0, 1.0), (-1, 0.5)])
+def test_streaming_matches_in_memory(tmp_path, threshold, voxel_size):
+    expected = resample_mrc.resample_mrc(threshold, SAMPLE_MAP, str(tmp_path / "memory.mrc"), voxel_size)
+    shape = resample_mrc.resample_mrc_streaming(
+        threshold, SAMPLE_MAP, str(tmp_path / "stream.mrc"), voxel_size, slab_bytes=64 * 1024
+    )
+    assert shape == expected.shape
+    with mrcfile.open(str(tmp_path / "stream.mrc")) as mrc:
+        np.testing.assert_array_equal(mrc.data, expected)
+
+
+@pytest.mark.parametrize("slab_depth,bins,max_candidates", [(None, 4096, 1 << 20), (3, 16, 4), (1, 8, 1)])
+def test_slab_percentile_matches_numpy(slab_depth, bins, max_candidates):
+    rng = np.random.default_rng(0)
+    with mrcfile.open(SAMPLE_MAP) as mrc:
+        maps = [mrc.data.copy()]
+    # Ties and a constant map need the range narrowing to stop on a single value
+    maps += [rng.integers(0, 4, size=(12, 9, 10)).astype(np.float32), np.zeros((6, 4, 4), dtype=np.float32)]
+    for data in maps:
+        for q in (0, 50, 99, 100):
+            np.testing.assert_allclose(
+                resample_mrc.slab_percentile(data, q, slab_depth, bins, max_candidates), np.percentile(data, q),
+                rtol=1e-6
+            )
+
+
+def test_in_memory_matches_written_map(tmp_path, monkeypatch):
+    written = str(tmp_path / "written.mrc")
+    expected = resample_mrc.resample_mrc(0, SAMPLE_MAP, written)
+
+    monkeypatch.chdir(tmp_path)
+    result = resample_mrc.resample_mrc(0, SAMPLE_MAP, None, with_metadata=True)
+    assert sorted(os.listdir(tmp_path)) == ["written.mrc"]
+    np.testing.assert_array_equal(result.data, expected)
+    with mrcfile.open(written) as mrc:
+        np.testing.assert_allclose(result.origin, mrc.header.origin.tolist(), atol=1e-4)
+        np.testing.assert_allclose(mrc.voxel_size.tolist(), [result.voxel_size] * 3)
@@ -0,0 +1,87 @@
+import os
+import sys
+import csv
+import gzip
+import shutil
+import numpy as np
+import mrcfile
+from Bio import PDB
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import segment_driver
+import segment_engine
+from artifact_store import ArtifactStore
+
+EMDB_IDS = {"6PJ6": "EMD-20353", "2XYZ": "EMD-99999"}
+
+
+def make_store(store_dir, sample_map, sample_pdb, tmp_path):
+    # The sample model as 6pj6.cif and the sample map as emd_20353.map.gz
+    store = ArtifactStore(store_dir)
+    cif = str(tmp_path / "6pj6.cif")
+    io = PDB.MMCIFIO()
+    io.set_structure(PDB.PDBParser(QUIET=True).get_structure("6PJ6", sample_pdb))
+    io.save(cif)
+    store.add("PDB/6pj6.cif", cif)
+    gz = str(tmp_path / "emd_20353.map.gz")
+    with open(sample_map, "rb") as f, gzip.open(gz, "wb") as out:
+        shutil.copyfileobj(f, out)
+    store.add("EMDB/emd_20353.map.gz", gz)
+    return store
+
+
+def offline_download(self, key, url):
+    raise OSError(f"offline, can not download {key}")
+
+
+def test_run_parallel_manifest(tmp_path, monkeypatch, sample_map, sample_pdb):
+    store_dir = str(tmp_path / "store")
+    make_store(store_dir, sample_map, sample_pdb, tmp_path)
+    monkeypatch.setattr(segment_driver, "get_emdb_id_from_pdb", EMDB_IDS.get)
+    monkeypatch.setattr(segment_driver, "prefetch_emdb_ids", lambda pdb_ids: list(pdb_ids))
+    monkeypatch.setattr(ArtifactStore, "download", offline_download)
+
+    csv_path = str(tmp_path / "motifs.csv")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(segment_driver.MOTIF_COLUMNS)
+        writer.writerow(["6PJ6", "/J:85-87", "/J:89-91", "1", "hairpin"])
+        writer.writerow(["6pj6", "/A:1-5", "/A:7-9", "2", "bulge"])
+        writer.writerow(["6PJ6", "J85", "J:89", "3", "1x1"])
+        writer.writerow(["1ABC", "/A:1-5", "/A:7-9", "4", "hairpin"])
+        writer.writerow(["2XYZ", "/A:1-5", "/A:7-9", "5", "hairpin"])
+
+    output_dir = str(tmp_path / "out")
+    manifest_path, records = segment_driver.run_parallel(csv_path, output_dir, workers=1, store_dir=store_dir)
+    assert manifest_path == os.path.join(output_dir, segment_driver.MANIFEST_FILE)
+    with open(manifest_path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == segment_driver.MANIFEST_COLUMNS
+    assert len(rows) == len(records) == 5
+    status = {row["internal_id"]: row for row in rows}
+    assert {key: row["status"] for key, row in status.items()} == {
+        "1": "ok", "2": "empty", "3": "failed", "4": "no_emdb", "5": "failed"}
+    assert status["4"]["emdb_id"] == "" and status["5"]["emdb_id"] == "EMD-99999"
+
+    work = os.path.join(os.path.abspath(output_dir), "work")
+    assert sorted(os.listdir(work)) == ["1ABC", "2XYZ", "6PJ6"]
+    ok = status["1"]
+    assert ok["pdb_id"] == "6PJ6" and ok["emdb_id"] == "EMD-20353"
+    assert ok["map_path"] == os.path.join(work, "6PJ6", "outputMaps", "EMD-20353_6PJ6_hairpin_1.mrc")
+    assert ok["pdb_path"] == os.path.join(work, "6PJ6", "outputPDBs", "6PJ6_hairpin_1.pdb")
+    assert os.path.isfile(ok["pdb_path"])
+    assert status["2"]["map_path"] == "" and status["3"]["map_path"] == ""
+
+    # The written map is the zone and crop of the selected residues
+    structure = segment_engine.load_structure(sample_pdb)
+    coords = np.array([atom.get_coord() for atom in segment_engine.select_atoms(
+        structure, segment_engine.parse_chain_ranges(["/J:85-87", "/J:89-91"]))], dtype=np.float64)
+    with segment_engine.DensityMap.open(sample_map) as density_map:
+        expected, origin = segment_engine.zone_and_crop(density_map, coords)
+    with mrcfile.open(ok["map_path"]) as mrc:
+        np.testing.assert_array_equal(mrc.data, expected)
+        np.testing.assert_allclose(mrc.header.origin.tolist(), origin, atol=1e-3)
+
+    # Workers memory-map the decompressed copy kept in the store
+    assert ArtifactStore(store_dir).lookup("EMDB/emd_20353.map") is not None
@@ -0,0 +1,115 @@
+import os
+import sys
+import numpy as np
+import mrcfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import segment_engine
+
+
+def brute_force_zone(density_map, coords, zone_range):
+    # Every voxel against every atom, then the bounding box of the non-zero voxels
+    data = np.array(density_map.data, dtype=np.float32)
+    grid = np.indices(data.shape).reshape(3, -1).T[:, ::-1]  # (x, y, z) index of every (z, y, x) voxel
+    points = density_map.origin + grid * density_map.voxel_size
+    distance = np.sqrt(((points[:, None, :] - coords[None, :, :]) ** 2).sum(axis=2)).min(axis=1)
+    data[(distance > zone_range).reshape(data.shape)] = 0
+    nonzero = np.argwhere(data != 0)
+    if nonzero.size == 0:
+        return None, None
+    lo, hi = nonzero.min(axis=0), nonzero.max(axis=0) + 1
+    return data[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]], density_map.origin + lo[::-1] * density_map.voxel_size
+
+
+def test_parse_chain_ranges():
+    assert segment_engine.parse_chain_ranges(["/A:10-25,40-52", "C:5"]) == [("A", [(10, 25), (40, 52)]), ("C", [(5, 5)])]
+
+
+def test_select_atoms(sample_pdb):
+    structure = segment_engine.load_structure(sample_pdb)
+    atoms = segment_engine.select_atoms(structure, [("J", [(85, 86), (90, 90)])])
+    expected = [atom for residue in structure[0]["J"] if residue.id[1] in (85, 86, 90) for atom in residue]
+    assert atoms == expected and atoms
+    assert segment_engine.select_atoms(structure, [("A", [(85, 91)])]) == []
+    assert segment_engine.select_atoms(structure, [("J", [(200, 210)])]) == []
+
+
+def test_zone_and_crop_matches_brute_force(sample_map, sample_pdb):
+    structure = segment_engine.load_structure(sample_pdb)
+    coords = np.array([atom.get_coord() for atom in segment_engine.select_atoms(structure, [("J", [(85, 86)])])],
+                      dtype=np.float64)
+    with segment_engine.DensityMap.open(sample_map) as density_map, mrcfile.open(sample_map) as mrc:
+        header_origin = np.array(mrc.header.origin.tolist())
+        voxel = np.array(mrc.voxel_size.tolist())
+        np.testing.assert_allclose(density_map.origin, header_origin)
+
+        for zone_range in (2.0, 5.0):
+            cropped, origin = segment_engine.zone_and_crop(density_map, coords, zone_range)
+            expected, expected_origin = brute_force_zone(density_map, coords, zone_range)
+            assert cropped.dtype == np.float32
+            assert cropped.shape == expected.shape and cropped.shape < mrc.data.shape
+            np.testing.assert_array_equal(cropped, expected)
+            np.testing.assert_allclose(origin, expected_origin)
+            # The crop starts on a voxel of the input grid
+            offset = (origin - header_origin) / voxel
+            np.testing.assert_allclose(offset, np.round(offset), atol=1e-6)
+
+
+def test_empty_and_out_of_map(sample_map, sample_pdb, tmp_path, capsys):
+    structure = segment_engine.load_structure(sample_pdb)
+    with segment_engine.DensityMap.open(sample_map) as density_map:
+        assert segment_engine.zone_and_crop(density_map, np.empty((0, 3))) == (None, None)
+        far = density_map.origin - 100
+        assert segment_engine.zone_and_crop(density_map, far[None, :]) == (None, None)
+
+        output = str(tmp_path / "out.mrc")
+        assert segment_engine.segment_motif(structure, density_map, [("A", [(1, 5)])], output) is None
+        assert "No atoms selected" in capsys.readouterr().out
+        assert not os.path.exists(output)
+
+        # An atom outside the map but within range of its edge keeps only the voxels inside
+        edge = density_map.origin + density_map.voxel_size * np.array(density_map.data.shape[::-1]) / 2
+        edge[0] = density_map.origin[0] - 3.0
+        cropped, origin = segment_engine.zone_and_crop(density_map, edge[None, :])
+        expected, expected_origin = brute_force_zone(density_map, edge[None, :], segment_engine.ZONE_RANGE)
+        assert expected is not None
+        np.testing.assert_array_equal(cropped, expected)
+        np.testing.assert_allclose(origin, expected_origin)
+        assert origin[0] == density_map.origin[0]
+
+
+def test_segment_motif_writes_header(sample_map, sample_pdb, tmp_path):
+    structure = segment_engine.load_structure(sample_pdb)
+    output_map, output_pdb = str(tmp_path / "maps" / "motif.mrc"), str(tmp_path / "pdbs" / "motif.pdb")
+    with segment_engine.DensityMap.open(sample_map) as density_map:
+        assert segment_engine.segment_motif(structure, density_map, [("J", [(87, 89)])], output_map,
+                                            output_pdb) == output_map
+        coords = np.array([a.get_coord() for a in segment_engine.select_atoms(structure, [("J", [(87, 89)])])],
+                          dtype=np.float64)
+        expected, expected_origin = segment_engine.zone_and_crop(density_map, coords)
+
+    with mrcfile.open(output_map) as mrc:
+        np.testing.assert_array_equal(mrc.data, expected)
+        np.testing.assert_allclose(mrc.header.origin.tolist(), expected_origin, atol=1e-3)
+        np.testing.assert_allclose(mrc.voxel_size.tolist(), [0.822] * 3, atol=1e-6)
+        assert (mrc.header.nxstart, mrc.header.nystart, mrc.header.nzstart) == (0, 0, 0)
+    residues = {line[22:26].strip() for line in open(output_pdb) if line.startswith("ATOM")}
+    assert residues == {"87", "88", "89"}
+
+
+def test_origin_from_nstart(tmp_path):
+    # Maps without a header origin are placed at nstart * voxel size, like ChimeraX
+    path = str(tmp_path / "nstart.mrc")
+    data = np.zeros((10, 12, 14), dtype=np.float32)
+    data[5, 6, 7] = 1.0
+    with mrcfile.new(path) as mrc:
+        mrc.set_data(data)
+        mrc.voxel_size = 1.5
+        mrc.header.nxstart, mrc.header.nystart, mrc.header.nzstart = 2, -4, 6
+    with segment_engine.DensityMap.open(path) as density_map:
+        np.testing.assert_allclose(density_map.origin, [3.0, -6.0, 9.0])
+        atom = density_map.origin + np.array([7, 6, 5]) * 1.5
+        cropped, origin = segment_engine.zone_and_crop(density_map, atom[None, :], 1.0)
+    assert cropped.shape == (1, 1, 1)
+    np.testing.assert_allclose(origin, atom)
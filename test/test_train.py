@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import pytest
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import train
+
+
+def test_load_training_config(tmp_path):
+    config = train.load_training_config(batch_size=16, num_workers=None)
+    assert config["batch_size"] == 16
+    assert config["num_workers"] == train.TRAINING_DEFAULTS["num_workers"]
+
+    path = tmp_path / "training.json"
+    path.write_text(json.dumps({"training": {"accumulation_steps": 4, "compile": True}}))
+    config = train.load_training_config(str(path), compile=False)
+    assert config["accumulation_steps"] == 4
+    assert config["compile"] is False
+
+    path.write_text(json.dumps({"batchsize": 8}))
+    with pytest.raises(ValueError):
+        train.load_training_config(str(path))
+
+
+def test_make_loader_options():
+    dataset = list(range(8))
+    config = dict(train.TRAINING_DEFAULTS, num_workers=2, prefetch_factor=4)
+    loader = train.make_loader(dataset, config, torch.device("cpu"))
+    assert loader.persistent_workers and loader.prefetch_factor == 4
+    assert not loader.pin_memory
+
+    loader = train.make_loader(dataset, dict(config, num_workers=0), torch.device("cpu"))
+    assert not loader.persistent_workers
+
+
+@pytest.mark.parametrize("num_workers", [0, 1])
+def test_train_motif_classifier(tmp_path, capsys, make_shard_dir, num_workers):
+    train_dir = make_shard_dir(tmp_path / "train", 6)
+    val_dir = make_shard_dir(tmp_path / "val", 3, seed=1)
+    destination = str(tmp_path / "models")
+    config = dict(train.TRAINING_DEFAULTS, epochs=2, batch_size=2, num_workers=num_workers,
+                  accumulation_steps=2, val_every=2)
+    train.train_motif_classifier(train_dir, val_dir, destination, config=config)
+
+    lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith("Epoch")]
+    assert len(lines) == 2
+    assert "ValAcc" not in lines[0] and "ValAcc" in lines[1]
+    assert "waiting on data" in lines[1]
+
+    model = train.Motif3DCNN(num_classes=5)
+    model.load_state_dict(torch.load(os.path.join(destination, "label_less_classifier_epoch2.pth")))
+
+
+def test_train_epoch_accumulates_gradients():
+    torch.manual_seed(0)
+    model = train.Motif3DCNN(num_classes=5)
+    opt = torch.optim.SGD(model.parameters(), lr=0.1)
+    batches = [(torch.randn(2, 1, 64, 64, 64), torch.tensor([0, 1])) for _ in range(3)]
+    steps = []
+    opt.step = lambda: steps.append(1)
+    stats = train.train_epoch(model, batches + [None], opt, torch.nn.CrossEntropyLoss(), torch.device("cpu"),
+                              torch.channels_last_3d, accumulation_steps=2)
+    # One step after two batches and one for the remaining batch
+    assert len(steps) == 2
+    assert stats["samples"] == 6
+    assert stats["data_s"] >= 0 and stats["compute_s"] > 0
+
+
+class FailingOnCall(torch.nn.Module):
+    # Stands in for a compiled module whose backend fails on the first forward
+    def forward(self, x):
+        raise RuntimeError("backend compiler failed")
+
+
+def test_compile_failure_on_first_call_trains_eagerly(tmp_path, capsys, make_shard_dir, monkeypatch):
+    monkeypatch.setattr(torch, "compile", lambda model: FailingOnCall())
+    torch.manual_seed(0)
+    model = train.Motif3DCNN(num_classes=5)
+    state = {key: value.clone() for key, value in model.state_dict().items()}
+    assert train.compile_model(model, torch.zeros(1, 1, 64, 64, 64)) is model
+    assert "training eagerly" in capsys.readouterr().out
+
+    train_dir = make_shard_dir(tmp_path / "train", 4)
+    config = dict(train.TRAINING_DEFAULTS, epochs=1, batch_size=2, num_workers=0, compile=True)
+    train.train_motif_classifier(train_dir, train_dir, str(tmp_path / "models"), config=config)
+    out = capsys.readouterr().out
+    assert "torch.compile failed, training eagerly: backend compiler failed" in out
+    assert any(line.startswith("Epoch 1") for line in out.splitlines())
+
+    # The warm-up step leaves the weights and gradients as they were
+    monkeypatch.setattr(torch, "compile", lambda model: model)
+    assert train.compile_model(model, torch.randn(1, 1, 64, 64, 64)) is model
+    assert all(torch.equal(value, state[key]) for key, value in model.state_dict().items())
+    assert all(p.grad is None for p in model.parameters()) and model.training
@@ -0,0 +1,68 @@
+import os
+import sys
+import csv
+import shutil
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import inference_single
+import validate_folder
+import volume_cache
+
+def make_test_folder(folder, per_class, sample_map):
+    for label in validate_folder.COARSE_LABELS:
+        (folder / label).mkdir(parents=True)
+        for i in range(per_class):
+            shutil.copy(sample_map, folder / label / f"EMD-20353_6PJ6_{label}_{i}.mrc")
+    return str(folder)
+
+
+def test_confusion_matrix_and_metrics():
+    rng = np.random.default_rng(0)
+    y_true, y_pred = rng.integers(0, 5, 200), rng.integers(0, 5, 200)
+    expected = np.zeros((5, 5), dtype=int)
+    for t, p in zip(y_true, y_pred):
+        expected[t, p] += 1
+    np.testing.assert_array_equal(validate_folder.confusion_matrix(y_true, y_pred, 5), expected)
+
+    running = validate_folder.RunningMetrics()
+    for start in range(0, 200, 32):
+        running.update(y_true[start:start + 32], y_pred[start:start + 32])
+    np.testing.assert_array_equal(running.cm, expected)
+    assert running.accuracy() == np.mean(y_true == y_pred)
+    hairpin = running.per_class()["hairpin"]
+    assert abs(hairpin["sensitivity"] - expected[2, 2] / expected[2].sum()) < 1e-6
+
+
+def test_seeded_sampling(tmp_path, sample_map):
+    folder = make_test_folder(tmp_path / "test", 6, sample_map)
+    first = validate_folder.list_class_files(folder, 3, seed=7)
+    assert len(first) == 15
+    assert validate_folder.list_class_files(folder, 3, seed=7) == first
+    assert validate_folder.list_class_files(folder, 3, seed=8) != first
+
+
+def test_evaluate_streams_predictions(tmp_path, sample_map, random_model):
+    folder = make_test_folder(tmp_path / "test", 2, sample_map)
+    os.remove(os.path.join(folder, "bulge", "EMD-20353_6PJ6_bulge_1.mrc"))
+    (tmp_path / "test" / "bulge" / "EMD-1_1ABC_bulge_broken.mrc").write_bytes(b"broken")
+    model = random_model
+    predicted, _ = inference_single.classify_vol(volume_cache.preprocess_volume(sample_map), model)
+
+    files = validate_folder.list_class_files(folder, seed=0)
+    predictions = str(tmp_path / "predictions.csv")
+    metrics, failed = validate_folder.evaluate(files, model, batch_size=3, workers=2, predictions_path=predictions)
+    assert failed == 1 and metrics.total == 9
+
+    expected = np.zeros((5, 5), dtype=int)
+    for label in validate_folder.COARSE_LABELS:
+        expected[validate_folder.LABEL_TO_IDX[label], validate_folder.LABEL_TO_IDX[predicted]] = 2
+    expected[validate_folder.LABEL_TO_IDX["bulge"], validate_folder.LABEL_TO_IDX[predicted]] = 1
+    np.testing.assert_array_equal(metrics.cm, expected)
+
+    with open(predictions, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 9
+    assert {row["pred"] for row in rows} == {predicted}
+    assert sum(row["match"] == "True" for row in rows) == np.trace(expected)
@@ -0,0 +1,102 @@
+import os
+import sys
+import shutil
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import volume_cache
+
+SAMPLE_MAP = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "sample",
+    "EMD-20353_6PJ6_hairpin3_2606", "EMD-20353_6PJ6_hairpin3_2606.mrc"
+)
+
+
+def test_cache_hit_matches_preprocessing(tmp_path):
+    cache = volume_cache.VolumeCache(str(tmp_path / "cache"))
+    expected = volume_cache.preprocess_volume(SAMPLE_MAP)
+
+    first = cache.get(SAMPLE_MAP)
+    second = cache.get(SAMPLE_MAP)
+    assert len(cache.entries()) == 1
+    assert isinstance(second, np.memmap)
+    np.testing.assert_array_equal(first, expected)
+    np.testing.assert_array_equal(second, expected)
+
+
+def test_key_changes_with_parameters_and_content(tmp_path):
+    path = str(tmp_path / "map.mrc")
+    shutil.copy(SAMPLE_MAP, path)
+    cache = volume_cache.VolumeCache(str(tmp_path / "cache"))
+    other = volume_cache.VolumeCache(str(tmp_path / "cache"), threshold=0.5)
+    key = cache.key(path)
+    assert other.key(path) != key
+
+    with open(path, "ab") as f:
+        f.write(b"\0")
+    assert cache.key(path) != key
+
+
+def test_lru_eviction(tmp_path):
+    paths = []
+    for i in range(3):
+        path = str(tmp_path / f"map{i}.mrc")
+        shutil.copy(SAMPLE_MAP, path)
+        with open(path, "ab") as f:
+            f.write(bytes([i]))
+        paths.append(path)
+
+    entry_bytes = volume_cache.PATCH_SIZE ** 3 * 4 + 128
+    cache = volume_cache.VolumeCache(str(tmp_path / "cache"), max_bytes=2 * entry_bytes)
+    cache.get(paths[0])
+    cache.get(paths[1])
+    os.utime(cache.entry_path(cache.key(paths[1])), (1, 1))
+    cache.get(paths[2])
+
+    remaining = set(cache.entries())
+    assert len(remaining) == 2
+    assert cache.entry_path(cache.key(paths[1])) not in remaining
+
+
+def test_warm_up_scans_the_cache_once_per_worker(tmp_path, monkeypatch):
+    paths = []
+    for i in range(4):
+        path = str(tmp_path / f"map{i}.mrc")
+        shutil.copy(SAMPLE_MAP, path)
+        with open(path, "ab") as f:
+            f.write(bytes([i]))
+        paths.append(path)
+
+    # Workers are forked, so they log their scans to a file
+    log = tmp_path / "scans.log"
+    total_bytes = volume_cache.VolumeCache.total_bytes
+
+    def logged_total_bytes(self):
+        with open(log, "a") as f:
+            f.write("scan\n")
+        return total_bytes(self)
+
+    monkeypatch.setattr(volume_cache.VolumeCache, "total_bytes", logged_total_bytes)
+    cache = volume_cache.VolumeCache(str(tmp_path / "cache"))
+    assert volume_cache.warm_up(cache, paths, workers=1) == (4, 0)
+    assert len(cache.entries()) == 4
+    assert log.read_text().splitlines() == ["scan"]
+
+
+def test_training_and_inference_share_preprocessing():
+    import inference_single
+    import train
+
+    expected = volume_cache.preprocess_volume(SAMPLE_MAP)
+    np.testing.assert_array_equal(inference_single.load_mrc_as_numpy(SAMPLE_MAP), expected)
+
+    vol = np.random.default_rng(0).normal(size=(70, 40, 90)).astype(np.float32)
+    center = np.array(vol.shape) // 2
+    np.testing.assert_array_equal(train.CryoVoxelMotifDataset.extract_patch(None, vol, *center, 64),
+                                  volume_cache.center_crop(vol))
+    # Off-centre crops are zero padded where they leave the volume
+    patch = volume_cache.center_crop(vol, 64, (0, 20, 89))
+    assert patch.shape == (64, 64, 64)
+    np.testing.assert_array_equal(patch[32:, 12:52, :33], vol[:32, :, 57:])
+    assert not patch[:32].any()